@@ -0,0 +1,121 @@
+# -*- coding: utf-8 -*-
+# Minimal MaxMind DB (format 2.0) writer, just enough to build tiny GeoLite2-City /
+# GeoLite2-ASN look-alikes so the benchmarks run without the real databases.
+# https://maxmind.github.io/MaxMind-DB/
+import ipaddress
+import struct
+import time
+
+
+def _control(type_id: int, size: int) -> bytes:
+    if size < 29:
+        size_bits, extra = size, b''
+    elif size < 285:
+        size_bits, extra = 29, bytes([size - 29])
+    elif size < 65821:
+        size_bits, extra = 30, struct.pack('>H', size - 285)
+    else:
+        size_bits, extra = 31, struct.pack('>I', size - 65821)[1:]
+    if type_id <= 7:
+        return bytes([(type_id << 5) | size_bits]) + extra
+    return bytes([size_bits, type_id - 7]) + extra
+
+
+# metadata fields must use these exact types
+class Uint16(int):
+    pass
+
+
+class Uint64(int):
+    pass
+
+
+def encode(value) -> bytes:
+    if isinstance(value, (Uint16, Uint64)):
+        data = value.to_bytes((value.bit_length() + 7) // 8, 'big') if value else b''
+        return _control(5 if isinstance(value, Uint16) else 9, len(data)) + data
+    if isinstance(value, bool):
+        return _control(14, int(value))
+    if isinstance(value, str):
+        data = value.encode('utf-8')
+        return _control(2, len(data)) + data
+    if isinstance(value, float):
+        return _control(3, 8) + struct.pack('>d', value)
+    if isinstance(value, int):
+        data = value.to_bytes((value.bit_length() + 7) // 8, 'big') if value else b''
+        type_id = 6 if value < 2 ** 32 else 9
+        return _control(type_id, len(data)) + data
+    if isinstance(value, dict):
+        return _control(7, len(value)) + b''.join(encode(k) + encode(v) for k, v in value.items())
+    if isinstance(value, list):
+        return _control(11, len(value)) + b''.join(encode(v) for v in value)
+    raise TypeError(value)
+
+
+def write_mmdb(path: str, database_type: str, networks: dict):
+    """ Write an IPv6-tree, 24-bit-record MaxMind DB with `networks` (cidr -> record dict),
+    the networks must not overlap """
+    root = [None, None]
+    for cidr, record in networks.items():
+        network = ipaddress.ip_network(cidr)
+        # IPv4 networks live under ::/96 in an IPv6 tree
+        bits = network.prefixlen + (96 if network.version == 4 else 0)
+        address = int(network.network_address)
+        node = root
+        for depth in range(bits):
+            bit = (address >> (127 - depth)) & 1
+            if depth == bits - 1:
+                node[bit] = ('data', record)
+            else:
+                if not isinstance(node[bit], list):
+                    node[bit] = [None, None]
+                node = node[bit]
+
+    nodes = []
+    queue = [root]
+    index = {}
+    while queue:
+        node = queue.pop(0)
+        index[id(node)] = len(nodes)
+        nodes.append(node)
+        for child in node:
+            if isinstance(child, list):
+                queue.append(child)
+    node_count = len(nodes)
+
+    data = bytearray()
+    offsets = {}
+
+    def record_value(child):
+        if child is None:
+            return node_count
+        if isinstance(child, list):
+            return index[id(child)]
+        key = id(child[1])
+        if key not in offsets:
+            offsets[key] = len(data)
+            data.extend(encode(child[1]))
+        return node_count + 16 + offsets[key]
+
+    tree = bytearray()
+    for node in nodes:
+        left, right = record_value(node[0]), record_value(node[1])
+        tree.extend(left.to_bytes(3, 'big') + right.to_bytes(3, 'big'))
+
+    metadata = {
+        'node_count': node_count,
+        'record_size': Uint16(24),
+        'ip_version': Uint16(6),
+        'database_type': database_type,
+        'languages': ['en'],
+        'binary_format_major_version': Uint16(2),
+        'binary_format_minor_version': Uint16(0),
+        'build_epoch': Uint64(int(time.time())),
+        'description': {'en': 'synthetic benchmark database'},
+    }
+    with open(path, 'wb') as handle:
+        handle.write(bytes(tree))
+        handle.write(b'\x00' * 16)
+        handle.write(bytes(data))
+        handle.write(b'\xab\xcd\xefMaxMind.com')
+        handle.write(encode(metadata))
@@ -0,0 +1,337 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+""" Offline microbenchmarks for the per-row enrichment hot path.
+
+Runs every enrichment step on synthetic rows (see synthetic.py) against tiny generated
+GeoLite2 look-alike databases, then the full `sent_to_es` transform against a stubbed
+OpenSearch client and into the gzip file sink, and how long a fresh process takes to import the shipper and enrich its
+first row. Prints ns/op per function, rows/sec for the transform and ms for the startup,
+saves the results as JSON and optionally compares them with an earlier run:
+
+    python benchmarks/run.py
+    python benchmarks/run.py --compare benchmarks/results/baseline.json --max-regression 0.15
+"""
+import argparse
+import contextlib
+import importlib.util
+import io
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+import typing as t
+from datetime import datetime
+
+BENCHMARKS_DIR = os.path.dirname(os.path.abspath(__file__))
+SRC_DIR = os.path.join(os.path.dirname(BENCHMARKS_DIR), 'src')
+RESULTS_DIR = os.path.join(BENCHMARKS_DIR, 'results')
+
+sys.path.insert(0, SRC_DIR)
+
+import synthetic  # noqa: E402
+
+
+# a stand-in for the OpenSearch client that accepts every document of a `_bulk` request
+class StubOpenSearch:
+    def __init__(self):
+        self.requests = 0
+        self.documents = 0
+
+    def bulk(self, body: str, **kwargs) -> dict:
+        count = body.count('\n') // 2
+        self.requests += 1
+        self.documents += count
+        return {'errors': False, 'items': [{'index': {'status': 201}}] * count}
+
+
+def load_shipper(db_dir: str, state_dir: str):
+    """ Import src/pull-traffics.py with the synthetic databases and in-process enrichment """
+    os.environ['GEOIP_DB_DIR'] = db_dir
+    os.environ['LOG_STATE_DIR'] = state_dir
+    os.environ['ENRICH_WORKERS'] = '0'
+    os.environ.setdefault('LOG_LEVEL', 'WARNING')
+    os.environ.setdefault('CLOUDFLARE_ZONE', 'benchmark-zone')
+    os.environ.setdefault('CLOUDFLARE_ACCOUNT', 'benchmark-account')
+    spec = importlib.util.spec_from_file_location('pull_traffics', os.path.join(SRC_DIR, 'pull-traffics.py'))
+    shipper = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(shipper)
+    return shipper
+
+
+def measure(function: t.Callable, inputs: t.Sequence, repeat: int,
+            setup: t.Callable | None = None, warmup: bool = True) -> dict:
+    """ Best-of-`repeat` time of calling `function` once per input, in ns per call.
+    `setup` runs untimed before every pass, e.g. to empty a cache """
+    if warmup:
+        if setup is not None:
+            setup()
+        for value in inputs:
+            function(value)
+
+    best = None
+    for _ in range(repeat):
+        if setup is not None:
+            setup()
+        started_at = time.perf_counter_ns()
+        for value in inputs:
+            function(value)
+        elapsed = time.perf_counter_ns() - started_at
+        best = elapsed if best is None else min(best, elapsed)
+    return {'ns_per_op': best / len(inputs), 'ops': len(inputs)}
+
+
+def merge_chain(merge_two_dicts: t.Callable, rows: t.List[dict], shipper) -> t.Callable:
+    """ The five merge_two_dicts calls enrich_row makes per row, with realistic operands """
+    from library import iohelper
+
+    sample = rows[0]['dimensions']
+    query = iohelper.parse_client_request_query_string(sample['clientRequestQuery'])
+    agent = iohelper.parse_browser_agent(sample['userAgent'])
+    referer = iohelper.parse_client_referer_url_string(sample['clientRequestReferer'])
+    geo = {'clientRequest_geoip_' + key: value
+           for key, value in shipper.enrichment.geoinfo().get_ip_info(sample['clientIP']).items()}
+    batch = {'log_pull_batch_name': 'benchmark', 'count': 1, 'sum_visits': 1, 'accountTag': 'a', 'zoneTag': 'z'}
+
+    def chain(dimensions: dict):
+        item_data = merge_two_dicts(dimensions, query)
+        item_data = merge_two_dicts(item_data, agent)
+        item_data = merge_two_dicts(item_data, referer)
+        item_data = merge_two_dicts(item_data, geo)
+        return merge_two_dicts(item_data, batch)
+
+    return chain
+
+
+def run_functions(shipper, rows: t.List[dict], repeat: int) -> t.Dict[str, dict]:
+    from library import iohelper
+    from library.geoinfo import GeoInfo
+
+    dimensions = [row['dimensions'] for row in rows]
+    agents = [item['userAgent'] for item in dimensions]
+    unique_agents = synthetic.unique_user_agents(len(rows), seed=7)
+    referers = [item['clientRequestReferer'] for item in dimensions]
+    queries = [item['clientRequestQuery'] for item in dimensions]
+    countries = [item['clientCountryName'] for item in dimensions]
+    addresses = [item['clientIP'] for item in dimensions]
+    ua_cache_size = shipper.UA_CACHE_SIZE
+    db_dir = shipper.GEOIP_DB_DIR
+    context = {'batch_name': 'benchmark', 'index_prefix_name': 'cloudflare-requests-',
+               'account': 'benchmark-account', 'zone': 'benchmark-zone'}
+
+    def empty_url_cache():
+        iohelper.parse_url_values.cache_clear()
+
+    geoinfo = GeoInfo(db_dir)
+    cold_geoinfo = []
+
+    def fresh_geoinfo():
+        cold_geoinfo[:] = [GeoInfo(db_dir)]
+
+    benchmarks = {
+        'parse_browser_agent[repeated]': lambda: measure(
+            iohelper.parse_browser_agent, agents, repeat),
+        'parse_browser_agent[unique]': lambda: measure(
+            iohelper.parse_browser_agent, unique_agents, repeat,
+            setup=lambda: iohelper.set_user_agent_cache_size(ua_cache_size)),
+        'parse_url[uncached]': lambda: measure(
+            iohelper.parse_url, referers, repeat, setup=empty_url_cache),
+        'parse_client_referer_url_string': lambda: measure(
+            iohelper.parse_client_referer_url_string, referers, repeat),
+        'parse_client_request_query_string': lambda: measure(
+            iohelper.parse_client_request_query_string, queries, repeat),
+        'normalize_country': lambda: measure(
+            iohelper.normalize_country, countries, repeat),
+        'GeoInfo.get_ip_info[cached]': lambda: measure(
+            geoinfo.get_ip_info, addresses, repeat),
+        'GeoInfo.get_ip_info[cold]': lambda: measure(
+            lambda ip: cold_geoinfo[0].get_ip_info(ip), addresses, repeat, setup=fresh_geoinfo),
+        'merge_two_dicts[chain]': lambda: measure(
+            merge_chain(iohelper.merge_two_dicts, rows, shipper), dimensions, repeat),
+        'enrich_row': lambda: measure(
+            lambda row: shipper.enrichment.enrich_row(row, context), rows, repeat),
+        'DocumentBuilder.action': lambda: measure(
+            shipper.enrichment.DocumentBuilder(context).action, rows, repeat),
+    }
+
+    results = {}
+    for name, benchmark in benchmarks.items():
+        results[name] = benchmark()
+        print(f"{name:<40} {results[name]['ns_per_op']:>12,.0f} ns/op")
+    iohelper.set_user_agent_cache_size(ua_cache_size)
+    return results
+
+
+def run_transform(shipper, rows: t.List[dict], repeat: int, file_dir: str | None = None) -> dict:
+    """ rows/sec of sent_to_es: decode, enrich, serialize and bulk-index a whole response,
+    or write it compressed under `file_dir` """
+    from library.bulkindexer import BulkIndexer
+    from library.sinks import FileSink, OpenSearchSink
+
+    body = synthetic.graphql_response(rows)
+    client = StubOpenSearch()
+    if file_dir is None:
+        name = 'sent_to_es'
+        shipper.sink = OpenSearchSink(BulkIndexer(client, chunk_size=shipper.OPENSEARCH_BULK_CHUNK_SIZE,
+                                                  max_chunk_bytes=shipper.OPENSEARCH_BULK_MAX_BYTES))
+    else:
+        name = 'sent_to_es[file]'
+        shipper.sink = FileSink(file_dir)
+    best = None
+    for _ in range(repeat + 1):
+        with contextlib.redirect_stdout(io.StringIO()):
+            started_at = time.perf_counter_ns()
+            summary = shipper.sent_to_es(body, 'benchmark', 'cloudflare-requests-')
+            shipper.sink.sync()
+            elapsed = time.perf_counter_ns() - started_at
+        if summary is None or summary[shipper.sink.counter] != len(rows):
+            raise RuntimeError(f'sent_to_es did not ship every row: {summary}')
+        best = elapsed if best is None else min(best, elapsed)
+    shipper.sink.close()
+
+    result = {
+        'rows': len(rows),
+        'bytes': len(body),
+        'rows_per_sec': len(rows) * 1e9 / best,
+        'bulk_requests': client.requests // (repeat + 1),
+    }
+    print(f"{name:<40} {result['rows_per_sec']:>12,.0f} rows/sec")
+    return result
+
+
+# run in a fresh interpreter: import src/pull-traffics.py, then enrich one row, printing both times
+STARTUP_SCRIPT = '''
+import importlib.util, json, sys, time
+started_at = time.perf_counter_ns()
+sys.path[:0] = [sys.argv[1], sys.argv[2]]
+spec = importlib.util.spec_from_file_location('pull_traffics', sys.argv[1] + '/pull-traffics.py')
+shipper = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(shipper)
+imported_at = time.perf_counter_ns()
+import synthetic
+row = synthetic.make_rows(1)[0]
+enriched_at = time.perf_counter_ns()
+shipper.enrichment.DocumentBuilder(shipper.enrichment.new_context('zone', 'account', 'index-', 'batch')).action(row)
+print(json.dumps({'import_ns': imported_at - started_at, 'first_row_ns': time.perf_counter_ns() - enriched_at}))
+'''
+
+
+def run_startup(repeat: int) -> dict:
+    """ Best-of-`repeat` ms to import the shipper in a fresh process, and to enrich its first row
+    (the parsers and GeoIP readers are only built then) """
+    best = {}
+    for _ in range(repeat):
+        output = subprocess.run([sys.executable, '-c', STARTUP_SCRIPT, SRC_DIR, BENCHMARKS_DIR],
+                                check=True, capture_output=True, text=True).stdout
+        for name, elapsed in json.loads(output.splitlines()[-1]).items():
+            best[name] = elapsed if name not in best else min(best[name], elapsed)
+
+    result = {'import_ms': best['import_ns'] / 1e6, 'first_row_ms': best['first_row_ns'] / 1e6}
+    print(f"{'import pull-traffics':<40} {result['import_ms']:>12,.1f} ms")
+    print(f"{'first row after import':<40} {result['first_row_ms']:>12,.1f} ms")
+    return result
+
+
+def git_revision() -> str | None:
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=BENCHMARKS_DIR,
+                              capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(results: dict, baseline: dict, max_regression: float) -> t.List[str]:
+    """ Human readable regressions of `results` against `baseline`, beyond `max_regression` """
+    regressions = []
+    print(f"\n{'compared with ' + (baseline['meta'].get('revision') or 'baseline'):<40} {'before':>12} {'after':>12}")
+    for name, result in results['functions'].items():
+        before = baseline['functions'].get(name)
+        if before is None:
+            continue
+        change = result['ns_per_op'] / before['ns_per_op'] - 1
+        print(f"{name:<40} {before['ns_per_op']:>12,.0f} {result['ns_per_op']:>12,.0f} {change:>+8.1%}")
+        if change > max_regression:
+            regressions.append(f'{name}: {change:+.1%} ns/op')
+
+    before, after = baseline['transform']['rows_per_sec'], results['transform']['rows_per_sec']
+    change = after / before - 1
+    print(f"{'sent_to_es rows/sec':<40} {before:>12,.0f} {after:>12,.0f} {change:>+8.1%}")
+    if -change > max_regression:
+        regressions.append(f'sent_to_es: {change:+.1%} rows/sec')
+
+    # results saved before the file sink existed have no `transform_file`
+    if 'transform_file' in baseline:
+        before, after = baseline['transform_file']['rows_per_sec'], results['transform_file']['rows_per_sec']
+        change = after / before - 1
+        print(f"{'sent_to_es[file] rows/sec':<40} {before:>12,.0f} {after:>12,.0f} {change:>+8.1%}")
+        if -change > max_regression:
+            regressions.append(f'sent_to_es[file]: {change:+.1%} rows/sec')
+
+    # results saved before the startup benchmark existed have no `startup`
+    for name, result in results['startup'].items():
+        before = baseline.get('startup', {}).get(name)
+        if before is None:
+            continue
+        change = result / before - 1
+        print(f"{'startup ' + name:<40} {before:>12,.1f} {result:>12,.1f} {change:>+8.1%}")
+        if change > max_regression:
+            regressions.append(f'startup {name}: {change:+.1%} ms')
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--rows', type=int, default=5000, help='synthetic rows per benchmark (default: 5000)')
+    parser.add_argument('--repeat', type=int, default=5, help='timed passes, the best one is kept (default: 5)')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--output', help='results file (default: benchmarks/results/<timestamp>.json)')
+    parser.add_argument('--compare', help='results file of an earlier run to compare with')
+    parser.add_argument('--max-regression', type=float, default=0.10,
+                        help='exit with status 1 when a result is this much worse than --compare (default: 0.10)')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory(prefix='cf2os-bench-') as work_dir:
+        db_dir = os.path.join(work_dir, 'db')
+        synthetic.write_geo_databases(db_dir)
+        shipper = load_shipper(db_dir, os.path.join(work_dir, 'state'))
+
+        print(f'{args.rows} synthetic rows, best of {args.repeat}\n')
+        rows = synthetic.make_rows(args.rows, seed=args.seed)
+        results = {
+            'meta': {
+                'created_at': datetime.utcnow().strftime("%Y-%m-%dT%H:%M:%SZ"),
+                'revision': git_revision(),
+                'python': platform.python_version(),
+                'platform': platform.platform(),
+                'rows': args.rows,
+                'repeat': args.repeat,
+                'seed': args.seed,
+            },
+            'functions': run_functions(shipper, rows, args.repeat),
+            # enrich_row fills missing fields in place, start the transform from fresh rows
+            'transform': run_transform(shipper, synthetic.make_rows(args.rows, seed=args.seed), args.repeat),
+            'transform_file': run_transform(shipper, synthetic.make_rows(args.rows, seed=args.seed), args.repeat,
+                                            os.path.join(work_dir, 'files')),
+            'startup': run_startup(args.repeat),
+        }
+
+    output = args.output or os.path.join(
+        RESULTS_DIR, datetime.utcnow().strftime("%Y%m%dT%H%M%SZ") + '.json')
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, 'w') as handle:
+        json.dump(results, handle, indent=2)
+    print(f'\nresults saved to {output}')
+
+    if args.compare:
+        with open(args.compare) as handle:
+            baseline = json.load(handle)
+        regressions = compare(results, baseline, args.max_regression)
+        if regressions:
+            print('\nregressions:\n  ' + '\n  '.join(regressions))
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
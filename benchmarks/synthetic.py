@@ -0,0 +1,192 @@
+# -*- coding: utf-8 -*-
+# Synthetic GraphQL rows and GeoLite2 look-alike databases for the benchmarks
+import json
+import os
+import random
+import typing as t
+
+from mmdb import write_mmdb
+
+# a handful of agents repeat on most rows, like real traffic
+COMMON_USER_AGENTS = (
+    'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) '
+    'Chrome/120.0.0.0 Safari/537.36',
+    'Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/605.1.15 (KHTML, like Gecko) '
+    'Version/17.1 Safari/605.1.15',
+    'Mozilla/5.0 (iPhone; CPU iPhone OS 17_1 like Mac OS X) AppleWebKit/605.1.15 (KHTML, like Gecko) '
+    'Version/17.1 Mobile/15E148 Safari/604.1',
+    'Mozilla/5.0 (Linux; Android 14; Pixel 8) AppleWebKit/537.36 (KHTML, like Gecko) '
+    'Chrome/120.0.6099.144 Mobile Safari/537.36',
+    'Mozilla/5.0 (Windows NT 10.0; Win64; x64; rv:121.0) Gecko/20100101 Firefox/121.0',
+    'Mozilla/5.0 (compatible; Googlebot/2.1; +http://www.google.com/bot.html)',
+    'curl/8.4.0',
+)
+
+REFERERS = (
+    '',
+    'https://www.google.com/search?q=running+shoes',
+    'https://www.bing.com/search?q=trail+shoes&form=QBLH',
+    'https://duckduckgo.com/?q=shoes',
+    'https://www.facebook.com/',
+    'https://t.co/abc123',
+)
+
+COUNTRIES = ('US', 'CA', 'MX', 'GB', 'DE', 'FR', 'BR', 'JP', 'XX', '')
+
+UTM_SOURCES = ('google', 'bing', 'facebook', 'newsletter', 'linkedin')
+UTM_MEDIUMS = ('cpc', 'email', 'social', 'display')
+
+# networks in the synthetic City / ASN databases; addresses outside them are "not found"
+CITY_NETWORKS = {
+    '1.2.3.0/24': ('Sydney', 'AU', 'OC', 'Oceania', -33.86, 151.2),
+    '8.8.0.0/16': ('Mountain View', 'US', 'NA', 'North America', 37.38, -122.08),
+    '81.2.69.0/24': ('London', 'GB', 'EU', 'Europe', 51.5, -0.12),
+    '177.0.0.0/12': ('Sao Paulo', 'BR', 'SA', 'South America', -23.55, -46.63),
+    '2001:db8::/32': ('Toronto', 'CA', 'NA', 'North America', 43.65, -79.38),
+    '2a02:1000::/24': ('Berlin', 'DE', 'EU', 'Europe', 52.52, 13.4),
+}
+ASN_NETWORKS = {
+    '1.2.0.0/16': (13335, 'CLOUDFLARENET'),
+    '8.8.8.0/24': (15169, 'GOOGLE'),
+    '81.2.0.0/16': (20712, 'Andrews & Arnold Ltd'),
+    '177.0.0.0/12': (28573, 'Claro NXT Telecomunicacoes Ltda'),
+    '2001:db8::/32': (64500, 'EXAMPLE-NET'),
+    '2a02:1000::/24': (3320, 'Deutsche Telekom AG'),
+}
+
+
+def _city_record(city, country_code, continent_code, continent, latitude, longitude) -> dict:
+    return {
+        'city': {'names': {'en': city}},
+        'continent': {'code': continent_code, 'names': {'en': continent}},
+        'country': {'iso_code': country_code, 'names': {'en': country_code}},
+        'location': {'latitude': latitude, 'longitude': longitude},
+        'postal': {'code': '00000'},
+        'subdivisions': [{'iso_code': 'XX', 'names': {'en': 'Province'}}],
+    }
+
+
+def write_geo_databases(db_dir: str):
+    """ Write GeoLite2-City.mmdb and GeoLite2-ASN.mmdb look-alikes to `db_dir` """
+    os.makedirs(db_dir, exist_ok=True)
+    write_mmdb(os.path.join(db_dir, 'GeoLite2-City.mmdb'), 'GeoLite2-City',
+               {cidr: _city_record(*values) for cidr, values in CITY_NETWORKS.items()})
+    write_mmdb(os.path.join(db_dir, 'GeoLite2-ASN.mmdb'), 'GeoLite2-ASN',
+               {cidr: {'autonomous_system_number': number, 'autonomous_system_organization': organization}
+                for cidr, (number, organization) in ASN_NETWORKS.items()})
+
+
+def unique_user_agents(count: int, seed: int = 1) -> t.List[str]:
+    """ `count` distinct, realistic user agent strings (parser cache misses) """
+    rnd = random.Random(seed)
+    agents = []
+    for i in range(count):
+        major, build = rnd.randint(90, 130), rnd.randint(1000, 9999)
+        agents.append(f'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) '
+                      f'Chrome/{major}.0.{build}.{i} Safari/537.36')
+    return agents
+
+
+def ip_addresses(count: int, seed: int = 1) -> t.List[str]:
+    """ IPv4 and IPv6 client addresses, mostly inside the synthetic networks """
+    rnd = random.Random(seed)
+    addresses = []
+    for _ in range(count):
+        kind = rnd.random()
+        if kind < 0.25:
+            addresses.append(f'1.2.3.{rnd.randint(1, 254)}')
+        elif kind < 0.45:
+            addresses.append(f'8.8.{rnd.randint(0, 255)}.{rnd.randint(1, 254)}')
+        elif kind < 0.55:
+            addresses.append(f'81.2.69.{rnd.randint(1, 254)}')
+        elif kind < 0.65:
+            addresses.append(f'177.{rnd.randint(0, 15)}.{rnd.randint(0, 255)}.{rnd.randint(1, 254)}')
+        elif kind < 0.8:
+            addresses.append(f'2001:db8:{rnd.randint(0, 0xffff):x}::{rnd.randint(1, 0xffff):x}')
+        elif kind < 0.9:
+            addresses.append(f'2a02:10{rnd.randint(0, 0xff):02x}::{rnd.randint(1, 0xffff):x}')
+        else:
+            # private and documentation ranges that are not in the databases
+            addresses.append(rnd.choice(('10.0.0.1', '192.168.1.10', '203.0.113.7', 'fd00::1')))
+    return addresses
+
+
+def query_strings(count: int, seed: int = 1) -> t.List[str]:
+    """ Request query strings, about half of them with UTM tags or click ids """
+    rnd = random.Random(seed)
+    queries = []
+    for i in range(count):
+        kind = rnd.random()
+        if kind < 0.4:
+            queries.append('')
+        elif kind < 0.75:
+            queries.append(f'?utm_source={rnd.choice(UTM_SOURCES)}&utm_medium={rnd.choice(UTM_MEDIUMS)}'
+                           f'&utm_campaign=spring-{rnd.randint(1, 20)}&utm_content=banner')
+        elif kind < 0.85:
+            queries.append(f'?gclid=Cj0KCQjw{i:08d}&utm_source=google&utm_medium=cpc')
+        elif kind < 0.9:
+            queries.append(f'?fbclid=IwAR{i:08d}')
+        else:
+            queries.append(f'?page={rnd.randint(1, 9)}&sort=price')
+    return queries
+
+
+def referer_urls(count: int, seed: int = 1) -> t.List[str]:
+    """ Referer URLs, some of them carrying UTM tags """
+    rnd = random.Random(seed)
+    referers = []
+    for _ in range(count):
+        if rnd.random() < 0.2:
+            referers.append(f'https://news.example.org/article/{rnd.randint(1, 500)}'
+                            f'?utm_source={rnd.choice(UTM_SOURCES)}&utm_medium={rnd.choice(UTM_MEDIUMS)}')
+        else:
+            referers.append(rnd.choice(REFERERS))
+    return referers
+
+
+def make_rows(count: int, seed: int = 1, unique_agent_ratio: float = 0.05) -> t.List[dict]:
+    """ GraphQL `series` rows, as returned by httpRequestsAdaptiveGroups with premium fields """
+    rnd = random.Random(seed)
+    unique_agents = iter(unique_user_agents(count, seed))
+    addresses = ip_addresses(count, seed)
+    queries = query_strings(count, seed)
+    referers = referer_urls(count, seed)
+
+    rows = []
+    for i in range(count):
+        if rnd.random() < unique_agent_ratio:
+            agent = next(unique_agents)
+        else:
+            agent = rnd.choice(COMMON_USER_AGENTS)
+        rows.append({
+            'count': rnd.randint(1, 20),
+            'avg': {'sampleInterval': 1.0, '__typename': 'ZoneHttpRequestsAdaptiveGroupsAverage'},
+            'sum': {'edgeResponseBytes': rnd.randint(200, 200000), 'visits': rnd.randint(0, 3),
+                    '__typename': 'ZoneHttpRequestsAdaptiveGroupsSum'},
+            'dimensions': {
+                'clientCountryName': rnd.choice(COUNTRIES),
+                'clientIP': addresses[i],
+                'clientRequestHTTPHost': 'www.example.com',
+                'clientRequestHTTPMethodName': rnd.choice(('GET', 'GET', 'GET', 'POST')),
+                'clientRequestPath': f'/products/{rnd.randint(1, 300)}',
+                'datetime': f'2025-10-01T{i // 3600 % 24:02d}:{i // 60 % 60:02d}:{i % 60:02d}Z',
+                'edgeResponseStatus': rnd.choice((200, 200, 200, 301, 404, 500)),
+                'originResponseStatus': 200,
+                'sampleInterval': 1,
+                'userAgent': agent,
+                'originIP': '192.0.2.10',
+                'clientRequestQuery': queries[i],
+                'clientRequestReferer': referers[i],
+                'clientRefererHost': '',
+            },
+            '__typename': 'ZoneHttpRequestsAdaptiveGroups',
+        })
+    return rows
+
+
+def graphql_response(rows: t.List[dict]) -> str:
+    """ The body of a successful GraphQL response carrying `rows` """
+    return json.dumps({
+        'data': {'viewer': {'zones': [{'series': rows, '__typename': 'zone'}], '__typename': 'viewer'}},
+        'errors': None,
+    })
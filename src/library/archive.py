@@ -0,0 +1,84 @@
+# -*- coding: utf-8 -*-
+import gzip
+import logging
+import os
+import typing as t
+from datetime import datetime
+
+from library.windows import Window
+
+logger = logging.getLogger(__name__)
+
+FILE_TIMESTAMP = "%Y%m%dT%H%M%SZ"
+FILE_SUFFIX = '.json.gz'
+
+
+# a class that keeps raw GraphQL responses as gzip files, one per zone and window:
+# <archive_dir>/<zone>/<YYYY-MM-DD>/<start>_<end>.json.gz
+class ResponseArchive:
+    def __init__(self, archive_dir: str, compresslevel: int = 6):
+        self.archive_dir = archive_dir
+        self.compresslevel = compresslevel
+
+    def path(self, zone: str | None, window: Window) -> str:
+        file_name = window.start.strftime(FILE_TIMESTAMP) + '_' + window.end.strftime(FILE_TIMESTAMP) + FILE_SUFFIX
+        return os.path.join(self.archive_dir, zone or 'default', window.start.strftime("%Y-%m-%d"), file_name)
+
+    def tee(self, zone: str | None, window: Window, chunks: t.Iterable[bytes]) -> t.Iterator[bytes]:
+        """ Pass `chunks` through while compressing them to the window's file, which only
+        appears once the whole body was read """
+        path = self.path(zone, window)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        partial_path = path + '.partial'
+        completed = False
+        try:
+            with gzip.open(partial_path, 'wb', compresslevel=self.compresslevel) as archive_file:
+                for chunk in chunks:
+                    archive_file.write(chunk)
+                    yield chunk
+            completed = True
+        finally:
+            if completed:
+                os.replace(partial_path, path)
+            elif os.path.exists(partial_path):
+                os.remove(partial_path)
+
+    def discard(self, zone: str | None, window: Window):
+        path = self.path(zone, window)
+        if os.path.exists(path):
+            os.remove(path)
+
+    def windows(self, zone: str | None, start: datetime, end: datetime) -> t.List[t.Tuple[Window, str]]:
+        """ Archived windows of `zone` that lie inside [start, end), in time order """
+        zone_dir = os.path.join(self.archive_dir, zone or 'default')
+        if not os.path.isdir(zone_dir):
+            return []
+
+        found = []
+        for day in sorted(os.listdir(zone_dir)):
+            day_dir = os.path.join(zone_dir, day)
+            if not os.path.isdir(day_dir):
+                continue
+            for file_name in os.listdir(day_dir):
+                if not file_name.endswith(FILE_SUFFIX):
+                    continue
+                try:
+                    window_start, window_end = file_name[:-len(FILE_SUFFIX)].split('_')
+                    window = Window(datetime.strptime(window_start, FILE_TIMESTAMP),
+                                    datetime.strptime(window_end, FILE_TIMESTAMP))
+                except ValueError:
+                    logger.warning("Skipping unexpected archive file %s", file_name)
+                    continue
+                if window.start >= start and window.end <= end:
+                    found.append((window, os.path.join(day_dir, file_name)))
+        found.sort()
+        return found
+
+    @staticmethod
+    def read(path: str, chunk_size: int = 65536) -> t.Iterator[bytes]:
+        with gzip.open(path, 'rb') as archive_file:
+            while True:
+                chunk = archive_file.read(chunk_size)
+                if not chunk:
+                    break
+                yield chunk
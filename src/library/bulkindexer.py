@@ -0,0 +1,211 @@
+# -*- coding: utf-8 -*-
+import asyncio
+import json
+import logging
+import time
+import typing as t
+
+logger = logging.getLogger(__name__)
+
+# item / request statuses that are worth sending again
+RETRYABLE_STATUS = (429, 502, 503, 504)
+# request statuses that say nothing about the documents: they are taken once the credentials are fixed
+AUTH_STATUS = (401, 403)
+
+
+def utf8_length(text: str) -> int:
+    """ Bytes of `text` in UTF-8; the lines json.dumps writes are usually ASCII, which skips the encoding """
+    return len(text) if text.isascii() else len(text.encode('utf-8'))
+
+
+class IndexingUnavailable(Exception):
+    """ OpenSearch could not take the documents right now, they are worth sending again later """
+
+
+# a class that batches documents into `_bulk` requests on an OpenSearch client
+# and returns a summary of indexed, failed and retried documents, and of the
+# `_bulk` requests sent (count, bytes and seconds spent waiting for OpenSearch);
+# with `raise_unavailable` documents that still fail with a retryable error after the retries
+# raise IndexingUnavailable instead of being dropped, as do requests refused for their credentials, and
+# `on_rejected(meta_line, source_line, error)` is called for every document OpenSearch rejected for good,
+# on its own or within a `_bulk` request that failed as a whole
+class BulkIndexer:
+    def __init__(self, client, chunk_size: int = 500, max_chunk_bytes: int = 10 * 1024 * 1024,
+                 max_retries: int = 3, initial_backoff: float = 2, max_backoff: float = 60,
+                 raise_unavailable: bool = False, on_rejected: t.Callable[[str, str, dict], None] | None = None):
+        self.client = client
+        self.raise_unavailable = raise_unavailable
+        self.on_rejected = on_rejected
+        self.chunk_size = max(1, chunk_size)
+        self.max_chunk_bytes = max(1, max_chunk_bytes)
+        self.max_retries = max(0, max_retries)
+        self.initial_backoff = initial_backoff
+        self.max_backoff = max_backoff
+
+    @staticmethod
+    def action(index_name: str, document: dict, doc_id: str | None = None) -> t.Tuple[str, str]:
+        """ Serialize a document into its (action, source) bulk lines """
+        meta = {'_index': index_name}
+        if doc_id is not None:
+            meta['_id'] = doc_id
+        return json.dumps({'index': meta}), json.dumps(document, default=str)
+
+    @staticmethod
+    def new_summary() -> dict:
+        return {'indexed': 0, 'failed': 0, 'retried': 0, 'errors': [], 'requests': 0, 'bytes': 0, 'seconds': 0.0}
+
+    def chunks(self, actions: t.Iterable[t.Tuple[str, str]]) -> t.Iterator[list]:
+        """ Group (action, source) line pairs into chunks bounded by docs and bytes """
+        chunk = []
+        chunk_bytes = 0
+        for meta_line, source_line in actions:
+            # the limit is on the request body, http.max_content_length counts bytes
+            size = utf8_length(meta_line) + utf8_length(source_line) + 2
+            if chunk and (len(chunk) >= self.chunk_size or chunk_bytes + size > self.max_chunk_bytes):
+                yield chunk
+                chunk = []
+                chunk_bytes = 0
+            chunk.append((meta_line, source_line))
+            chunk_bytes += size
+
+        if chunk:
+            yield chunk
+
+    def index(self, actions: t.Iterable[t.Tuple[str, str]], summary: dict | None = None) -> dict:
+        """ Send (action, source) line pairs in chunks bounded by docs and bytes """
+        if summary is None:
+            summary = self.new_summary()
+        for chunk in self.chunks(actions):
+            self._send(chunk, summary)
+        return summary
+
+    def _backoff(self, attempt: int) -> float:
+        return min(self.initial_backoff * (2 ** attempt), self.max_backoff)
+
+    @staticmethod
+    def _transport_errors() -> tuple:
+        # imported on the first request: opensearch-py takes longer to import than the rest of the shipper
+        from opensearchpy.exceptions import ConnectionError as OpenSearchConnectionError
+        from opensearchpy.exceptions import TransportError
+
+        return OpenSearchConnectionError, TransportError
+
+    @staticmethod
+    def _body(chunk: list, summary: dict) -> str:
+        body = ''.join(f'{meta_line}\n{source_line}\n' for meta_line, source_line in chunk)
+        summary['requests'] += 1
+        summary['bytes'] += utf8_length(body)
+        return body
+
+    def _request_failed(self, err: Exception, chunk: list, attempt: int, summary: dict) -> bool:
+        """ Whether a chunk whose whole `_bulk` request failed is sent again, otherwise it is dropped """
+        connection_error, _ = self._transport_errors()
+        status = getattr(err, 'status_code', None)
+        retryable = isinstance(err, connection_error) or status in RETRYABLE_STATUS
+        if retryable and attempt < self.max_retries:
+            logger.warning("Bulk request failed (%s), retrying %s docs", err, len(chunk))
+            summary['retried'] += len(chunk)
+            return True
+        if (retryable or status in AUTH_STATUS) and self.raise_unavailable:
+            raise IndexingUnavailable(f'Bulk request failed ({err})') from err
+        logger.error("Bulk request failed (%s), dropping %s docs", err, len(chunk))
+        summary['failed'] += len(chunk)
+        summary['errors'].append({'status': status, 'error': str(err), 'docs': len(chunk)})
+        if self.on_rejected is not None:
+            error = {'status': status, 'error': str(err)}
+            for meta_line, source_line in chunk:
+                self.on_rejected(meta_line, source_line, error)
+        return False
+
+    def _collect(self, chunk: list, response: dict, attempt: int, summary: dict) -> list:
+        """ Count the results of a `_bulk` response, returns the documents worth sending again """
+        retry = []
+        items = response.get('items', [])
+        if len(items) < len(chunk):
+            # nothing says these were indexed: they are sent again like throttled documents
+            logger.warning("Bulk response has %s items for %s docs, the other %s are unanswered",
+                           len(items), len(chunk), len(chunk) - len(items))
+        for position, (meta_line, source_line) in enumerate(chunk):
+            if position < len(items):
+                result = next(iter(items[position].values()))
+                status = result.get('status', 0)
+                retryable = status in RETRYABLE_STATUS
+            else:
+                result = {'error': 'no item in the _bulk response'}
+                status = None
+                retryable = True
+            if status is not None and 200 <= status < 300:
+                summary['indexed'] += 1
+            elif retryable and attempt < self.max_retries:
+                retry.append((meta_line, source_line))
+            elif retryable and self.raise_unavailable:
+                raise IndexingUnavailable(f'Bulk item still rejected with {status} after {attempt} retries')
+            else:
+                summary['failed'] += 1
+                error = {
+                    'index': result.get('_index'),
+                    'id': result.get('_id'),
+                    'status': status,
+                    'error': result.get('error'),
+                }
+                summary['errors'].append(error)
+                logger.warning("Bulk item rejected: %s", error)
+                if self.on_rejected is not None:
+                    self.on_rejected(meta_line, source_line, error)
+        if retry:
+            summary['retried'] += len(retry)
+        return retry
+
+    def _send(self, chunk: list, summary: dict):
+        transport_errors = self._transport_errors()
+        attempt = 0
+        while chunk:
+            body = self._body(chunk, summary)
+            started_at = time.perf_counter()
+            try:
+                response = self.client.bulk(body=body)
+            except transport_errors as err:
+                summary['seconds'] += time.perf_counter() - started_at
+                if not self._request_failed(err, chunk, attempt, summary):
+                    return
+                time.sleep(self._backoff(attempt))
+                attempt += 1
+                continue
+            summary['seconds'] += time.perf_counter() - started_at
+
+            chunk = self._collect(chunk, response, attempt, summary)
+            if chunk:
+                time.sleep(self._backoff(attempt))
+                attempt += 1
+
+
+# the same batching on opensearch-py's AsyncOpenSearch client, for the asyncio engine
+class AsyncBulkIndexer(BulkIndexer):
+    async def index(self, actions: t.Iterable[t.Tuple[str, str]], summary: dict | None = None) -> dict:
+        if summary is None:
+            summary = self.new_summary()
+        for chunk in self.chunks(actions):
+            await self._send(chunk, summary)
+        return summary
+
+    async def _send(self, chunk: list, summary: dict):
+        transport_errors = self._transport_errors()
+        attempt = 0
+        while chunk:
+            body = self._body(chunk, summary)
+            started_at = time.perf_counter()
+            try:
+                response = await self.client.bulk(body=body)
+            except transport_errors as err:
+                summary['seconds'] += time.perf_counter() - started_at
+                if not self._request_failed(err, chunk, attempt, summary):
+                    return
+                await asyncio.sleep(self._backoff(attempt))
+                attempt += 1
+                continue
+            summary['seconds'] += time.perf_counter() - started_at
+
+            chunk = self._collect(chunk, response, attempt, summary)
+            if chunk:
+                await asyncio.sleep(self._backoff(attempt))
+                attempt += 1
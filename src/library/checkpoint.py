@@ -0,0 +1,129 @@
+# -*- coding: utf-8 -*-
+import logging
+import os
+import sqlite3
+import threading
+import typing as t
+from datetime import datetime
+
+from library.windows import Window, format_timestamp
+
+logger = logging.getLogger(__name__)
+
+PENDING = 'pending'
+FETCHED = 'fetched'
+INDEXED = 'indexed'
+# the documents are safe in the local spool, waiting to be indexed
+SPOOLED = 'spooled'
+# the documents were written to local files instead of OpenSearch
+WRITTEN = 'written'
+FAILED = 'failed'
+# a window follow mode gave up on after it kept failing, left for a backfill to fetch again
+SKIPPED = 'skipped'
+
+
+# a class that records the status of every window in a local SQLite file,
+# so an interrupted backfill can skip the windows it already shipped
+class CheckpointStore:
+    def __init__(self, state_dir: str, file_name: str = 'checkpoints.sqlite3'):
+        os.makedirs(state_dir, exist_ok=True)
+        self.path = os.path.join(state_dir, file_name)
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+        self.connection.execute('PRAGMA journal_mode=WAL')
+        self.connection.execute('''
+            CREATE TABLE IF NOT EXISTS windows (
+                zone TEXT NOT NULL,
+                start TEXT NOT NULL,
+                "end" TEXT NOT NULL,
+                status TEXT NOT NULL,
+                rows INTEGER,
+                indexed INTEGER,
+                failed INTEGER,
+                error TEXT,
+                updated_at TEXT NOT NULL,
+                PRIMARY KEY (zone, start, "end")
+            )''')
+        self.connection.execute('''
+            CREATE TABLE IF NOT EXISTS watermarks (
+                zone TEXT PRIMARY KEY,
+                value TEXT NOT NULL,
+                updated_at TEXT NOT NULL
+            )''')
+
+    def mark(self, zone: str, window: Window, status: str, rows: int | None = None,
+             indexed: int | None = None, failed: int | None = None, error: str | None = None):
+        """ Insert or update the status of a window, counts that are not passed are kept """
+        with self.lock:
+            self.connection.execute('''
+                INSERT INTO windows (zone, start, "end", status, rows, indexed, failed, error, updated_at)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+                ON CONFLICT (zone, start, "end") DO UPDATE SET
+                    status = excluded.status,
+                    rows = COALESCE(excluded.rows, rows),
+                    indexed = COALESCE(excluded.indexed, indexed),
+                    failed = COALESCE(excluded.failed, failed),
+                    error = excluded.error,
+                    updated_at = excluded.updated_at''',
+                (zone or '', format_timestamp(window.start), format_timestamp(window.end), status,
+                 rows, indexed, failed, error, datetime.utcnow().isoformat()))
+
+    def completed(self, zone: str, start: datetime, end: datetime) -> t.List[Window]:
+        """ Indexed (or spooled, or written) windows overlapping [start, end], sorted and merged into contiguous ranges """
+        with self.lock:
+            cursor = self.connection.execute('''
+                SELECT start, "end" FROM windows
+                WHERE zone = ? AND status IN (?, ?, ?) AND "end" > ? AND start < ?
+                ORDER BY start''',
+                (zone or '', INDEXED, SPOOLED, WRITTEN, format_timestamp(start), format_timestamp(end)))
+            rows = cursor.fetchall()
+
+        merged = []
+        for row_start, row_end in rows:
+            window = Window(datetime.strptime(row_start, "%Y-%m-%dT%H:%M:%SZ"),
+                            datetime.strptime(row_end, "%Y-%m-%dT%H:%M:%SZ"))
+            if merged and window.start <= merged[-1].end:
+                if window.end > merged[-1].end:
+                    merged[-1] = Window(merged[-1].start, window.end)
+            else:
+                merged.append(window)
+        return merged
+
+    def failed_at(self, zone: str, start: datetime) -> t.Tuple[Window, str | None] | None:
+        """ The failed window starting at `start` that was tried last, with its error """
+        with self.lock:
+            row = self.connection.execute('''
+                SELECT start, "end", error FROM windows
+                WHERE zone = ? AND status = ? AND start = ?
+                ORDER BY updated_at DESC LIMIT 1''',
+                (zone or '', FAILED, format_timestamp(start))).fetchone()
+        if row is None:
+            return None
+        return Window(datetime.strptime(row[0], "%Y-%m-%dT%H:%M:%SZ"),
+                      datetime.strptime(row[1], "%Y-%m-%dT%H:%M:%SZ")), row[2]
+
+    def get_watermark(self, zone: str) -> datetime | None:
+        """ End of the contiguous range shipped so far in follow mode """
+        with self.lock:
+            row = self.connection.execute(
+                'SELECT value FROM watermarks WHERE zone = ?', (zone or '',)).fetchone()
+        if row is None:
+            return None
+        return datetime.strptime(row[0], "%Y-%m-%dT%H:%M:%SZ")
+
+    def set_watermark(self, zone: str, value: datetime):
+        with self.lock:
+            self.connection.execute('''
+                INSERT INTO watermarks (zone, value, updated_at) VALUES (?, ?, ?)
+                ON CONFLICT (zone) DO UPDATE SET value = excluded.value, updated_at = excluded.updated_at''',
+                (zone or '', format_timestamp(value), datetime.utcnow().isoformat()))
+
+    def counts(self, zone: str) -> t.Dict[str, int]:
+        with self.lock:
+            cursor = self.connection.execute(
+                'SELECT status, COUNT(*) FROM windows WHERE zone = ? GROUP BY status', (zone or '',))
+            return dict(cursor.fetchall())
+
+    def close(self):
+        with self.lock:
+            self.connection.close()
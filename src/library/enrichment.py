@@ -0,0 +1,264 @@
+# -*- coding: utf-8 -*-
+import json
+import os
+import time
+import typing as t
+from datetime import datetime
+
+from library.geoinfo import GeoInfo, IP_INFO_FIELDS
+from library.iohelper import REFERER_FIELDS, REQUEST_QUERY_FIELDS, URL_PARTS, USER_AGENT_FIELDS, document_id, \
+    normalize_country, parse_browser_agent_values, parse_url_values, set_user_agent_cache_size, \
+    user_agent_cache_stats, user_agent_parser
+from library.rollup import RollupAggregator
+from library.windows import Window
+
+# Ensure required fields have empty values if not present
+REQUIRED_FIELDS = (
+    'clientCountryName',
+    'clientIP',
+    'clientRequestHTTPHost',
+    'clientRequestHTTPMethodName',
+    'clientRequestPath',
+    'datetime',
+    'edgeResponseStatus',
+    'originResponseStatus',
+    'sampleInterval',
+    'userAgent',
+)
+
+BATCH_DATETIME_FORMAT = "%Y-%m-%dT%H:%M:%SZ"
+
+# fields added to every row's dimensions, in document order
+ENRICHED_FIELDS = REQUEST_QUERY_FIELDS + USER_AGENT_FIELDS + REFERER_FIELDS + (
+    'clientRequest_CountryCode',
+    'clientRequest_CountryName',
+) + tuple('clientRequest_geoip_' + field for field in IP_INFO_FIELDS) + (
+    'log_pull_batch_name',
+    'log_pull_batch_datetime',
+    'count',
+    'avg_typename',
+    'avg_sampleInterval',
+    'sum_edgeResponseBytes',
+    'sum_visits',
+    'sum_typename',
+    'accountTag',
+    'zoneTag',
+)
+# json.dumps(document, default=str) without building a new encoder for every document
+_encode_document = json.JSONEncoder(default=str).encode
+# the marketing parameters of parse_url_values(), without the URL parts
+_QUERY_VALUES = slice(len(URL_PARTS), None)
+
+# enrichment steps timed for every row, in order; `serialize` is the bulk line encoding
+ENRICH_STEPS = (
+    'prepare',
+    'query',
+    'user_agent',
+    'referer',
+    'country',
+    'geoip',
+    'batch',
+    'serialize',
+    'rollup',
+)
+
+# per-process enrichment state: every pool worker opens its own GeoLite2 readers
+# and keeps its own parser caches, set up once by init_worker()
+_geoip_db_dir = None
+_geoip_cache_size = 65536
+_geoinfo = None
+
+
+def init_worker(geoip_db_dir: str | None = None, geoip_cache_size: int = 65536, ua_cache_size: int = 4096,
+                open_now: bool = False):
+    global _geoip_db_dir, _geoip_cache_size, _geoinfo
+    _geoip_db_dir = geoip_db_dir
+    _geoip_cache_size = geoip_cache_size
+    _geoinfo = GeoInfo(geoip_db_dir, cache_size=geoip_cache_size)
+    set_user_agent_cache_size(ua_cache_size)
+    if open_now:
+        preload()
+
+
+def preload():
+    """ Build the user agent parser and open the GeoLite2 readers now rather than on the first row """
+    user_agent_parser()
+    geoinfo().open()
+
+
+def geoinfo() -> GeoInfo:
+    global _geoinfo
+    if _geoinfo is None:
+        _geoinfo = GeoInfo(_geoip_db_dir, cache_size=_geoip_cache_size)
+    return _geoinfo
+
+
+def cache_stats() -> t.Dict[str, dict]:
+    stats = {'user_agent': user_agent_cache_stats()}
+    if _geoinfo is not None:
+        for name, geo_stats in _geoinfo.cache_stats().items():
+            stats['geoip_' + name] = geo_stats
+    return stats
+
+
+def new_timings() -> t.Dict[str, float]:
+    return dict.fromkeys(ENRICH_STEPS, 0.0)
+
+
+def new_context(zone: str | None, account: str | None, index_prefix_name: str, batch_name: str | None,
+                rollup_dimensions: t.Sequence[t.Tuple[str, ...]] = (), rollup_interval_minutes: int = 60,
+                window: Window | None = None) -> dict:
+    """ The per-window constants of the documents, `batch_datetime` is the time the window was shipped;
+    with `rollup_dimensions` the documents of `window` are also rolled up (see RollupAggregator) """
+    return {
+        'batch_name': batch_name,
+        'batch_datetime': datetime.now().strftime(BATCH_DATETIME_FORMAT),
+        'index_prefix_name': index_prefix_name,
+        'account': account,
+        'zone': zone,
+        'rollup_dimensions': tuple(rollup_dimensions),
+        'rollup_interval_minutes': rollup_interval_minutes,
+        'window': window,
+    }
+
+
+# a class that builds the documents of one window: the enriched fields have a fixed layout
+# (ENRICHED_FIELDS), their values are collected in one list per row and added to a copy of
+# the row's dimensions in a single update, and the window constants (batch fields, index
+# names and action lines) are computed once instead of for every row
+class DocumentBuilder:
+    def __init__(self, context: dict):
+        self.zone = context['zone']
+        self.account = context['account']
+        self.index_prefix_name = context['index_prefix_name']
+        self.batch_name = context['batch_name']
+        self.batch_datetime = context.get('batch_datetime') or datetime.now().strftime(BATCH_DATETIME_FORMAT)
+        self.rollup = None
+        if context.get('rollup_dimensions'):
+            self.rollup = RollupAggregator(context['rollup_dimensions'], context.get('rollup_interval_minutes', 60),
+                                           context.get('window'))
+        # day (YYYY-MM-DD) -> (index name, action line up to the document id)
+        self.indices = {}
+
+    def _index(self, created_date: str) -> t.Tuple[str, str]:
+        day = created_date[:10]
+        index = self.indices.get(day)
+        if index is None:
+            index_name = self.index_prefix_name + datetime.fromisoformat(created_date).strftime("%Y.%m.%d")
+            # the same bytes as BulkIndexer.action()
+            index = index_name, '{"index": {"_index": ' + json.dumps(index_name) + ', "_id": '
+            self.indices[day] = index
+        return index
+
+    def build(self, item: dict, timings: dict | None = None) -> t.Tuple[str, str, dict]:
+        """ Enrich one GraphQL row, returns (index name, document id, document);
+        the seconds spent in each step are added to `timings` """
+        index_name, _, index_id, item_data, values = self._values(item, timings)
+        started_at = time.perf_counter()
+        document = item_data.copy()
+        document.update(zip(ENRICHED_FIELDS, values))
+        if timings is not None:
+            timings['serialize'] += time.perf_counter() - started_at
+        return index_name, index_id, document
+
+    def action(self, item: dict, timings: dict | None = None) -> t.Tuple[str, str]:
+        """ Enrich one GraphQL row straight into its bulk (action, source) lines """
+        _, meta_prefix, index_id, item_data, values = self._values(item, timings)
+        started_at = time.perf_counter()
+        document = item_data.copy()
+        document.update(zip(ENRICHED_FIELDS, values))
+        lines = meta_prefix + '"' + index_id + '"}}', _encode_document(document)
+        if timings is not None:
+            step_at = time.perf_counter()
+            timings['serialize'] += step_at - started_at
+            started_at = step_at
+        if self.rollup is not None:
+            self.rollup.add(document)
+            if timings is not None:
+                timings['rollup'] += time.perf_counter() - started_at
+        return lines
+
+    def _values(self, item: dict, timings: dict | None) -> tuple:
+        if timings is None:
+            timings = new_timings()
+        clock = time.perf_counter
+        started_at = clock()
+        item_data = item['dimensions']
+
+        # Ensure required fields have empty values if not present
+        for field in REQUIRED_FIELDS:
+            if item_data.get(field) is None:
+                item_data[field] = ''
+
+        # stable id over the group-by dimensions, so a re-run overwrites instead of duplicating
+        index_id = document_id(self.zone, item_data)
+        index_name, meta_prefix = self._index(item_data['datetime'])
+
+        step_at = clock()
+        timings['prepare'] += step_at - started_at
+        started_at = step_at
+
+        # client request query parameters, then the fields of every later step, in ENRICHED_FIELDS order
+        values = list(parse_url_values(item_data.get('clientRequestQuery', ''))[_QUERY_VALUES])
+        step_at = clock()
+        timings['query'] += step_at - started_at
+        started_at = step_at
+
+        values += parse_browser_agent_values(item_data['userAgent'])
+        step_at = clock()
+        timings['user_agent'] += step_at - started_at
+        started_at = step_at
+
+        values += parse_url_values(item_data.get('clientRequestReferer', ''))
+        step_at = clock()
+        timings['referer'] += step_at - started_at
+        started_at = step_at
+
+        # the country code and its normalized name
+        country = item_data['clientCountryName']
+        values.append(country)
+        values.append(normalize_country(country))
+        step_at = clock()
+        timings['country'] += step_at - started_at
+        started_at = step_at
+
+        # client ip geo info
+        values += geoinfo().get_ip_values(item_data['clientIP'])
+        step_at = clock()
+        timings['geoip'] += step_at - started_at
+        started_at = step_at
+
+        values += (
+            self.batch_name,
+            self.batch_datetime,
+            item['count'],
+            item['avg']['__typename'],
+            item['avg']['sampleInterval'],
+            item['sum']['edgeResponseBytes'],
+            item['sum']['visits'],
+            item['sum']['__typename'],
+            self.account,
+            self.zone,
+        )
+        timings['batch'] += clock() - started_at
+        return index_name, meta_prefix, index_id, item_data, values
+
+
+def enrich_row(item: dict, context: dict, timings: dict | None = None) -> t.Tuple[str, str, dict]:
+    """ Enrich one GraphQL row, returns (index name, document id, document);
+    the seconds spent in each step are added to `timings` """
+    return DocumentBuilder(context).build(item, timings)
+
+
+def enrich_rows(rows: t.List[dict], context: dict) -> dict:
+    """ Enrich and serialize a batch of rows into bulk (action, source) lines, in order.
+
+    Returns the lines with the step timings of the batch and the cache statistics of the
+    process that ran it, so a pool worker reports them along with its results, and the
+    rollup sums of the batch when the context asks for rollups.
+    """
+    timings = new_timings()
+    builder = DocumentBuilder(context)
+    actions = [builder.action(item, timings) for item in rows]
+    return {'actions': actions, 'timings': timings, 'pid': os.getpid(), 'caches': cache_stats(),
+            'rollups': builder.rollup.sums if builder.rollup is not None else None}
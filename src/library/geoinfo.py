@@ -1,98 +1,230 @@
 # -*- coding: utf-8 -*-
 import typing as t
-import geoip2.database
 import geoip2.errors
+import ipaddress
 import os
 import logging
+import threading
+from collections import OrderedDict
 
 logger = logging.getLogger(__name__)
 
+EMPTY_CITY_INFO = {
+    'city': '',
+    'country': '',
+    'country_iso_code': '',
+    'continent': '',
+    'province': '',
+    'postal_code': '',
+    'latitude': '',
+    'longitude': '',
+    'geocoding': '',
+    'is_anonymous': '',
+    'is_anonymous_vpn': '',
+    'is_public_proxy': '',
+    'is_residential_proxy': '',
+    'is_tor_exit_node': '',
+    'is_hosting_provider': '',
+}
 
-# a class that will geoip2_city_reader and geoip2_asn_reader
-# and return a dict with the geoip2 data
-class GeoInfo:
-    def __init__(self):
-        # Get the directory where this script is located (src/library/)
-        script_dir = os.path.dirname(os.path.abspath(__file__))
-        # Navigate to the db directory (src/db/)
-        db_dir = os.path.join(os.path.dirname(script_dir), 'db')
+EMPTY_ASN_INFO = {
+    'asn': '',
+    'asn_org': '',
+}
 
-        self.geoip2_city_reader = geoip2.database.Reader(os.path.join(db_dir, 'GeoLite2-City.mmdb'))
-        self.geoip2_asn_reader = geoip2.database.Reader(os.path.join(db_dir, 'GeoLite2-ASN.mmdb'))
+# field order of the tuples returned by GeoInfo.get_ip_values()
+CITY_FIELDS = tuple(EMPTY_CITY_INFO)
+ASN_FIELDS = tuple(EMPTY_ASN_INFO)
+IP_INFO_FIELDS = CITY_FIELDS + ASN_FIELDS
+EMPTY_IP_INFO_VALUES = tuple(EMPTY_CITY_INFO.values()) + tuple(EMPTY_ASN_INFO.values())
 
-    def get_asn_info(self, ip: str) -> t.Dict[str, str]:
-        try:
-            asn_data = self.geoip2_asn_reader.asn(ip)
-        except:
-            # except geoip2.errors.AddressNotFoundError as e:
-            #     print("AddressNotFoundError: {}".format(e))
-            pass
-            return {
-                'asn': '',
-                'asn_org': '',
-            }
 
-        return {
-            'asn': asn_data.autonomous_system_number,
-            'asn_org': asn_data.autonomous_system_organization,
-        }
+# a bounded LRU cache keyed by the network a MaxMind record was found in,
+# so every address inside an already resolved network is answered from memory
+class NetworkCache:
+    def __init__(self, max_size: int = 65536):
+        self.max_size = max(1, max_size)
+        self.entries = OrderedDict()
+        # ip version -> {prefix length: number of cached networks with that length}
+        self.prefix_lengths = {4: {}, 6: {}}
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.lock = threading.Lock()
 
-    def get_ip_info(self, ip: str) -> t.Dict[str, str]:
-        try:
-            city_data = self.geoip2_city_reader.city(ip)
-            asn_data = self.geoip2_asn_reader.asn(ip)
-        except:
-            # except geoip2.errors.AddressNotFoundError as e:
-            #     print("AddressNotFoundError: {}".format(e))
-            pass
+    def get(self, address: ipaddress.IPv4Address | ipaddress.IPv6Address) -> t.Tuple[bool, t.Any]:
+        """ Returns (found, value) for the cached network containing `address` """
+        version = address.version
+        address_int = int(address)
+        with self.lock:
+            for prefix_length in self.prefix_lengths[version]:
+                key = (version, prefix_length, address_int >> (address.max_prefixlen - prefix_length))
+                if key in self.entries:
+                    self.entries.move_to_end(key)
+                    self.hits += 1
+                    return True, self.entries[key]
+            self.misses += 1
+            return False, None
+
+    def put(self, network: ipaddress.IPv4Network | ipaddress.IPv6Network, value: t.Any):
+        version = network.version
+        key = (version, network.prefixlen, int(network.network_address) >> (network.max_prefixlen - network.prefixlen))
+        with self.lock:
+            if key not in self.entries:
+                counts = self.prefix_lengths[version]
+                counts[network.prefixlen] = counts.get(network.prefixlen, 0) + 1
+            self.entries[key] = value
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_size:
+                (old_version, old_prefix_length, _), _ = self.entries.popitem(last=False)
+                counts = self.prefix_lengths[old_version]
+                counts[old_prefix_length] -= 1
+                if not counts[old_prefix_length]:
+                    del counts[old_prefix_length]
+                self.evictions += 1
+
+    def stats(self) -> t.Dict[str, int]:
+        with self.lock:
             return {
-                'city': '',
-                'country': '',
-                'country_iso_code': '',
-                'continent': '',
-                'province': '',
-                'postal_code': '',
-                'latitude': '',
-                'longitude': '',
-                'geocoding': '',
-                'is_anonymous': '',
-                'is_anonymous_vpn': '',
-                'is_public_proxy': '',
-                'is_residential_proxy': '',
-                'is_tor_exit_node': '',
-                'is_hosting_provider': '',
-                'asn': '',
-                'asn_org': '',
+                'size': len(self.entries),
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
             }
 
-        asn = ''
-        asn_org = ''
-        if asn_data is not None:
-            asn = asn_data.autonomous_system_number
-            asn_org = asn_data.autonomous_system_organization
 
+# a class that will geoip2_city_reader and geoip2_asn_reader
+# and return a dict with the geoip2 data; the readers are opened on the first lookup
+class GeoInfo:
+    def __init__(self, db_dir: str | None = None, cache_size: int = 65536):
+        if db_dir is None:
+            # Get the directory where this script is located (src/library/)
+            script_dir = os.path.dirname(os.path.abspath(__file__))
+            # Navigate to the db directory (src/db/)
+            db_dir = os.path.join(os.path.dirname(script_dir), 'db')
+
+        self.db_dir = db_dir
+        self.geoip2_city_reader = None
+        self.geoip2_asn_reader = None
+        self.open_lock = threading.Lock()
+
+        self.city_cache = NetworkCache(cache_size)
+        self.asn_cache = NetworkCache(cache_size)
+
+    def database_paths(self) -> t.Tuple[str, str]:
+        return os.path.join(self.db_dir, 'GeoLite2-City.mmdb'), os.path.join(self.db_dir, 'GeoLite2-ASN.mmdb')
+
+    def missing_databases(self) -> t.List[str]:
+        """ Paths of the databases that are not there, without opening them """
+        return [path for path in self.database_paths() if not os.path.isfile(path)]
+
+    def open(self):
+        """ Open both GeoLite2 databases, a missing file raises here instead of emptying every lookup """
+        import geoip2.database
+
+        with self.open_lock:
+            if self.geoip2_asn_reader is not None:
+                return
+            city_path, asn_path = self.database_paths()
+            city_reader = geoip2.database.Reader(city_path)
+            asn_reader = geoip2.database.Reader(asn_path)
+            self.geoip2_city_reader, self.geoip2_asn_reader = city_reader, asn_reader
+
+    def cache_stats(self) -> t.Dict[str, t.Dict[str, int]]:
+        return {
+            'city': self.city_cache.stats(),
+            'asn': self.asn_cache.stats(),
+        }
+
+    @staticmethod
+    def _city_fields(city_data) -> tuple:
         latitude = ''
         longitude = ''
         if city_data is not None and city_data.city.name:
             latitude = city_data.location.latitude
             longitude = city_data.location.longitude
 
-        return {
-            'city': city_data.city.name,
-            'country': city_data.country.name,
-            'country_iso_code': city_data.country.iso_code,
-            'continent': city_data.continent.name,
-            'province': city_data.subdivisions.most_specific.name,
-            'postal_code': city_data.postal.code,
-            'latitude': latitude,
-            'longitude': longitude,
-            'geocoding': "{},{}".format(latitude, longitude),
-            'is_anonymous': city_data.traits.is_anonymous,
-            'is_anonymous_vpn': city_data.traits.is_anonymous_vpn,
-            'is_public_proxy': city_data.traits.is_public_proxy,
-            'is_residential_proxy': city_data.traits.is_residential_proxy,
-            'is_tor_exit_node': city_data.traits.is_tor_exit_node,
-            'is_hosting_provider': city_data.traits.is_hosting_provider,
-            'asn': asn,
-            'asn_org': asn_org,
-        }
+        # aligned with CITY_FIELDS
+        return (
+            city_data.city.name,
+            city_data.country.name,
+            city_data.country.iso_code,
+            city_data.continent.name,
+            city_data.subdivisions.most_specific.name,
+            city_data.postal.code,
+            latitude,
+            longitude,
+            "{},{}".format(latitude, longitude),
+            city_data.traits.is_anonymous,
+            city_data.traits.is_anonymous_vpn,
+            city_data.traits.is_public_proxy,
+            city_data.traits.is_residential_proxy,
+            city_data.traits.is_tor_exit_node,
+            city_data.traits.is_hosting_provider,
+        )
+
+    @staticmethod
+    def _asn_fields(asn_data) -> tuple:
+        # aligned with ASN_FIELDS
+        return asn_data.autonomous_system_number, asn_data.autonomous_system_organization
+
+    @staticmethod
+    def _cached_lookup(cache: NetworkCache, lookup: t.Callable, to_fields: t.Callable, address,
+                       network_of: t.Callable) -> tuple | None:
+        # None is cached too: unknown and private networks are not looked up twice
+        found, value = cache.get(address)
+        if found:
+            return value
+
+        try:
+            record = lookup(address)
+        except geoip2.errors.AddressNotFoundError as e:
+            value = None
+            network = e.network
+        else:
+            value = to_fields(record)
+            network = network_of(record)
+
+        if network is None:
+            network = ipaddress.ip_network(address)
+        cache.put(network, value)
+        return value
+
+    def _city_info(self, address) -> tuple | None:
+        return self._cached_lookup(self.city_cache, self.geoip2_city_reader.city, self._city_fields,
+                                   address, lambda record: record.traits.network)
+
+    def _asn_info(self, address) -> tuple | None:
+        return self._cached_lookup(self.asn_cache, self.geoip2_asn_reader.asn, self._asn_fields,
+                                   address, lambda record: record.network)
+
+    def get_asn_info(self, ip: str) -> t.Dict[str, str]:
+        if self.geoip2_asn_reader is None:
+            self.open()
+        try:
+            asn_info = self._asn_info(ipaddress.ip_address(ip))
+        except Exception:
+            asn_info = None
+        if asn_info is None:
+            return dict(EMPTY_ASN_INFO)
+        return dict(zip(ASN_FIELDS, asn_info))
+
+    def get_ip_values(self, ip: str) -> tuple:
+        """ City and ASN data of `ip`, aligned with IP_INFO_FIELDS """
+        if self.geoip2_asn_reader is None:
+            self.open()
+        try:
+            address = ipaddress.ip_address(ip)
+            city_info = self._city_info(address)
+            asn_info = self._asn_info(address)
+        except Exception:
+            city_info = None
+            asn_info = None
+
+        # like the uncached lookups, a miss in either database empties the whole result
+        if city_info is None or asn_info is None:
+            return EMPTY_IP_INFO_VALUES
+        return city_info + asn_info
+
+    def get_ip_info(self, ip: str) -> t.Dict[str, str]:
+        return dict(zip(IP_INFO_FIELDS, self.get_ip_values(ip)))
@@ -0,0 +1,141 @@
+# -*- coding: utf-8 -*-
+import json
+import os
+import re
+import typing as t
+
+from library.zones import ZoneConfig
+
+# dimensions available on all plans
+BASE_DIMENSIONS = (
+    'clientCountryName',
+    'clientIP',
+    'clientRequestHTTPHost',
+    'clientRequestHTTPMethodName',
+    'clientRequestPath',
+    'datetime',
+    'edgeResponseStatus',
+    'originResponseStatus',
+    'sampleInterval',
+    'userAgent',
+)
+
+# dimensions of the Bot Management / Enterprise plans, only asked for zones with include_premium_fields
+PREMIUM_DIMENSIONS = (
+    'originIP',
+    'clientRequestQuery',
+    'clientRequestReferer',
+    'clientRefererHost',
+    'clientAsn',
+    'clientASNDescription',
+    'edgeResponseContentTypeName',
+    'botManagementDecision',
+    'botScoreSrcName',
+    'securityAction',
+    'securitySource',
+    'wafAttackScore',
+    'wafAttackScoreClass',
+    'wafXssAttackScore',
+    'xRequestedWith',
+)
+
+# noise filtered out by Cloudflare before it is counted, added after the time range filter
+DEFAULT_FILTERS = (
+    {'userAgent_neq': ''},
+    {'userAgent_neq': 'test'},
+    {'clientRequestPath_notlike': '%/.well-known/%'},
+    {'clientRequestPath_neq': '//.well-known/'},
+    {'clientRequestPath_notlike': '/favicon.ico'},
+    {'clientRequestPath_notlike': '%.ico%'},
+    {'clientRequestPath_notlike': '%.gif%'},
+    {'clientRequestPath_notlike': '%wlwmanifest%'},
+    {'clientRequestPath_notlike': '%.git%'},
+    {'clientRequestPath_notlike': '%/durbin%'},
+    {'clientRequestPath_notlike': '%/Blueprint.aspx%'},
+    {'clientRequestPath_notlike': '%.jsp%'},
+    {'clientRequestPath_notlike': '%/.aws%'},
+    {'clientRequestPath_notlike': '%/.env%'},
+    {'clientRequestPath_notlike': '%/index.php%'},
+)
+
+QUERY_TEMPLATE = (
+    'query ZapTimeseriesBydatetimeGroupedByclientRequestPath('
+    '$zoneTag: string $filter: ZoneHttpRequestsAdaptiveGroupsFilter_InputObject) {{ '
+    'viewer {{ zones(filter: {{ zoneTag: $zoneTag }}) {{ '
+    'series: httpRequestsAdaptiveGroups(limit: {limit}, filter: $filter) {{ '
+    'count avg {{ sampleInterval __typename }} sum {{ edgeResponseBytes visits __typename }} '
+    'dimensions {{ {dimensions} }} __typename }} __typename }} __typename }} }}'
+)
+
+_IDENTIFIER = re.compile(r'^[A-Za-z_][A-Za-z0-9_]*$')
+
+
+def parse_dimensions(value: str | None) -> t.Tuple[str, ...] | None:
+    """ A comma-separated dimension list, None when empty (every dimension of the zone's plan) """
+    dimensions = tuple(dict.fromkeys(field.strip() for field in (value or '').split(',') if field.strip()))
+    return dimensions or None
+
+
+def load_filters(value: str | None) -> t.List[dict]:
+    """ Parse a filter list: a JSON array, or the path of a JSON file holding one, of
+    ZoneHttpRequestsAdaptiveGroupsFilter objects; an empty value is DEFAULT_FILTERS """
+    if not value or not value.strip():
+        return list(DEFAULT_FILTERS)
+
+    value = value.strip()
+    if not value.startswith('['):
+        with open(os.path.expanduser(value)) as handle:
+            value = handle.read()
+    filters = json.loads(value)
+    if not isinstance(filters, list) or not all(isinstance(entry, dict) and entry for entry in filters):
+        raise ValueError('The filter list must be a JSON array of filter objects, '
+                         'e.g. [{"clientRequestPath_notlike": "%.ico%"}]')
+    return filters
+
+
+# a class that builds the GraphQL request bodies of the adaptive groups query with json.dumps; the
+# query text only depends on the projected dimensions and the row limit and is compiled once per pair,
+# the time range and the filters are variables. `dimensions` restricts what is asked for (premium
+# dimensions are still left out for zones without include_premium_fields), `datetime` is always asked
+# for since the daily index and the document id depend on it
+class GraphQLQuery:
+    def __init__(self, filters: t.Sequence[dict] = DEFAULT_FILTERS, dimensions: t.Sequence[str] | None = None):
+        if dimensions is not None:
+            invalid = [field for field in dimensions if not _IDENTIFIER.match(field)]
+            if invalid:
+                raise ValueError(f"Invalid dimension name(s): {', '.join(invalid)}")
+            if 'datetime' not in dimensions:
+                dimensions = ('datetime',) + tuple(dimensions)
+        self.filters = list(filters)
+        self.dimensions = tuple(dimensions) if dimensions is not None else None
+        # (include premium fields, limit) -> query text, threads racing on a miss build the same text
+        self.queries = {}
+
+    def zone_dimensions(self, include_premium_fields: bool) -> t.Tuple[str, ...]:
+        available = BASE_DIMENSIONS + PREMIUM_DIMENSIONS if include_premium_fields else BASE_DIMENSIONS
+        if self.dimensions is None:
+            return available
+        if include_premium_fields:
+            return self.dimensions
+        return tuple(field for field in self.dimensions if field not in PREMIUM_DIMENSIONS)
+
+    def query(self, include_premium_fields: bool, limit: int) -> str:
+        key = (bool(include_premium_fields), int(limit))
+        query = self.queries.get(key)
+        if query is None:
+            query = QUERY_TEMPLATE.format(limit=key[1], dimensions=' '.join(self.zone_dimensions(key[0])))
+            self.queries[key] = query
+        return query
+
+    def payload(self, zone: ZoneConfig, limit: int, start_date: str, end_date: str) -> str:
+        """ The JSON body asking for the rows of `zone` in [start_date, end_date) """
+        if start_date > end_date:
+            raise ValueError(f'The start {start_date} is after the end {end_date}')
+        return json.dumps({
+            'query': self.query(zone.include_premium_fields, limit),
+            'variables': {
+                'accountTag': zone.account,
+                'zoneTag': zone.zone,
+                'filter': {'AND': [{'datetime_geq': start_date, 'datetime_lt': end_date}] + self.filters},
+            },
+        })
@@ -0,0 +1,71 @@
+# -*- coding: utf-8 -*-
+import random
+import typing as t
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+
+import requests
+from requests.adapters import HTTPAdapter
+
+# responses worth asking again: throttling, and the 5xx a gateway returns while the origin recovers
+RETRYABLE_STATUS = (429, 500, 502, 503, 504, 520, 521, 522, 523, 524)
+
+# transport errors worth asking again, the request may not even have reached the API
+RETRYABLE_ERRORS = (requests.exceptions.ConnectionError, requests.exceptions.Timeout)
+
+
+def new_session(pool_size: int = 4, headers: t.Dict[str, str] | None = None) -> requests.Session:
+    """ A long-lived session keeping up to `pool_size` connections per host open (one per
+    concurrent window), so TLS handshakes are paid once instead of per request """
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=max(1, pool_size))
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    session.headers.update({'Accept-Encoding': 'gzip, deflate'})
+    if headers:
+        session.headers.update(headers)
+    return session
+
+
+def new_async_session(pool_size: int = 4, connect_timeout: float = 10, read_timeout: float = 120,
+                      verify_tls: bool = True):
+    """ new_session() for the asyncio engine: an aiohttp session keeping up to `pool_size`
+    connections open, to be closed by the caller """
+    import aiohttp
+
+    connector = aiohttp.TCPConnector(limit=max(1, pool_size), ssl=None if verify_tls else False)
+    timeout = aiohttp.ClientTimeout(sock_connect=connect_timeout, sock_read=read_timeout)
+    return aiohttp.ClientSession(connector=connector, timeout=timeout,
+                                 headers={'Accept-Encoding': 'gzip, deflate'})
+
+
+def async_retryable_errors() -> tuple:
+    """ RETRYABLE_ERRORS of an aiohttp session """
+    import asyncio
+    import aiohttp
+
+    return aiohttp.ClientConnectionError, asyncio.TimeoutError
+
+
+def retry_after(response) -> float | None:
+    """ Seconds to wait according to the response's Retry-After header (seconds or HTTP date),
+    of a requests or an aiohttp response """
+    value = response.headers.get('Retry-After')
+    if not value:
+        return None
+    value = value.strip()
+    if value.isdigit():
+        return float(value)
+    try:
+        retry_at = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    if retry_at.tzinfo is None:
+        retry_at = retry_at.replace(tzinfo=timezone.utc)
+    return max(0.0, (retry_at - datetime.now(timezone.utc)).total_seconds())
+
+
+def backoff(attempt: int, initial: float = 5, maximum: float = 120) -> float:
+    """ Exponential backoff with jitter: between half and all of initial * 2^attempt, capped """
+    delay = min(initial * (2 ** attempt), maximum)
+    return delay / 2 + random.uniform(0, delay / 2)
@@ -0,0 +1,162 @@
+# -*- coding: utf-8 -*-
+import logging
+import threading
+import typing as t
+
+from library.iohelper import REFERER_FIELDS, REQUEST_QUERY_FIELDS
+
+logger = logging.getLogger(__name__)
+
+# fields that are not plain keywords; empty strings stand for "unknown" in the documents,
+# so every non-keyword field ignores malformed values instead of rejecting the document
+DATE_FIELDS = ('datetime', 'log_pull_batch_datetime')
+IP_FIELDS = ('clientIP', 'originIP')
+SHORT_FIELDS = ('edgeResponseStatus', 'originResponseStatus', 'wafAttackScore', 'wafXssAttackScore')
+LONG_FIELDS = ('count', 'sum_edgeResponseBytes', 'sum_visits', 'clientAsn', 'clientRequest_geoip_asn')
+FLOAT_FIELDS = ('sampleInterval', 'avg_sampleInterval', 'clientRequest_geoip_latitude',
+                'clientRequest_geoip_longitude')
+BOOLEAN_FIELDS = (
+    'clientRequest_geoip_is_anonymous',
+    'clientRequest_geoip_is_anonymous_vpn',
+    'clientRequest_geoip_is_public_proxy',
+    'clientRequest_geoip_is_residential_proxy',
+    'clientRequest_geoip_is_tor_exit_node',
+    'clientRequest_geoip_is_hosting_provider',
+)
+GEO_POINT_FIELDS = ('clientRequest_geoip_geocoding',)
+# keywords that can be long, every other string is a keyword of up to 1024 characters
+LONG_KEYWORD_FIELDS = ('userAgent', 'clientRequestPath', 'clientRequestQuery', 'clientRequestReferer',
+                       'clientRefererPath', 'clientRefererQuery')
+# identifiers and marketing fields, mapped up front so their type never depends on the first document
+KEYWORD_FIELDS = (
+    'accountTag',
+    'zoneTag',
+    'log_pull_batch_name',
+    'clientCountryName',
+    'clientRequest_CountryCode',
+    'clientRequest_CountryName',
+    'clientRequestHTTPHost',
+    'clientRequestHTTPMethodName',
+    'clientRefererHost',
+    'clientASNDescription',
+    'clientRequest_geoip_asn_org',
+    'clientRequest_geoip_country_iso_code',
+) + REQUEST_QUERY_FIELDS + tuple(field for field in REFERER_FIELDS if field not in LONG_KEYWORD_FIELDS)
+
+
+def mappings() -> dict:
+    properties = {}
+    for field in KEYWORD_FIELDS:
+        properties[field] = {'type': 'keyword', 'ignore_above': 1024}
+    for field in LONG_KEYWORD_FIELDS:
+        properties[field] = {'type': 'keyword', 'ignore_above': 8191}
+    for field in DATE_FIELDS:
+        properties[field] = {'type': 'date', 'format': 'strict_date_optional_time||epoch_millis',
+                             'ignore_malformed': True}
+    for fields, field_type in ((IP_FIELDS, 'ip'), (SHORT_FIELDS, 'short'), (LONG_FIELDS, 'long'),
+                               (FLOAT_FIELDS, 'float'), (GEO_POINT_FIELDS, 'geo_point')):
+        for field in fields:
+            properties[field] = {'type': field_type, 'ignore_malformed': True}
+    for field in BOOLEAN_FIELDS:
+        properties[field] = {'type': 'boolean'}
+
+    return {
+        # any other string field is a keyword too, instead of a dynamic text + keyword pair
+        'dynamic_templates': [
+            {'strings_as_keywords': {
+                'match_mapping_type': 'string',
+                'mapping': {'type': 'keyword', 'ignore_above': 1024},
+            }},
+        ],
+        'properties': properties,
+    }
+
+
+# a class that installs the index template of the daily indices and, during a backfill,
+# switches the indices being written to ingest settings (no refresh, no replicas) until
+# their day is complete, then restores the template settings and optionally force-merges
+class IndexLifecycle:
+    def __init__(self, client, template_name: str, index_prefixes: t.Iterable[str], shards: int = 1,
+                 replicas: int = 1, refresh_interval: str = '1s', bulk_settings: bool = False,
+                 force_merge_segments: int = 0, request_timeout: float = 600):
+        self.client = client
+        self.template_name = template_name
+        self.index_prefixes = sorted(set(index_prefixes))
+        self.shards = shards
+        self.replicas = replicas
+        self.refresh_interval = refresh_interval
+        self.bulk_settings = bulk_settings
+        self.force_merge_segments = force_merge_segments
+        self.request_timeout = request_timeout
+        self.prepared = set()
+        self.lock = threading.Lock()
+
+    def template(self) -> dict:
+        return {
+            'index_patterns': [prefix + '*' for prefix in self.index_prefixes],
+            'priority': 100,
+            'template': {
+                'settings': {
+                    'index': {
+                        'number_of_shards': self.shards,
+                        'number_of_replicas': self.replicas,
+                        'refresh_interval': self.refresh_interval,
+                    },
+                },
+                'mappings': mappings(),
+            },
+            '_meta': {'managed_by': 'PyLogShipper-cf2os'},
+        }
+
+    def install_template(self):
+        self.client.indices.put_index_template(name=self.template_name, body=self.template())
+        logger.info("Installed index template %s for %s", self.template_name,
+                    ', '.join(prefix + '*' for prefix in self.index_prefixes))
+
+    def prepare(self, index_name: str):
+        """ Create `index_name` if needed and turn off refreshes and replicas while it is backfilled """
+        from opensearchpy.exceptions import RequestError
+
+        if not self.bulk_settings:
+            return
+        # held across the calls: a window of the same day waits until its index is ready, and the
+        # index is only recorded once its settings were changed, so a failure is tried again
+        with self.lock:
+            if index_name in self.prepared:
+                return
+            if not self.client.indices.exists(index=index_name):
+                try:
+                    self.client.indices.create(index=index_name)
+                except RequestError as err:
+                    # created meanwhile, e.g. by a bulk request of a window that did not wait
+                    if err.error != 'resource_already_exists_exception':
+                        raise
+            self.client.indices.put_settings(index=index_name, body={
+                'index': {'refresh_interval': '-1', 'number_of_replicas': 0}})
+            self.prepared.add(index_name)
+        logger.info("Index %s switched to backfill settings", index_name)
+
+    def finish(self, index_name: str):
+        """ Restore the template settings of a backfilled index and force-merge it if configured """
+        with self.lock:
+            if index_name not in self.prepared:
+                return
+            self.prepared.discard(index_name)
+
+        self.client.indices.put_settings(index=index_name, body={
+            'index': {'refresh_interval': self.refresh_interval, 'number_of_replicas': self.replicas}})
+        if self.force_merge_segments > 0:
+            self.client.indices.forcemerge(index=index_name, max_num_segments=self.force_merge_segments,
+                                           request_timeout=self.request_timeout)
+        logger.info("Index %s restored to refresh_interval=%s replicas=%s%s", index_name, self.refresh_interval,
+                    self.replicas, f' and merged to {self.force_merge_segments} segment(s)'
+                    if self.force_merge_segments > 0 else '')
+
+    def finish_all(self):
+        with self.lock:
+            remaining = sorted(self.prepared)
+        for index_name in remaining:
+            try:
+                self.finish(index_name)
+            except Exception as err:
+                logger.error("Could not restore the settings of %s: %s", index_name, err)
@@ -1,10 +1,9 @@
 # -*- coding: utf-8 -*-
-import pycountry
-from ua_parser import user_agent_parser
-from library.parseurl import ParseURL
-from urllib.parse import parse_qs
+import functools
+import hashlib
+from urllib.parse import parse_qs, parse_qsl, urlsplit
 
-url_parser = ParseURL()
+from library.countries import COUNTRY_NAMES
 
 
 def flatten_dict(dd, separator='_', prefix=''):
@@ -24,6 +23,18 @@ def merge_two_dicts(dict_x, dict_y):
     return dict_z
 
 
+def document_id(zone: str | None, dimensions: dict) -> str:
+    """ Content-derived id of a GraphQL row: zone, datetime and every dimension, in key order """
+    digest = hashlib.blake2b(digest_size=16)
+    digest.update((zone or '').encode())
+    digest.update(b'\x1f')
+    digest.update(str(dimensions.get('datetime', '')).encode())
+    for key in sorted(dimensions):
+        digest.update(b'\x1f')
+        digest.update(f'{key}={dimensions[key]}'.encode())
+    return digest.hexdigest()
+
+
 def normalize_country(country_name: str | None):
     if country_name is None:
         return ''
@@ -32,18 +43,8 @@ def normalize_country(country_name: str | None):
     if not isinstance(country_name, str):
         return country_name
 
-    try:
-        country_name_result = pycountry.countries.get(alpha_2=country_name)
-        if country_name_result is not None:
-            country_name = country_name_result.name
-        else:
-            country_name = ''
-
-    except Exception as e:
-        print(e)
-        pass
-
-    return country_name
+    # alpha-2 codes are matched case-insensitively, like pycountry does
+    return COUNTRY_NAMES.get(country_name) or COUNTRY_NAMES.get(country_name.upper(), '')
 
 
 def normalize_string(input_string: str | None, max_length: int = 250):
@@ -63,183 +64,173 @@ def normalize_string(input_string: str | None, max_length: int = 250):
     return input_string
 
 
-def parse_browser_agent(agent_string: str) -> dict:
-    parsed_string = user_agent_parser.Parse(agent_string)
-    data_result = {
-        'user_agent_device_family': parsed_string.get("device").get("family"),
-        'user_agent_device_brand': parsed_string.get("device").get("brand"),
-        'user_agent_device_model': parsed_string.get("device").get("model"),
-        'user_agent_platform_family': parsed_string.get("os").get("family"),
-        'user_agent_platform_major': parsed_string.get("os").get("major"),
-        'user_agent_platform_minor': parsed_string.get("os").get("minor"),
-        'user_agent_platform_patch': parsed_string.get("os").get("patch"),
-        'user_agent_family': parsed_string.get("user_agent").get("family"),
-        'user_agent_major': parsed_string.get("user_agent").get("major"),
-        'user_agent_minor': parsed_string.get("user_agent").get("minor"),
-        'user_agent_patch': parsed_string.get("user_agent").get("patch"),
-    }
-
-    return data_result
-
-
-def parse_url(url):
-    parse_result = url_parser.parse_url(url)
-
-    dict_result = parse_qs(parse_result["query"])
-
-    url_dict = {
-        'scheme': '',
-        'hostname': '',
-        'path': '',
-        'query': '',
-        'utm_source': '',
-        'utm_medium': '',
-        'utm_campaign': '',
-        'utm_content': '',
-        'utm_term': '',
-        'utm_campaign_id': '',
-        'utm_id': '',
-        'utm_ad_id': '',
-        'utm_source_platform': '',
-        'utm_creative_format': '',
-        'utm_marketing_tactic': '',
-        'utm_creative_id': '',
-        'product': '',
-        'search_keyword': '',
-        'li_fat_id': '',
-        'fbclid': '',
-        'msclkid': '',
-        'gclid': '',
-        'hsa_acc': '',
-        'hsa_cam': '',
-        'hsa_grp': '',
-        'hsa_ad': '',
-        'hsa_src': '',
-        'hsa_tgt': '',
-        'hsa_kw': '',
-        'hsa_mt': '',
-        'hsa_net': '',
-        'hsa_ver': '',
-        'gad_source': '',
-        'gad_campaignid': '',
+@functools.cache
+def user_agent_parser():
+    """ The user agent parser, built on first use: compiling the rules takes a few hundred ms """
+    import ua_parser
+
+    # fastest backend installed: ua-parser-rs, then google-re2, then the pure python matcher
+    if ua_parser.RegexResolver is not None:
+        return ua_parser.Parser(ua_parser.RegexResolver(ua_parser.load_lazy_builtins()))
+    if ua_parser.Re2Resolver is not None:
+        return ua_parser.Parser(ua_parser.Re2Resolver(ua_parser.load_lazy_builtins()))
+    return ua_parser.Parser(ua_parser.BasicResolver(ua_parser.load_builtins()))
+
+
+USER_AGENT_FIELDS = (
+    'user_agent_device_family',
+    'user_agent_device_brand',
+    'user_agent_device_model',
+    'user_agent_platform_family',
+    'user_agent_platform_major',
+    'user_agent_platform_minor',
+    'user_agent_platform_patch',
+    'user_agent_family',
+    'user_agent_major',
+    'user_agent_minor',
+    'user_agent_patch',
+)
+
+
+def _parse_browser_agent(agent_string: str) -> tuple:
+    parsed_string = user_agent_parser().parse(agent_string)
+    # unmatched parts default like the legacy user_agent_parser.Parse result
+    device = parsed_string.device
+    platform = parsed_string.os
+    agent = parsed_string.user_agent
+    return (
+        device.family if device else 'Other',
+        device.brand if device else None,
+        device.model if device else None,
+        platform.family if platform else 'Other',
+        platform.major if platform else None,
+        platform.minor if platform else None,
+        platform.patch if platform else None,
+        agent.family if agent else 'Other',
+        agent.major if agent else None,
+        agent.minor if agent else None,
+        agent.patch if agent else None,
+    )
+
+
+_cached_parse_browser_agent = functools.lru_cache(maxsize=4096)(_parse_browser_agent)
+
+
+def set_user_agent_cache_size(max_size: int):
+    """ Replace the user agent cache with an empty one holding up to `max_size` strings """
+    global _cached_parse_browser_agent
+    _cached_parse_browser_agent = functools.lru_cache(maxsize=max_size)(_parse_browser_agent)
+
+
+def user_agent_cache_stats() -> dict:
+    info = _cached_parse_browser_agent.cache_info()
+    lookups = info.hits + info.misses
+    return {
+        'size': info.currsize,
+        'max_size': info.maxsize,
+        'hits': info.hits,
+        'misses': info.misses,
+        'hit_rate': info.hits / lookups if lookups else 0.0,
     }
 
-    # if utm_source is not in the query string, return None
-    if parse_result['scheme'] is not None:
-        url_dict['scheme'] = parse_result['scheme']
-
-    if parse_result['hostname'] is not None:
-        url_dict['hostname'] = parse_result['hostname']
-
-    if parse_result['path'] is not None:
-        url_dict['path'] = parse_result['path']
-
-    if parse_result['query'] is not None:
-        url_dict['query'] = parse_result['query']
-
-    if 'utm_source' in dict_result:
-        url_dict['utm_source'] = dict_result['utm_source'][0]
-
-    if 'utm_medium' in dict_result:
-        url_dict['utm_medium'] = dict_result['utm_medium'][0]
-
-    if 'utm_campaign' in dict_result:
-        url_dict['utm_campaign'] = dict_result['utm_campaign'][0]
-
-    if 'utm_campaign_id' in dict_result:
-        url_dict['utm_campaign_id'] = dict_result['utm_campaign_id'][0]
-
-    if 'utm_id' in dict_result:
-        url_dict['utm_id'] = dict_result['utm_id'][0]
-
-    if 'utm_ad_id' in dict_result:
-        url_dict['utm_ad_id'] = dict_result['utm_ad_id'][0]
-
-    if 'utm_content' in dict_result:
-        url_dict['utm_content'] = dict_result['utm_content'][0]
-
-    if 'utm_term' in dict_result:
-        url_dict['utm_term'] = normalize_string(dict_result['utm_term'][0])
-
-    if 'utm_source_platform' in dict_result:
-        url_dict['utm_source_platform'] = dict_result['utm_source_platform'][0]
 
-    if 'utm_creative_format' in dict_result:
-        url_dict['utm_creative_format'] = dict_result['utm_creative_format'][0]
+def parse_browser_agent_values(agent_string: str) -> tuple:
+    """ Device, platform and browser of a user agent string, aligned with USER_AGENT_FIELDS """
+    return _cached_parse_browser_agent(agent_string)
 
-    if 'utm_marketing_tactic' in dict_result:
-        url_dict['utm_marketing_tactic'] = dict_result['utm_marketing_tactic'][0]
 
-    if 'utm_creative_id' in dict_result:
-        url_dict['utm_creative_id'] = dict_result['utm_creative_id'][0]
-
-    if 'product' in dict_result:
-        url_dict['product'] = dict_result['product'][0]
-
-    if 'ask' in dict_result:
-        url_dict['search_keyword'] = normalize_string(dict_result['ask'][0])
-
-    if 'searchfor' in dict_result:
-        url_dict['search_keyword'] = normalize_string(
-            dict_result['searchfor'][0])
-
-    if 'wd' in dict_result:
-        url_dict['search_keyword'] = normalize_string(dict_result['wd'][0])
+def parse_browser_agent(agent_string: str) -> dict:
+    return dict(zip(USER_AGENT_FIELDS, _cached_parse_browser_agent(agent_string)))
+
+
+# Marketing parameters extracted from a URL query string, in document order:
+# (field, query parameters in increasing priority - the last one present wins, normalize)
+URL_PARAMETERS = (
+    ('utm_source', ('utm_source',), False),
+    ('utm_medium', ('utm_medium',), False),
+    ('utm_campaign', ('utm_campaign',), False),
+    ('utm_content', ('utm_content',), False),
+    ('utm_term', ('utm_term',), True),
+    ('utm_campaign_id', ('utm_campaign_id',), False),
+    ('utm_id', ('utm_id',), False),
+    ('utm_ad_id', ('utm_ad_id',), False),
+    ('utm_source_platform', ('utm_source_platform',), False),
+    ('utm_creative_format', ('utm_creative_format',), False),
+    ('utm_marketing_tactic', ('utm_marketing_tactic',), False),
+    ('utm_creative_id', ('utm_creative_id',), False),
+    ('product', ('product',), False),
+    ('search_keyword', ('ask', 'searchfor', 'wd', 'kw', 'Q', 'query', 'q'), True),
+    # LinkedIn, Facebook, Microsoft Ads and Google Ads auto-tagging
+    ('li_fat_id', ('li_fat_id',), False),
+    ('fbclid', ('fbclid',), False),
+    ('msclkid', ('msclkid',), False),
+    ('gclid', ('gclid',), False),
+    # Google Ads manual tagging (hsa_* parameters)
+    ('hsa_acc', ('hsa_acc',), False),
+    ('hsa_cam', ('hsa_cam',), False),
+    ('hsa_grp', ('hsa_grp',), False),
+    ('hsa_ad', ('hsa_ad',), False),
+    ('hsa_src', ('hsa_src',), False),
+    ('hsa_tgt', ('hsa_tgt',), False),
+    ('hsa_kw', ('hsa_kw',), True),
+    ('hsa_mt', ('hsa_mt',), False),
+    ('hsa_net', ('hsa_net',), False),
+    ('hsa_ver', ('hsa_ver',), False),
+    # Google Ads enhanced parameters (gad_* parameters)
+    ('gad_source', ('gad_source',), False),
+    ('gad_campaignid', ('gad_campaignid',), False),
+)
+
+URL_PARTS = ('scheme', 'hostname', 'path', 'query')
+URL_FIELDS = URL_PARTS + tuple(field for field, _, _ in URL_PARAMETERS)
+
+# query parameter -> (position in URL_FIELDS, priority)
+_URL_PARAMETER_SLOTS = {
+    parameter: (len(URL_PARTS) + position, priority)
+    for position, (_, parameters, _) in enumerate(URL_PARAMETERS)
+    for priority, parameter in enumerate(parameters)
+}
+_URL_NORMALIZED_SLOTS = tuple(
+    len(URL_PARTS) + position for position, (_, _, normalize) in enumerate(URL_PARAMETERS) if normalize)
+_EMPTY_URL_VALUES = ('',) * len(URL_FIELDS)
+
+
+@functools.lru_cache(maxsize=8192)
+def parse_url_values(url: str | None) -> tuple:
+    """ Scheme, hostname, path, query and marketing parameters of `url`, aligned with URL_FIELDS """
+    if not url:
+        return _EMPTY_URL_VALUES
 
-    if 'kw' in dict_result:
-        url_dict['search_keyword'] = normalize_string(dict_result['kw'][0])
+    try:
+        parsed = urlsplit(url)
+        values = [parsed.scheme, parsed.hostname or '', parsed.path, parsed.query]
+    except ValueError:
+        return _EMPTY_URL_VALUES
 
-    if 'Q' in dict_result:
-        url_dict['search_keyword'] = normalize_string(dict_result['Q'][0])
+    values.extend(_EMPTY_URL_VALUES[len(URL_PARTS):])
+    if not parsed.query:
+        return tuple(values)
 
-    if 'query' in dict_result:
-        url_dict['search_keyword'] = normalize_string(dict_result['query'][0])
+    # one pass over the query string, the first value of a parameter is kept like parse_qs()[0]
+    priorities = {}
+    for parameter, value in parse_qsl(parsed.query):
+        slot = _URL_PARAMETER_SLOTS.get(parameter)
+        if slot is None:
+            continue
+        position, priority = slot
+        if priorities.get(position, -1) < priority:
+            priorities[position] = priority
+            values[position] = value
 
-    if 'q' in dict_result:
-        url_dict['search_keyword'] = normalize_string(dict_result['q'][0])
-
-    # Microsoft Ads auto-tagging
-    if 'msclkid' in dict_result:
-        url_dict['msclkid'] = dict_result['msclkid'][0]
-    # Google Ads auto-tagging
-    if 'gclid' in dict_result:
-        url_dict['gclid'] = dict_result['gclid'][0]
-    # LinkedIn auto-tagging
-    if 'li_fat_id' in dict_result:
-        url_dict['li_fat_id'] = dict_result['li_fat_id'][0]
-    # Facebook auto-tagging
-    if 'fbclid' in dict_result:
-        url_dict['fbclid'] = dict_result['fbclid'][0]
+    for position in _URL_NORMALIZED_SLOTS:
+        if position in priorities:
+            values[position] = normalize_string(values[position])
 
-    # Google Ads manual tagging (hsa_* parameters)
-    if 'hsa_acc' in dict_result:
-        url_dict['hsa_acc'] = dict_result['hsa_acc'][0]
-    if 'hsa_cam' in dict_result:
-        url_dict['hsa_cam'] = dict_result['hsa_cam'][0]
-    if 'hsa_grp' in dict_result:
-        url_dict['hsa_grp'] = dict_result['hsa_grp'][0]
-    if 'hsa_ad' in dict_result:
-        url_dict['hsa_ad'] = dict_result['hsa_ad'][0]
-    if 'hsa_src' in dict_result:
-        url_dict['hsa_src'] = dict_result['hsa_src'][0]
-    if 'hsa_tgt' in dict_result:
-        url_dict['hsa_tgt'] = dict_result['hsa_tgt'][0]
-    if 'hsa_kw' in dict_result:
-        url_dict['hsa_kw'] = normalize_string(dict_result['hsa_kw'][0])
-    if 'hsa_mt' in dict_result:
-        url_dict['hsa_mt'] = dict_result['hsa_mt'][0]
-    if 'hsa_net' in dict_result:
-        url_dict['hsa_net'] = dict_result['hsa_net'][0]
-    if 'hsa_ver' in dict_result:
-        url_dict['hsa_ver'] = dict_result['hsa_ver'][0]
+    return tuple(values)
 
-    # Google Ads enhanced parameters (gad_* parameters)
-    if 'gad_source' in dict_result:
-        url_dict['gad_source'] = dict_result['gad_source'][0]
-    if 'gad_campaignid' in dict_result:
-        url_dict['gad_campaignid'] = dict_result['gad_campaignid'][0]
 
-    return url_dict
+def parse_url(url):
+    return dict(zip(URL_FIELDS, parse_url_values(url)))
 
 
 def get_search_keyword(query_string: str | None = None):
@@ -369,80 +360,14 @@ def get_http_code_desc(http_status_code: str | None = None):
         # return f'{http_status_code} - {desc}'
 
 
-def parse_client_referer_url_string(url_string: str) -> dict:
-    parsed_url_result = parse_url(url_string)
-    utm_dict = {
-        'clientRefererScheme': parsed_url_result['scheme'],
-        'clientRefererHost': parsed_url_result['hostname'],
-        'clientRefererPath': parsed_url_result['path'],
-        'clientRefererQuery': parsed_url_result['query'],
-        'clientReferer_utm_source': parsed_url_result['utm_source'],
-        'clientReferer_utm_medium': parsed_url_result['utm_medium'],
-        'clientReferer_utm_campaign': parsed_url_result['utm_campaign'],
-        'clientReferer_utm_content': parsed_url_result['utm_content'],
-        'clientReferer_utm_term': parsed_url_result['utm_term'],
-        'clientReferer_utm_campaign_id': parsed_url_result['utm_campaign_id'],
-        'clientReferer_utm_id': parsed_url_result['utm_id'],
-        'clientReferer_utm_ad_id': parsed_url_result['utm_ad_id'],
-        'clientReferer_utm_source_platform': parsed_url_result['utm_source_platform'],
-        'clientReferer_utm_creative_format': parsed_url_result['utm_creative_format'],
-        'clientReferer_utm_marketing_tactic': parsed_url_result['utm_marketing_tactic'],
-        'clientReferer_utm_creative_id': parsed_url_result['utm_creative_id'],
-        'clientReferer_product': parsed_url_result['product'],
-        'clientReferer_search_keyword': parsed_url_result['search_keyword'],
-        'clientReferer_li_fat_id': parsed_url_result['li_fat_id'],
-        'clientReferer_fbclid': parsed_url_result['fbclid'],
-        'clientReferer_msclkid': parsed_url_result['msclkid'],
-        'clientReferer_gclid': parsed_url_result['gclid'],
-        'clientReferer_hsa_acc': parsed_url_result['hsa_acc'],
-        'clientReferer_hsa_cam': parsed_url_result['hsa_cam'],
-        'clientReferer_hsa_grp': parsed_url_result['hsa_grp'],
-        'clientReferer_hsa_ad': parsed_url_result['hsa_ad'],
-        'clientReferer_hsa_src': parsed_url_result['hsa_src'],
-        'clientReferer_hsa_tgt': parsed_url_result['hsa_tgt'],
-        'clientReferer_hsa_kw': parsed_url_result['hsa_kw'],
-        'clientReferer_hsa_mt': parsed_url_result['hsa_mt'],
-        'clientReferer_hsa_net': parsed_url_result['hsa_net'],
-        'clientReferer_hsa_ver': parsed_url_result['hsa_ver'],
-        'clientReferer_gad_source': parsed_url_result['gad_source'],
-        'clientReferer_gad_campaignid': parsed_url_result['gad_campaignid']
-    }
+REFERER_FIELDS = ('clientRefererScheme', 'clientRefererHost', 'clientRefererPath', 'clientRefererQuery') + \
+    tuple('clientReferer_' + field for field in URL_FIELDS[len(URL_PARTS):])
+REQUEST_QUERY_FIELDS = tuple('clientRequest_' + field for field in URL_FIELDS[len(URL_PARTS):])
 
-    return utm_dict
+
+def parse_client_referer_url_string(url_string: str) -> dict:
+    return dict(zip(REFERER_FIELDS, parse_url_values(url_string)))
 
 
 def parse_client_request_query_string(url_string: str) -> dict:
-    parsed_url_result = parse_url(url_string)
-    utm_dict = {
-        'clientRequest_utm_source': parsed_url_result['utm_source'],
-        'clientRequest_utm_medium': parsed_url_result['utm_medium'],
-        'clientRequest_utm_campaign': parsed_url_result['utm_campaign'],
-        'clientRequest_utm_content': parsed_url_result['utm_content'],
-        'clientRequest_utm_term': parsed_url_result['utm_term'],
-        'clientRequest_utm_id': parsed_url_result['utm_id'],
-        'clientRequest_utm_campaign_id': parsed_url_result['utm_campaign_id'],
-        'clientRequest_utm_ad_id': parsed_url_result['utm_ad_id'],
-        'clientRequest_utm_source_platform': parsed_url_result['utm_source_platform'],
-        'clientRequest_utm_creative_format': parsed_url_result['utm_creative_format'],
-        'clientRequest_utm_marketing_tactic': parsed_url_result['utm_marketing_tactic'],
-        'clientRequest_utm_creative_id': parsed_url_result['utm_creative_id'],
-        'clientRequest_product': parsed_url_result['product'],
-        'clientRequest_search_keyword': parsed_url_result['search_keyword'],
-        'clientRequest_li_fat_id': parsed_url_result['li_fat_id'],
-        'clientRequest_fbclid': parsed_url_result['fbclid'],
-        'clientRequest_msclkid': parsed_url_result['msclkid'],
-        'clientRequest_gclid': parsed_url_result['gclid'],
-        'clientRequest_hsa_acc': parsed_url_result['hsa_acc'],
-        'clientRequest_hsa_cam': parsed_url_result['hsa_cam'],
-        'clientRequest_hsa_grp': parsed_url_result['hsa_grp'],
-        'clientRequest_hsa_ad': parsed_url_result['hsa_ad'],
-        'clientRequest_hsa_src': parsed_url_result['hsa_src'],
-        'clientRequest_hsa_tgt': parsed_url_result['hsa_tgt'],
-        'clientRequest_hsa_kw': parsed_url_result['hsa_kw'],
-        'clientRequest_hsa_mt': parsed_url_result['hsa_mt'],
-        'clientRequest_hsa_net': parsed_url_result['hsa_net'],
-        'clientRequest_hsa_ver': parsed_url_result['hsa_ver'],
-        'clientRequest_gad_source': parsed_url_result['gad_source'],
-        'clientRequest_gad_campaignid': parsed_url_result['gad_campaignid']
-    }
-    return utm_dict
+    return dict(zip(REQUEST_QUERY_FIELDS, parse_url_values(url_string)[len(URL_PARTS):]))
@@ -0,0 +1,22 @@
+# -*- coding: utf-8 -*-
+import threading
+import typing as t
+
+
+# a stand-in for an object that is slow to build or whose library is slow to import, e.g. the
+# OpenSearch client: `factory` builds it on the first attribute access, which is then forwarded
+class LazyObject:
+    def __init__(self, factory: t.Callable[[], t.Any]):
+        self._factory = factory
+        self._object = None
+        self._lock = threading.Lock()
+
+    def get(self) -> t.Any:
+        if self._object is None:
+            with self._lock:
+                if self._object is None:
+                    self._object = self._factory()
+        return self._object
+
+    def __getattr__(self, name: str) -> t.Any:
+        return getattr(self.get(), name)
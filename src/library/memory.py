@@ -0,0 +1,26 @@
+# -*- coding: utf-8 -*-
+import os
+import sys
+
+try:
+    import resource
+except ImportError:  # not available on Windows
+    resource = None
+
+
+def rss_bytes() -> int:
+    """ Current resident set size of this process, 0 when it cannot be read """
+    try:
+        with open('/proc/self/statm') as statm:
+            return int(statm.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, IndexError):
+        return 0
+
+
+def peak_rss_bytes() -> int:
+    """ Highest resident set size of this process so far, 0 when it cannot be read """
+    if resource is None:
+        return 0
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in bytes on macOS and in kilobytes elsewhere
+    return peak if sys.platform == 'darwin' else peak * 1024
@@ -0,0 +1,139 @@
+# -*- coding: utf-8 -*-
+import bisect
+import logging
+import math
+import threading
+import typing as t
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+logger = logging.getLogger(__name__)
+
+COUNTER = 'counter'
+GAUGE = 'gauge'
+HISTOGRAM = 'histogram'
+
+# seconds, from a single fast enrichment batch up to a slow multi-minute window
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+
+
+def _format_value(value: float) -> str:
+    if math.isinf(value):
+        return '+Inf' if value > 0 else '-Inf'
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+def _format_labels(labels: t.Tuple[t.Tuple[str, str], ...]) -> str:
+    if not labels:
+        return ''
+    escaped = (str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+               for _, value in labels)
+    return '{' + ','.join(f'{name}="{value}"' for (name, _), value in zip(labels, escaped)) + '}'
+
+
+# a thread-safe set of counters, gauges and histograms, keyed by name and labels,
+# rendered in the Prometheus text exposition format
+class MetricsRegistry:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.metrics = {}
+
+    def _declare(self, name: str, kind: str, help_text: str, buckets: t.Sequence[float] = ()):
+        with self.lock:
+            self.metrics.setdefault(name, {'type': kind, 'help': help_text, 'buckets': tuple(buckets), 'values': {}})
+
+    def counter(self, name: str, help_text: str):
+        self._declare(name, COUNTER, help_text)
+
+    def gauge(self, name: str, help_text: str):
+        self._declare(name, GAUGE, help_text)
+
+    def histogram(self, name: str, help_text: str, buckets: t.Sequence[float] = DEFAULT_BUCKETS):
+        self._declare(name, HISTOGRAM, help_text, sorted(buckets))
+
+    def inc(self, name: str, value: float = 1, **labels):
+        key = tuple(sorted(labels.items()))
+        with self.lock:
+            values = self.metrics[name]['values']
+            values[key] = values.get(key, 0) + value
+
+    def set(self, name: str, value: float, **labels):
+        key = tuple(sorted(labels.items()))
+        with self.lock:
+            self.metrics[name]['values'][key] = value
+
+    def observe(self, name: str, value: float, **labels):
+        key = tuple(sorted(labels.items()))
+        with self.lock:
+            metric = self.metrics[name]
+            observed = metric['values'].get(key)
+            if observed is None:
+                # per-bucket counts (the last one is +Inf), sum, count
+                observed = metric['values'][key] = [[0] * (len(metric['buckets']) + 1), 0.0, 0]
+            observed[0][bisect.bisect_left(metric['buckets'], value)] += 1
+            observed[1] += value
+            observed[2] += 1
+
+    def value(self, name: str, **labels) -> t.Any:
+        """ Current value of a counter or gauge, or (sum, count) of a histogram """
+        key = tuple(sorted(labels.items()))
+        with self.lock:
+            metric = self.metrics[name]
+            observed = metric['values'].get(key)
+            if metric['type'] == HISTOGRAM:
+                return (observed[1], observed[2]) if observed else (0.0, 0)
+            return observed or 0
+
+    def render(self) -> str:
+        lines = []
+        with self.lock:
+            for name, metric in sorted(self.metrics.items()):
+                lines.append(f"# HELP {name} {metric['help']}")
+                lines.append(f"# TYPE {name} {metric['type']}")
+                for key, observed in sorted(metric['values'].items()):
+                    if metric['type'] != HISTOGRAM:
+                        lines.append(f'{name}{_format_labels(key)} {_format_value(observed)}')
+                        continue
+                    cumulative = 0
+                    for bound, count in zip(metric['buckets'] + (math.inf,), observed[0]):
+                        cumulative += count
+                        bucket_key = key + (('le', _format_value(bound)),)
+                        lines.append(f'{name}_bucket{_format_labels(bucket_key)} {cumulative}')
+                    lines.append(f'{name}_sum{_format_labels(key)} {_format_value(observed[1])}')
+                    lines.append(f'{name}_count{_format_labels(key)} {observed[2]}')
+        return '\n'.join(lines) + '\n'
+
+
+# a class that serves a registry on http://<address>:<port>/metrics from a daemon thread
+class MetricsServer:
+    def __init__(self, registry: MetricsRegistry, port: int, address: str = ''):
+        self.registry = registry
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split('?')[0] not in ('/metrics', '/'):
+                    self.send_error(404)
+                    return
+                body = registry.render().encode('utf-8')
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                logger.debug("metrics %s - " + format, self.address_string(), *args)
+
+        self.server = ThreadingHTTPServer((address, port), Handler)
+        self.server.daemon_threads = True
+        self.thread = threading.Thread(target=self.server.serve_forever, name='metrics', daemon=True)
+
+    def start(self) -> 'MetricsServer':
+        self.thread.start()
+        logger.info("Serving metrics on http://%s:%s/metrics", *self.server.server_address[:2])
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
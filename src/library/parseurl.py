@@ -35,10 +35,11 @@ class ParseURL:
         self.url = url_string
         return self.parse_url(url_string)
 
-    def parse_url(self, url_string: str, lowercase: bool = False) -> dict:
+    def parse_url(self, url_string: str, lowercase: bool = False, hashes: bool = False) -> dict:
         """ Parse a URL into 5 components:
         <scheme>://<netloc>/<path>?<query>#<fragment>
         https://docs.python.org/3/library/urllib.parse.html
+        host_hash / path_hash are only computed when `hashes` is set
         """
         url = {
             "isvalid": False,
@@ -92,9 +93,9 @@ class ParseURL:
                 if parsed.scheme == "http":
                     url["port"] = 80
 
-            #
-            url["host_hash"] = self.host_hash_identifier(url)
-            url["path_hash"] = self.path_hash_identifier(url)
+            if hashes:
+                url["host_hash"] = self.host_hash_identifier(url)
+                url["path_hash"] = self.path_hash_identifier(url)
 
             url["isvalid"] = True
 
@@ -0,0 +1,123 @@
+# -*- coding: utf-8 -*-
+import asyncio
+import logging
+import time
+import typing as t
+
+from library.scheduler import SPLIT
+
+logger = logging.getLogger(__name__)
+
+# tells a stage's workers that nothing more will be queued
+_DONE = object()
+
+
+# a class that runs windows through fetch -> enrich -> index stages connected by bounded queues,
+# so window N+1 is fetched while window N is enriched and window N-1 is indexed, and the
+# throughput is that of the slowest stage instead of the sum of all of them. Every stage
+# has its own number of concurrent workers; a queue holds at most `queue_size` windows,
+# so a slow stage holds back the ones before it instead of piling up windows in memory
+class AsyncWindowPipeline:
+    def __init__(self, fetch_concurrency: int = 4, enrich_concurrency: int = 1, index_concurrency: int = 2,
+                 queue_size: int = 2):
+        self.fetch_concurrency = max(1, fetch_concurrency)
+        self.enrich_concurrency = max(1, enrich_concurrency)
+        self.index_concurrency = max(1, index_concurrency)
+        self.queue_size = max(1, queue_size)
+
+    async def run(self, next_window: t.Callable[[], t.Any], fetch: t.Callable, enrich: t.Callable,
+                  index: t.Callable, on_error: t.Callable[[t.Any, Exception], None] | None = None) -> dict:
+        """ Run every window handed out by `next_window()` through the stages.
+
+        `fetch(window)`, `enrich(window, fetched)` and `index(window, enriched)` are
+        coroutines; a stage returning None is the end of that window, SPLIT the end of a
+        window the planner split, which is not counted as completed. Like WindowScheduler.run(), `next_window` returns None
+        when it has nothing to hand out right now and is asked again whenever a
+        window is done; the pipeline stops once nothing is in flight and nothing is left.
+        `on_error(window, err)` is called when a stage raised.
+        """
+        report = {'completed': 0, 'failed': 0, 'split': 0, 'elapsed': 0.0, 'windows_per_minute': 0.0}
+        started_at = time.monotonic()
+        enrich_queue = asyncio.Queue(self.queue_size)
+        index_queue = asyncio.Queue(self.queue_size)
+        changed = asyncio.Condition()
+        in_flight = 0
+
+        async def done(window, err: Exception | None = None, split: bool = False):
+            nonlocal in_flight
+            if split:
+                report['split'] += 1
+            elif err is None:
+                report['completed'] += 1
+            else:
+                report['failed'] += 1
+                logger.error("Window %s failed: %s", window, err, exc_info=err)
+                if on_error is not None:
+                    try:
+                        on_error(window, err)
+                    except Exception:
+                        logger.exception("Could not record the failure of window %s", window)
+            async with changed:
+                in_flight -= 1
+                changed.notify_all()
+
+        async def run_stage(window, stage: t.Callable, *args) -> t.Any:
+            try:
+                result = await stage(window, *args)
+            except Exception as err:
+                await done(window, err)
+                return None
+            if result is None or result == SPLIT:
+                await done(window, split=result == SPLIT)
+                return None
+            return result
+
+        async def fetcher():
+            nonlocal in_flight
+            while True:
+                async with changed:
+                    while True:
+                        window = next_window()
+                        if window is not None:
+                            in_flight += 1
+                            break
+                        if not in_flight:
+                            return
+                        await changed.wait()
+
+                fetched = await run_stage(window, fetch)
+                if fetched is not None:
+                    await enrich_queue.put((window, fetched))
+
+        async def enricher():
+            while True:
+                entry = await enrich_queue.get()
+                if entry is _DONE:
+                    return
+                enriched = await run_stage(entry[0], enrich, entry[1])
+                if enriched is not None:
+                    await index_queue.put((entry[0], enriched))
+
+        async def indexer():
+            while True:
+                entry = await index_queue.get()
+                if entry is _DONE:
+                    return
+                if await run_stage(entry[0], index, entry[1]) is not None:
+                    await done(entry[0])
+
+        enrichers = [asyncio.create_task(enricher()) for _ in range(self.enrich_concurrency)]
+        indexers = [asyncio.create_task(indexer()) for _ in range(self.index_concurrency)]
+        await asyncio.gather(*(fetcher() for _ in range(self.fetch_concurrency)))
+        # nothing is in flight any more, so the queues are empty
+        for _ in enrichers:
+            await enrich_queue.put(_DONE)
+        await asyncio.gather(*enrichers)
+        for _ in indexers:
+            await index_queue.put(_DONE)
+        await asyncio.gather(*indexers)
+
+        report['elapsed'] = time.monotonic() - started_at
+        if report['elapsed'] > 0:
+            report['windows_per_minute'] = report['completed'] * 60 / report['elapsed']
+        return report
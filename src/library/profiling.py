@@ -0,0 +1,113 @@
+# -*- coding: utf-8 -*-
+import contextlib
+import cProfile
+import io
+import logging
+import os
+import pstats
+import threading
+import tracemalloc
+import typing as t
+from datetime import datetime
+
+from library.windows import Window
+
+logger = logging.getLogger(__name__)
+
+FILE_TIMESTAMP = "%Y%m%dT%H%M%SZ"
+CPROFILE = 'cprofile'
+TRACEMALLOC = 'tracemalloc'
+
+
+# a class that profiles selected windows (every Nth one and / or the ones containing given
+# timestamps) with cProfile and / or tracemalloc, and dumps one report set per window:
+# <output_dir>/<zone>_<start>_<end>.pstats, .profile.txt and .allocations.txt
+class WindowProfiler:
+    def __init__(self, output_dir: str, every: int = 0, timestamps: t.Iterable[datetime] = (),
+                 modes: t.Iterable[str] = (CPROFILE,), top: int = 30):
+        self.output_dir = output_dir
+        self.every = max(0, every)
+        self.timestamps = sorted(timestamps)
+        self.modes = set(modes)
+        unknown = self.modes - {CPROFILE, TRACEMALLOC}
+        if unknown:
+            raise ValueError(f"Unknown profiling mode(s): {', '.join(sorted(unknown))}")
+        self.top = top
+        self.seen = 0
+        self.lock = threading.Lock()
+        # cProfile and tracemalloc are process-wide, so only one window is profiled at a time
+        self.busy = threading.Lock()
+
+    def selected(self, window: Window) -> bool:
+        with self.lock:
+            self.seen += 1
+            if self.every and self.seen % self.every == 0:
+                return True
+        return any(window.start <= timestamp < window.end for timestamp in self.timestamps)
+
+    def base_path(self, zone: str | None, window: Window) -> str:
+        return os.path.join(self.output_dir, '{}_{}_{}'.format(
+            zone or 'default', window.start.strftime(FILE_TIMESTAMP), window.end.strftime(FILE_TIMESTAMP)))
+
+    @contextlib.contextmanager
+    def profile(self, zone: str | None, window: Window):
+        """ Profile the calling thread while the block runs, the reports are written when it exits """
+        if not self.busy.acquire(blocking=False):
+            logger.warning("Not profiling %s, another window is being profiled", window.label)
+            yield
+            return
+
+        try:
+            profiler = cProfile.Profile() if CPROFILE in self.modes else None
+            if TRACEMALLOC in self.modes:
+                tracemalloc.start()
+                tracemalloc.reset_peak()
+                before = tracemalloc.take_snapshot()
+            if profiler is not None:
+                profiler.enable()
+            try:
+                yield
+            finally:
+                if profiler is not None:
+                    profiler.disable()
+                if TRACEMALLOC in self.modes:
+                    after = tracemalloc.take_snapshot()
+                    _, peak = tracemalloc.get_traced_memory()
+                    tracemalloc.stop()
+                # the window was processed (and maybe checkpointed) already, failing to write its
+                # reports must not fail it
+                base_path = self.base_path(zone, window)
+                try:
+                    os.makedirs(self.output_dir, exist_ok=True)
+                    if profiler is not None:
+                        self._write_profile(profiler, base_path)
+                    if TRACEMALLOC in self.modes:
+                        self._write_allocations(before, after, peak, base_path)
+                    logger.info("Profiled %s into %s.*", window.label, base_path)
+                except Exception:
+                    logger.exception("Could not write the profile of %s to %s", window.label, self.output_dir)
+        finally:
+            self.busy.release()
+
+    def _write_profile(self, profiler: cProfile.Profile, base_path: str):
+        profiler.dump_stats(base_path + '.pstats')
+        report = io.StringIO()
+        stats = pstats.Stats(profiler, stream=report)
+        stats.sort_stats(pstats.SortKey.CUMULATIVE).print_stats(self.top)
+        stats.sort_stats(pstats.SortKey.TIME).print_stats(self.top)
+        with open(base_path + '.profile.txt', 'w') as handle:
+            handle.write(report.getvalue())
+
+    def _write_allocations(self, before: tracemalloc.Snapshot, after: tracemalloc.Snapshot, peak: int,
+                           base_path: str):
+        # allocations made by the profiling machinery itself are not interesting
+        filters = [tracemalloc.Filter(False, tracemalloc.__file__)]
+        before, after = before.filter_traces(filters), after.filter_traces(filters)
+        with open(base_path + '.allocations.txt', 'w') as handle:
+            handle.write(f'peak traced memory: {peak / 1048576:.1f}MB\n')
+            handle.write(f'\ntop {self.top} allocation sites still alive at the end of the window:\n')
+            for stat in after.compare_to(before, 'lineno')[:self.top]:
+                handle.write(f'{stat}\n')
+            handle.write(f'\ntop {self.top} allocation sites by size at the end of the window:\n')
+            for stat in after.statistics('lineno')[:self.top]:
+                handle.write(f'{stat}\n')
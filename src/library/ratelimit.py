@@ -0,0 +1,69 @@
+# -*- coding: utf-8 -*-
+import asyncio
+import logging
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+
+# a thread-safe token bucket shared by every worker that talks to the same API,
+# so the combined request rate stays under the provider's quota
+class TokenBucket:
+    def __init__(self, rate: float, capacity: float = 1):
+        # rate is in tokens per second, capacity is the largest allowed burst
+        self.rate = rate
+        self.capacity = max(1.0, capacity)
+        self.tokens = self.capacity
+        self.updated_at = time.monotonic()
+        self.paused_until = 0.0
+        self.lock = threading.Lock()
+
+    def _refill(self, now: float):
+        elapsed = now - self.updated_at
+        if elapsed > 0:
+            self.tokens = min(self.capacity, self.tokens + elapsed * self.rate)
+            self.updated_at = now
+
+    def _take(self, tokens: float) -> float:
+        # consume `tokens` if they are available, otherwise return the seconds to wait for them
+        with self.lock:
+            now = time.monotonic()
+            if now < self.paused_until:
+                return self.paused_until - now
+            self._refill(now)
+            if self.tokens >= tokens:
+                self.tokens -= tokens
+                return 0.0
+            return (tokens - self.tokens) / self.rate
+
+    def acquire(self, tokens: float = 1) -> float:
+        """ Block until `tokens` are available and consume them, returns the seconds waited """
+        waited = 0.0
+        while True:
+            wait = self._take(tokens)
+            if not wait:
+                return waited
+            time.sleep(wait)
+            waited += wait
+
+    async def acquire_async(self, tokens: float = 1) -> float:
+        """ acquire() for coroutines: waits without blocking the event loop """
+        waited = 0.0
+        while True:
+            wait = self._take(tokens)
+            if not wait:
+                return waited
+            await asyncio.sleep(wait)
+            waited += wait
+
+    def pause(self, seconds: float):
+        """ Stop handing out tokens for `seconds`, e.g. after the API answered 429 """
+        with self.lock:
+            now = time.monotonic()
+            if now + seconds > self.paused_until:
+                logger.warning("Rate limited, pausing requests for %.1f seconds", seconds)
+                self.paused_until = now + seconds
+            # start from an empty bucket once the pause is over
+            self.tokens = 0
+            self.updated_at = self.paused_until
@@ -0,0 +1,126 @@
+# -*- coding: utf-8 -*-
+import typing as t
+from datetime import datetime, timedelta
+
+from library.bulkindexer import BulkIndexer
+from library.iohelper import document_id
+from library.windows import Window
+
+# what the dashboards group by: host and path, host, country, status, ASN and bot decision
+DEFAULT_DIMENSIONS = ('clientRequestHTTPHost,clientRequestPath;clientRequestHTTPHost;clientRequest_CountryName;'
+                      'edgeResponseStatus;clientRequest_geoip_asn,clientRequest_geoip_asn_org;botManagementDecision')
+# the weights summed into every rollup, fields of the raw documents, in the order of the sums
+MEASURES = ('count', 'sum_visits', 'sum_edgeResponseBytes')
+BUCKET_FORMAT = '%Y-%m-%dT%H:%M:%SZ'
+
+
+def parse_dimensions(value: str | None) -> t.Tuple[t.Tuple[str, ...], ...]:
+    """ Dimension sets written as comma-separated fields, sets separated by semicolons:
+    'clientRequestHTTPHost,clientRequestPath;edgeResponseStatus' """
+    dimension_sets = []
+    for dimension_set in (value or DEFAULT_DIMENSIONS).split(';'):
+        fields = tuple(field.strip() for field in dimension_set.split(',') if field.strip())
+        if fields and fields not in dimension_sets:
+            dimension_sets.append(fields)
+    return tuple(dimension_sets)
+
+
+def merge(sums: dict, other: dict):
+    """ Add the rollups of `other` (e.g. of a pool worker's batch) to `sums` """
+    for key, values in other.items():
+        current = sums.get(key)
+        if current is None:
+            sums[key] = list(values)
+        else:
+            for i, value in enumerate(values):
+                current[i] += value
+
+
+def bucket_start(value: datetime, interval_minutes: int) -> datetime:
+    """ Start of the bucket `value` falls in, buckets are aligned to midnight """
+    minutes = value.hour * 60 + value.minute
+    return value.replace(hour=0, minute=0, second=0, microsecond=0) + \
+        timedelta(minutes=minutes - minutes % interval_minutes)
+
+
+def covers(window: Window, start: datetime, interval_minutes: int) -> bool:
+    return window.start <= start and start + timedelta(minutes=interval_minutes) <= window.end
+
+
+# a class that sums the MEASURES of enriched documents per time bucket and per value of each
+# dimension set; `sums` maps (dimension set, bucket start, values) to the MEASURES sums. With the
+# `window` the documents come from, a bucket the window does not cover whole is summed per minute
+# instead, its "bucket start" is then the start of the minute (see actions())
+class RollupAggregator:
+    def __init__(self, dimension_sets: t.Sequence[t.Tuple[str, ...]], interval_minutes: int = 60,
+                 window: Window | None = None):
+        self.dimension_sets = tuple(dimension_sets)
+        self.interval_minutes = min(max(1, interval_minutes), 1440)
+        self.window = window
+        self.sums = {}
+        # datetime up to the minute -> start of its bucket
+        self.buckets = {}
+
+    def bucket(self, datetime_value: str) -> str:
+        minute = datetime_value[:16]
+        bucket = self.buckets.get(minute)
+        if bucket is None:
+            # buckets are aligned to midnight, e.g. 2025-10-01T12:34:56Z -> 2025-10-01T12:00:00Z
+            minutes = int(minute[11:13]) * 60 + int(minute[14:16])
+            minutes -= minutes % self.interval_minutes
+            bucket = f'{minute[:10]}T{minutes // 60:02d}:{minutes % 60:02d}:00Z'
+            if self.window is not None and not covers(self.window, datetime.strptime(bucket, BUCKET_FORMAT),
+                                                      self.interval_minutes):
+                bucket = minute + ':00Z'
+            self.buckets[minute] = bucket
+        return bucket
+
+    def add(self, document: dict):
+        bucket = self.bucket(document['datetime'])
+        hits = document.get('count') or 0
+        visits = document.get('sum_visits') or 0
+        response_bytes = document.get('sum_edgeResponseBytes') or 0
+        all_sums = self.sums
+        get = document.get
+        for dimensions in self.dimension_sets:
+            # a missing field is None, written as '' like in the raw documents
+            key = (dimensions, bucket, tuple(map(get, dimensions)))
+            sums = all_sums.get(key)
+            if sums is None:
+                all_sums[key] = [hits, visits, response_bytes]
+            else:
+                sums[0] += hits
+                sums[1] += visits
+                sums[2] += response_bytes
+
+
+def actions(sums: dict, index_prefix: str, zone: str | None, account: str | None, window: Window,
+            interval_minutes: int) -> t.List[t.Tuple[str, str]]:
+    """ The (action, source) bulk lines of a window's rollups, in daily `index_prefix` indices.
+
+    The ids only depend on the zone, the dimension values and the bucket: shipping a window again,
+    even planned with other boundaries, overwrites the rollups of the buckets it covers whole. A
+    bucket cut by a window boundary gets a document per minute the window has rows in, with `part`
+    naming the minute, so windows that cover the same minutes overwrite the same documents.
+    Window boundaries are whole minutes (see AdaptiveWindowPlanner).
+    """
+    # (bucket or minute) -> (start of the bucket, the minute for a part)
+    cells = {}
+    lines = []
+    for (dimensions, cell, values), totals in sums.items():
+        bucket_part = cells.get(cell)
+        if bucket_part is None:
+            cell_start = datetime.strptime(cell, BUCKET_FORMAT)
+            start = bucket_start(cell_start, interval_minutes)
+            part = '' if start == cell_start and covers(window, start, interval_minutes) else cell
+            bucket_part = cells[cell] = start.strftime(BUCKET_FORMAT), part
+        bucket, part = bucket_part
+        rollup = ','.join(dimensions)
+        document = {'datetime': bucket, 'interval_minutes': interval_minutes, 'rollup': rollup}
+        document.update(zip(dimensions, ('' if value is None else value for value in values)))
+        doc_id = document_id(zone, {**document, 'part': part} if part else document)
+        document.update(zip(MEASURES, totals))
+        document['accountTag'] = account
+        document['zoneTag'] = zone
+        lines.append(BulkIndexer.action(index_prefix + bucket[:10].replace('-', '.'), document, doc_id))
+    return lines
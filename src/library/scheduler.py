@@ -0,0 +1,57 @@
+# -*- coding: utf-8 -*-
+import logging
+import time
+import typing as t
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+logger = logging.getLogger(__name__)
+
+# returned by `process(window)` for a window that was split instead of shipped: its halves are
+# counted once they are done, so it is neither completed nor failed
+SPLIT = 'split'
+
+
+# a class that runs up to `concurrency` windows at the same time and
+# reports how many windows were completed per minute, split windows apart
+class WindowScheduler:
+    def __init__(self, concurrency: int = 4):
+        self.concurrency = max(1, concurrency)
+
+    def run(self, next_window: t.Callable[[], t.Any], process: t.Callable) -> dict:
+        """ Run `process(window)` for every window handed out by `next_window()`.
+
+        `next_window` returns None when it has nothing to hand out right now; the
+        scheduler asks again after each completed window (a planner may re-queue
+        work), and stops once nothing is running and nothing is left.
+        """
+        report = {'completed': 0, 'failed': 0, 'split': 0, 'elapsed': 0.0, 'windows_per_minute': 0.0}
+        started_at = time.monotonic()
+        running = {}
+
+        with ThreadPoolExecutor(max_workers=self.concurrency, thread_name_prefix='window') as executor:
+            while True:
+                # keep the pool full without materializing the whole date range
+                while len(running) < self.concurrency:
+                    window = next_window()
+                    if window is None:
+                        break
+                    running[executor.submit(process, window)] = window
+
+                if not running:
+                    break
+
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    window = running.pop(future)
+                    try:
+                        result = future.result()
+                    except Exception as err:
+                        report['failed'] += 1
+                        logger.exception("Window %s failed: %s", window, err)
+                    else:
+                        report['split' if result == SPLIT else 'completed'] += 1
+
+        report['elapsed'] = time.monotonic() - started_at
+        if report['elapsed'] > 0:
+            report['windows_per_minute'] = report['completed'] * 60 / report['elapsed']
+        return report
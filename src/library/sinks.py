@@ -0,0 +1,311 @@
+# -*- coding: utf-8 -*-
+import abc
+import asyncio
+import collections
+import importlib.util
+import json
+import logging
+import os
+import threading
+import typing as t
+import zlib
+
+from library import checkpoint
+from library.bulkindexer import AsyncBulkIndexer, BulkIndexer
+from library.spool import DiskSpool
+
+logger = logging.getLogger(__name__)
+
+FILE_PREFIX = 'part-'
+PARTIAL_SUFFIX = '.partial'
+COMPRESSIONS = ('gzip', 'zstd')
+
+
+# where the bulk (action, source) lines of enriched documents go. `write()` counts the
+# documents it took in summary[counter], a window whose documents were all taken is
+# checkpointed with `status` once sync() returned. With `overwrites`, a document written
+# twice is kept once (by its id), so the documents of a window can be written before the
+# planner knows whether the window is truncated and gets split
+class Sink(abc.ABC):
+    counter = 'indexed'
+    status = checkpoint.INDEXED
+    overwrites = True
+
+    @abc.abstractmethod
+    def write(self, actions: t.Iterable[t.Tuple[str, str]], summary: dict, zone: str | None = None):
+        """ Take (action, source) line pairs, counting them in summary[counter] """
+
+    async def write_async(self, actions: t.Iterable[t.Tuple[str, str]], summary: dict, zone: str | None = None):
+        """ write() for the asyncio engine, in a thread unless the sink has a native async path """
+        await asyncio.to_thread(self.write, actions, summary, zone)
+
+    def sync(self):
+        """ Make everything written so far durable """
+
+    def window_status(self, summary: dict) -> str:
+        return checkpoint.FAILED if summary['failed'] else self.status
+
+    async def open_async(self):
+        """ Set up what write_async() needs, on the event loop that will call it """
+
+    async def close_async(self):
+        pass
+
+    def close(self, timeout: float | None = None) -> bool:
+        """ Flush and release everything; False when something is left for the next start """
+        return True
+
+
+# documents are indexed right away through `_bulk` requests
+class OpenSearchSink(Sink):
+    def __init__(self, indexer: BulkIndexer, async_client_factory: t.Callable | None = None):
+        self.indexer = indexer
+        self.async_client_factory = async_client_factory
+        self.async_indexer = None
+
+    def write(self, actions: t.Iterable[t.Tuple[str, str]], summary: dict, zone: str | None = None):
+        self.indexer.index(actions, summary)
+
+    async def open_async(self):
+        self.async_indexer = AsyncBulkIndexer(
+            self.async_client_factory(), chunk_size=self.indexer.chunk_size,
+            max_chunk_bytes=self.indexer.max_chunk_bytes, max_retries=self.indexer.max_retries)
+
+    async def write_async(self, actions: t.Iterable[t.Tuple[str, str]], summary: dict, zone: str | None = None):
+        await self.async_indexer.index(actions, summary)
+
+    async def close_async(self):
+        if self.async_indexer is not None:
+            await self.async_indexer.client.close()
+            self.async_indexer = None
+
+
+# documents are appended to the disk spool, its drainer thread indexes them
+class SpoolSink(Sink):
+    counter = 'spooled'
+    status = checkpoint.SPOOLED
+
+    def __init__(self, spool: DiskSpool):
+        self.spool = spool
+
+    def write(self, actions: t.Iterable[t.Tuple[str, str]], summary: dict, zone: str | None = None):
+        summary['spooled'] += self.spool.append(actions)
+
+    def sync(self):
+        self.spool.sync()
+
+    def close(self, timeout: float | None = None) -> bool:
+        return self.spool.close(timeout)
+
+
+def zstd_available() -> bool:
+    # without importing it, the file sink does not pay for zstandard unless it is asked for
+    return importlib.util.find_spec('zstandard') is not None
+
+
+def _compressor(compression: str, level: int | None) -> t.Tuple[t.Any, int]:
+    # a streaming compressor and the flush mode that ends a block without ending the stream
+    if compression == 'zstd':
+        import zstandard
+
+        compressor = zstandard.ZstdCompressor(level=3 if level is None else level).compressobj()
+        return compressor, zstandard.COMPRESSOBJ_FLUSH_BLOCK
+    # wbits=31 writes a gzip header and trailer, the files open with gzip / zcat
+    return zlib.compressobj(6 if level is None else level, zlib.DEFLATED, 31), zlib.Z_SYNC_FLUSH
+
+
+def _decompressor(compression: str):
+    if compression == 'zstd':
+        import zstandard
+
+        return zstandard.ZstdDecompressor().decompressobj()
+    return zlib.decompressobj(31)
+
+
+# one open file of a zone and day, written through a streaming compressor into a large write buffer
+class _Part:
+    def __init__(self, path: str, compression: str, level: int | None, buffer_bytes: int):
+        self.path = path
+        self.file = open(path + PARTIAL_SUFFIX, 'xb', buffering=buffer_bytes)
+        self.compressor, self.block_flush = _compressor(compression, level)
+        self.lock = threading.Lock()
+        self.closed = False
+
+    def write(self, data: bytes):
+        self.file.write(self.compressor.compress(data))
+
+    def size(self) -> int:
+        # compressed bytes so far, the compressor may still hold a little
+        return self.file.tell()
+
+    def sync(self):
+        self.file.write(self.compressor.flush(self.block_flush))
+        self.file.flush()
+        os.fsync(self.file.fileno())
+
+    def close(self):
+        # the file only gets its final name once the compressed stream is complete
+        self.file.write(self.compressor.flush())
+        self.file.flush()
+        os.fsync(self.file.fileno())
+        self.file.close()
+        os.replace(self.path + PARTIAL_SUFFIX, self.path)
+        self.closed = True
+
+
+# documents are written as compressed NDJSON `_bulk` bodies (an action line, then the source line),
+# one directory per zone and day of the documents: <file_dir>/<zone>/<YYYY-MM-DD>/part-NNNNNN.ndjson.gz.
+# A part is rotated once it holds `rotate_bytes` compressed bytes; at most `max_open` parts are open,
+# the least recently written is completed first. Parts being written end in .partial, those left by a
+# crash are completed on the next start with everything synced before it
+class FileSink(Sink):
+    counter = 'written'
+    status = checkpoint.WRITTEN
+    overwrites = False
+
+    def __init__(self, file_dir: str, compression: str = 'gzip', level: int | None = None,
+                 rotate_bytes: int = 256 * 1024 * 1024, buffer_bytes: int = 1024 * 1024, max_open: int = 32):
+        if compression not in COMPRESSIONS:
+            raise ValueError(f"Unknown compression {compression!r}: use {' or '.join(COMPRESSIONS)}")
+        if compression == 'zstd' and not zstd_available():
+            logger.warning("zstandard is not installed, writing gzip files instead")
+            compression = 'gzip'
+        self.file_dir = file_dir
+        self.compression = compression
+        self.suffix = '.ndjson.zst' if compression == 'zstd' else '.ndjson.gz'
+        self.level = level
+        self.rotate_bytes = max(1, rotate_bytes)
+        self.buffer_bytes = max(4096, buffer_bytes)
+        self.max_open = max(1, max_open)
+        # (zone, day) -> open part, least recently written first
+        self.parts = collections.OrderedDict()
+        self.lock = threading.Lock()
+        # action line up to the document id -> day of its index
+        self.days = {}
+        os.makedirs(file_dir, exist_ok=True)
+        self.recover()
+
+    def _day(self, meta_line: str) -> str:
+        key = meta_line[:meta_line.find('"_id"')]
+        day = self.days.get(key)
+        if day is None:
+            # daily indices end in YYYY.MM.DD
+            day = json.loads(meta_line)['index']['_index'][-10:].replace('.', '-')
+            self.days[key] = day
+        return day
+
+    def _next_path(self, zone: str | None, day: str) -> str:
+        day_dir = os.path.join(self.file_dir, zone or 'default', day)
+        os.makedirs(day_dir, exist_ok=True)
+        numbers = [int(file_name[len(FILE_PREFIX):].split('.', 1)[0]) for file_name in os.listdir(day_dir)
+                   if file_name.startswith(FILE_PREFIX) and file_name[len(FILE_PREFIX):].split('.', 1)[0].isdigit()]
+        return os.path.join(day_dir, f'{FILE_PREFIX}{max(numbers, default=0) + 1:06d}{self.suffix}')
+
+    def _part(self, zone: str | None, day: str) -> _Part:
+        evicted = []
+        with self.lock:
+            part = self.parts.get((zone, day))
+            if part is None:
+                part = _Part(self._next_path(zone, day), self.compression, self.level, self.buffer_bytes)
+                self.parts[(zone, day)] = part
+                while len(self.parts) > self.max_open:
+                    evicted.append(self.parts.popitem(last=False)[1])
+            else:
+                self.parts.move_to_end((zone, day))
+        for old_part in evicted:
+            with old_part.lock:
+                old_part.close()
+        return part
+
+    def _flush(self, zone: str | None, day: str, records: t.List[str]):
+        data = ''.join(records).encode('utf-8')
+        while True:
+            part = self._part(zone, day)
+            with part.lock:
+                # rotated or evicted by another thread meanwhile
+                if part.closed:
+                    continue
+                part.write(data)
+                if part.size() < self.rotate_bytes:
+                    return
+                with self.lock:
+                    if self.parts.get((zone, day)) is part:
+                        del self.parts[(zone, day)]
+                part.close()
+                return
+
+    def write(self, actions: t.Iterable[t.Tuple[str, str]], summary: dict, zone: str | None = None):
+        # lines are gathered per day and handed to the compressor `buffer_bytes` at a time,
+        # the enrichment running in this loop never holds a part's lock
+        pending = {}
+        count = 0
+        for meta_line, source_line in actions:
+            day = self._day(meta_line)
+            records = pending.get(day)
+            if records is None:
+                records = pending[day] = [[], 0]
+            records[0].append(f'{meta_line}\n{source_line}\n')
+            records[1] += len(meta_line) + len(source_line) + 2
+            if records[1] >= self.buffer_bytes:
+                self._flush(zone, day, records[0])
+                pending[day] = [[], 0]
+            count += 1
+        for day, records in pending.items():
+            if records[0]:
+                self._flush(zone, day, records[0])
+        summary['written'] += count
+
+    def sync(self):
+        with self.lock:
+            parts = list(self.parts.values())
+        for part in parts:
+            with part.lock:
+                if not part.closed:
+                    part.sync()
+
+    def close(self, timeout: float | None = None) -> bool:
+        with self.lock:
+            parts = list(self.parts.values())
+            self.parts.clear()
+        for part in parts:
+            with part.lock:
+                if not part.closed:
+                    part.close()
+        return True
+
+    def recover(self):
+        """ Complete the parts a crashed run left behind with the documents they hold """
+        for directory, _, file_names in os.walk(self.file_dir):
+            for file_name in sorted(file_names):
+                if file_name.endswith(PARTIAL_SUFFIX):
+                    self._recover(os.path.join(directory, file_name))
+
+    def _recover(self, partial_path: str):
+        path = partial_path[:-len(PARTIAL_SUFFIX)]
+        compression = 'zstd' if path.endswith('.zst') else 'gzip'
+        if compression == 'zstd' and not zstd_available():
+            logger.warning("Cannot recover %s without zstandard, leaving it as is", partial_path)
+            return
+        decompressor = _decompressor(compression)
+        data = bytearray()
+        with open(partial_path, 'rb') as partial_file:
+            try:
+                while True:
+                    chunk = partial_file.read(self.buffer_bytes)
+                    if not chunk:
+                        break
+                    data += decompressor.decompress(chunk)
+            except Exception as err:
+                # the end of the file was never synced
+                logger.warning("%s is damaged after %s bytes: %s", partial_path, len(data), err)
+
+        # keep whole (action, source) line pairs only
+        lines = bytes(data).split(b'\n')[:-1]
+        lines = lines[:len(lines) // 2 * 2]
+        os.remove(partial_path)
+        if not lines:
+            return
+        part = _Part(path, compression, self.level, self.buffer_bytes)
+        part.write(b'\n'.join(lines) + b'\n')
+        part.close()
+        logger.info("Recovered %s documents into %s", len(lines) // 2, path)
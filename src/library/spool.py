@@ -0,0 +1,229 @@
+# -*- coding: utf-8 -*-
+import json
+import logging
+import os
+import threading
+import time
+import typing as t
+from datetime import datetime
+
+from library.bulkindexer import BulkIndexer, IndexingUnavailable
+
+logger = logging.getLogger(__name__)
+
+SEGMENT_SUFFIX = '.segment'
+# a segment that keeps failing for another reason than OpenSearch being unavailable is moved aside
+QUARANTINE_SUFFIX = '.quarantined'
+DEAD_LETTER_FILE = 'dead-letter.ndjson'
+
+
+def is_segment(file_name: str) -> bool:
+    """ Segments are named after their sequence number, e.g. 000000000042.segment """
+    return file_name.endswith(SEGMENT_SUFFIX) and file_name[:-len(SEGMENT_SUFFIX)].isdigit()
+
+
+# a class that keeps ready-to-index bulk lines in append-only segment files on disk and drains
+# them into OpenSearch from a background thread. Writers block while the spool holds `max_bytes`
+# (backpressure), segments are only deleted once OpenSearch took all their documents, so whatever
+# is left after a crash or an outage is sent again on the next start. Documents rejected for good
+# are appended to <spool_dir>/dead-letter.ndjson, once. A segment that fails `max_failures` times in a
+# row for another reason (e.g. a corrupt line) is renamed to <segment>.quarantined and skipped, so it
+# cannot block the spool. The drainer runs once start() was called.
+class DiskSpool:
+    def __init__(self, spool_dir: str, indexer: BulkIndexer, segment_bytes: int = 64 * 1024 * 1024,
+                 max_bytes: int = 1024 * 1024 * 1024, linger: float = 1.0, initial_backoff: float = 5,
+                 max_backoff: float = 300, max_failures: int = 5):
+        os.makedirs(spool_dir, exist_ok=True)
+        self.spool_dir = spool_dir
+        self.indexer = indexer
+        self.indexer.on_rejected = self._dead_letter
+        self.segment_bytes = max(1, segment_bytes)
+        self.max_bytes = max(self.segment_bytes, max_bytes)
+        self.linger = linger
+        self.initial_backoff = initial_backoff
+        self.max_backoff = max_backoff
+        self.max_failures = max(1, max_failures)
+
+        self.lock = threading.Lock()
+        self.changed = threading.Condition(self.lock)
+        self.dead_letter_lock = threading.Lock()
+        self.stopping = False
+
+        # segments left over by a previous run are drained first
+        self.segments = sorted(file_name for file_name in os.listdir(spool_dir) if is_segment(file_name))
+        self.size = sum(os.path.getsize(self._path(file_name)) for file_name in self.segments)
+        self.sequence = int(self.segments[-1][:-len(SEGMENT_SUFFIX)]) if self.segments else 0
+        if self.segments:
+            logger.info("Spool has %s segment(s), %.1fMB left from a previous run", len(self.segments),
+                        self.size / 1048576)
+        self.active = None
+        self.active_name = None
+        self.active_bytes = 0
+        self.active_since = 0.0
+        self.stats = {'spooled': 0, 'drained': 0, 'rejected': 0, 'unavailable': 0, 'quarantined': 0}
+        # (action, source) pairs of the segment being drained that are already in the dead-letter file:
+        # a segment sent again after an outage skips them instead of dead-lettering them twice
+        self.rejected = set()
+
+        self.thread = threading.Thread(target=self._drain_forever, name='spool-drainer', daemon=True)
+
+    def start(self) -> 'DiskSpool':
+        self.thread.start()
+        return self
+
+    def _path(self, file_name: str) -> str:
+        return os.path.join(self.spool_dir, file_name)
+
+    def _roll(self):
+        # close the active segment and hand it to the drainer, the lock is held
+        if self.active is None:
+            return
+        self.active.flush()
+        os.fsync(self.active.fileno())
+        self.active.close()
+        self.segments.append(self.active_name)
+        self.active = None
+        self.changed.notify_all()
+
+    def append(self, actions: t.Iterable[t.Tuple[str, str]]) -> int:
+        """ Append (action, source) line pairs, blocking while the spool is full; returns the count """
+        count = 0
+        for meta_line, source_line in actions:
+            record = f'{meta_line}\n{source_line}\n'.encode('utf-8')
+            with self.lock:
+                while self.size >= self.max_bytes and not self.stopping:
+                    self.changed.wait()
+                if self.active is None:
+                    self.sequence += 1
+                    self.active_name = f'{self.sequence:012d}{SEGMENT_SUFFIX}'
+                    self.active = open(self._path(self.active_name), 'ab')
+                    self.active_bytes = 0
+                    self.active_since = time.monotonic()
+                self.active.write(record)
+                self.active_bytes += len(record)
+                self.size += len(record)
+                self.stats['spooled'] += 1
+                if self.active_bytes >= self.segment_bytes:
+                    self._roll()
+            count += 1
+        return count
+
+    def sync(self):
+        """ Make everything appended so far durable """
+        with self.lock:
+            if self.active is not None:
+                self.active.flush()
+                os.fsync(self.active.fileno())
+
+    def pending(self) -> t.Dict[str, int]:
+        with self.lock:
+            return {'segments': len(self.segments) + (self.active is not None), 'bytes': self.size, **self.stats}
+
+    def _read(self, path: str) -> t.Iterator[t.Tuple[str, str]]:
+        with open(path, 'r', encoding='utf-8') as segment:
+            while True:
+                meta_line = segment.readline()
+                source_line = segment.readline()
+                if not source_line.endswith('\n'):
+                    if meta_line:
+                        # the process died while writing this pair, it was never acknowledged
+                        logger.warning("Skipping a truncated document at the end of %s", path)
+                    return
+                yield meta_line[:-1], source_line[:-1]
+
+    def _dead_letter(self, meta_line: str, source_line: str, error: dict):
+        record = json.dumps({
+            'dead_at': datetime.utcnow().strftime("%Y-%m-%dT%H:%M:%SZ"),
+            'error': error,
+            'action': json.loads(meta_line),
+            'source': source_line,
+        }, default=str)
+        with self.dead_letter_lock:
+            with open(self._path(DEAD_LETTER_FILE), 'a', encoding='utf-8') as dead_letter:
+                dead_letter.write(record + '\n')
+        self.rejected.add((meta_line, source_line))
+        with self.lock:
+            self.stats['rejected'] += 1
+
+    def _next_segment(self) -> str | None:
+        with self.lock:
+            while not self.segments:
+                if self.active is not None and time.monotonic() - self.active_since >= self.linger:
+                    self._roll()
+                    break
+                if self.stopping and self.active is None:
+                    return None
+                self.changed.wait(self.linger)
+            return self.segments[0]
+
+    def _remove(self, file_name: str, quarantine: bool = False):
+        # the drainer is done with a segment: deleted once drained, or moved aside
+        path = self._path(file_name)
+        size = os.path.getsize(path)
+        if quarantine:
+            os.replace(path, path + QUARANTINE_SUFFIX)
+        else:
+            os.remove(path)
+        self.rejected.clear()
+        with self.lock:
+            self.segments.remove(file_name)
+            self.size -= size
+            self.stats['quarantined'] += quarantine
+            self.changed.notify_all()
+
+    def _drain_forever(self):
+        attempt = 0
+        failures = 0
+        while True:
+            file_name = self._next_segment()
+            if file_name is None:
+                return
+            path = self._path(file_name)
+            try:
+                summary = self.indexer.index(pair for pair in self._read(path) if pair not in self.rejected)
+            except IndexingUnavailable as err:
+                delay = min(self.initial_backoff * (2 ** attempt), self.max_backoff)
+                logger.warning("OpenSearch unavailable (%s), spool holds %.1fMB, retrying in %.0fs",
+                               err, self.size / 1048576, delay)
+                with self.lock:
+                    self.stats['unavailable'] += 1
+                    if self.stopping:
+                        return
+                    self.changed.wait(delay)
+                attempt += 1
+                continue
+            except Exception:
+                failures += 1
+                if failures < self.max_failures:
+                    logger.exception("Could not drain spool segment %s, retrying", path)
+                    time.sleep(self.initial_backoff)
+                    continue
+                logger.exception("Could not drain spool segment %s after %s attempts, moving it to %s",
+                                 path, failures, path + QUARANTINE_SUFFIX)
+                failures = 0
+                self._remove(file_name, quarantine=True)
+                continue
+
+            attempt = 0
+            failures = 0
+            with self.lock:
+                self.stats['drained'] += summary['indexed']
+            self._remove(file_name)
+
+    def close(self, timeout: float | None = None) -> bool:
+        """ Hand the active segment to the drainer and wait up to `timeout` seconds for the spool to
+        empty; True when it did, otherwise the rest stays on disk for the next start """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self.lock:
+            self._roll()
+            while self.segments:
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    break
+                self.changed.wait(remaining)
+            drained = not self.segments
+            self.stopping = True
+            self.changed.notify_all()
+        if drained and self.thread.is_alive():
+            self.thread.join()
+        return drained
@@ -0,0 +1,169 @@
+# -*- coding: utf-8 -*-
+import codecs
+import json
+import typing as t
+
+_WHITESPACE = ' \t\n\r'
+
+
+# where the rows are: {"data": {"viewer": {"zones": [{"series": [...]}]}}}, int steps are array indices
+SERIES_PATH = ('data', 'viewer', 'zones', 0, 'series')
+
+
+# a class that decodes the rows of a GraphQL response's `series` array one by one
+# while the body is still being read, instead of loading the whole document;
+# after iteration `found`, `errors`, `rows` and `bytes_read` describe the response.
+# The array is only looked for at `path`: anywhere else (e.g. in an error's "path") the
+# response has no rows and the whole body, an error document, is parsed for its `errors`
+class SeriesStream:
+    def __init__(self, chunks: t.Iterable[bytes | str], path: t.Sequence[str | int] = SERIES_PATH,
+                 compact_at: int = 1024 * 1024):
+        self.chunks = iter(chunks)
+        self.path = tuple(path)
+        self.compact_at = compact_at
+        self.decoder = json.JSONDecoder()
+        self.utf8 = codecs.getincrementaldecoder('utf-8')()
+        self.found = False
+        self.errors = None
+        self.rows = 0
+        self.bytes_read = 0
+        self.buffer = ''
+
+    def _read(self) -> bool:
+        """ Append the next chunk to the buffer, False once the body is exhausted """
+        for chunk in self.chunks:
+            if isinstance(chunk, bytes):
+                self.bytes_read += len(chunk)
+                chunk = self.utf8.decode(chunk)
+            else:
+                self.bytes_read += len(chunk)
+            if chunk:
+                self.buffer += chunk
+                return True
+        return False
+
+    def _skip(self, position: int, characters: str) -> int:
+        # skip whitespace and `characters`, reading more when the buffer runs out
+        while True:
+            while position < len(self.buffer) and self.buffer[position] in characters:
+                position += 1
+            if position < len(self.buffer) or not self._read():
+                return position
+
+    def _expect(self, position: int, character: str) -> int:
+        position = self._skip(position, _WHITESPACE)
+        if position >= len(self.buffer) or self.buffer[position] != character:
+            raise json.JSONDecodeError(f"Expecting '{character}'", self.buffer, position)
+        return position + 1
+
+    def _enter(self, position: int, character: str) -> int | None:
+        # the position after `character` opening a value, None when the value is something else
+        position = self._skip(position, _WHITESPACE)
+        if position >= len(self.buffer) or self.buffer[position] != character:
+            return None
+        return position + 1
+
+    def _decode(self, position: int) -> t.Tuple[t.Any, int]:
+        # the value at `position`, reading until it is complete
+        while True:
+            try:
+                value, end = self.decoder.raw_decode(self.buffer, position)
+            except json.JSONDecodeError:
+                if not self._read():
+                    raise
+                continue
+            # a number at the end of the buffer may go on in the next chunk
+            if end < len(self.buffer) or not self._read():
+                return value, end
+
+    def _member(self, position: int, key: str) -> int | None:
+        # in the object opened before `position`, the position of the value of `key`,
+        # skipping the members before it; None when the object has no such member
+        while True:
+            position = self._skip(position, _WHITESPACE + ',')
+            if position >= len(self.buffer) or self.buffer[position] != '"':
+                return None
+            name, position = self._decode(position)
+            position = self._expect(position, ':')
+            if name == key:
+                return position
+            _, position = self._decode(self._skip(position, _WHITESPACE))
+
+    def _locate(self) -> int | None:
+        """ The position of the first row of the series array, None when the response has none """
+        position = self._enter(0, '{')
+        for i, step in enumerate(self.path):
+            if position is None:
+                return None
+            if isinstance(step, int):
+                for skipped in range(step + 1):
+                    position = self._skip(position, _WHITESPACE + ',')
+                    if position >= len(self.buffer) or self.buffer[position] == ']':
+                        return None
+                    if skipped < step:
+                        _, position = self._decode(position)
+            else:
+                position = self._member(position, step)
+                if position is None:
+                    return None
+            # open the value: an array for an index or the series, an object for a key
+            following = self.path[i + 1] if i + 1 < len(self.path) else 0
+            position = self._enter(position, '[' if isinstance(following, int) else '{')
+        return position
+
+    def __iter__(self) -> t.Iterator[dict]:
+        position = self._locate()
+        if position is None:
+            # an error document: read the rest of it and parse it whole
+            while self._read():
+                pass
+            self._finish(self.buffer)
+            return
+        self.found = True
+        # everything before the array is kept for error reporting
+        head = self.buffer[:position - 1]
+
+        while True:
+            position = self._skip(position, _WHITESPACE + ',')
+            if position >= len(self.buffer):
+                raise json.JSONDecodeError("Unterminated series array", self.buffer, position)
+            if self.buffer[position] == ']':
+                position += 1
+                break
+
+            try:
+                row, end = self.decoder.raw_decode(self.buffer, position)
+            except json.JSONDecodeError:
+                # the row is not complete yet
+                if not self._read():
+                    raise
+                continue
+
+            self.rows += 1
+            yield row
+            position = end
+            if position > self.compact_at:
+                # release the rows that were already handed out
+                self.buffer = self.buffer[position:]
+                position = 0
+
+        tail = self.buffer[position:]
+        self.buffer = ''
+        while self._read():
+            tail += self.buffer
+            self.buffer = ''
+        self._finish(head + '[]' + tail)
+
+    def _finish(self, document: str):
+        # the rest of the document is small: parse it for the GraphQL `errors` member
+        self.buffer = ''
+        try:
+            response = json.loads(document)
+        except json.JSONDecodeError:
+            if not self.found:
+                raise
+            return
+        if isinstance(response, dict):
+            self.errors = response.get('errors')
+            if response.get('data') is None:
+                self.found = False
@@ -0,0 +1,102 @@
+# -*- coding: utf-8 -*-
+import logging
+import threading
+import typing as t
+from datetime import datetime, timedelta
+
+logger = logging.getLogger(__name__)
+
+
+class Window(t.NamedTuple):
+    start: datetime
+    end: datetime
+
+    @property
+    def label(self) -> str:
+        return "{} -> {}".format(format_timestamp(self.start), format_timestamp(self.end))
+
+
+def format_timestamp(value: datetime) -> str:
+    return value.strftime("%Y-%m-%dT%H:%M:%SZ")
+
+
+def iter_windows(start: datetime, end: datetime, span: timedelta) -> t.Iterator[Window]:
+    """ Split [start, end] into consecutive windows of `span`, the last one clipped to `end` """
+    while start < end:
+        window_end = min(start + span, end)
+        yield Window(start, window_end)
+        start = window_end
+
+
+# a class that hands out windows over [start, end] and adapts their size to the
+# row counts the API returns: windows that hit the row limit are bisected and
+# re-queued, windows that come back mostly empty make the next ones wider
+class AdaptiveWindowPlanner:
+    def __init__(self, start: datetime, end: datetime, span: timedelta, row_limit: int,
+                 min_span: timedelta = timedelta(minutes=1), max_span: timedelta = timedelta(hours=24),
+                 widen_ratio: float = 0.25, completed: t.List[Window] | None = None):
+        self.start = start
+        self.cursor = start
+        self.end = end
+        self.row_limit = row_limit
+        self.min_span = min_span
+        self.max_span = max(max_span, min_span)
+        self.span = min(max(span, self.min_span), self.max_span)
+        self.widen_ratio = widen_ratio
+        self.splits = []
+        # sorted, non-overlapping ranges that were already shipped by an earlier run
+        self.completed = list(completed or [])
+        self.lock = threading.Lock()
+
+    def next_window(self) -> Window | None:
+        """ Next window to fetch, split halves first, None when nothing is left to hand out """
+        with self.lock:
+            if self.splits:
+                return self.splits.pop()
+            window_end = self.end
+            while self.completed:
+                done = self.completed[0]
+                if done.end <= self.cursor:
+                    self.completed.pop(0)
+                elif done.start <= self.cursor:
+                    # skip over a range a previous run already shipped
+                    self.cursor = done.end
+                    self.completed.pop(0)
+                else:
+                    window_end = min(window_end, done.start)
+                    break
+            if self.cursor >= self.end:
+                return None
+            window = Window(self.cursor, min(self.cursor + self.span, window_end))
+            self.cursor = window.end
+            return window
+
+    def record(self, window: Window, rows: int) -> bool:
+        """ Feed back the row count of a fetched window, returns False when it was split and must be discarded """
+        span = window.end - window.start
+        with self.lock:
+            if rows >= self.row_limit:
+                half = timedelta(seconds=int(span.total_seconds() // 2))
+                if half >= timedelta(minutes=1):
+                    # halves stay on whole minutes, a minute of rows is never shared by two windows
+                    half -= timedelta(seconds=half.seconds % 60)
+                if half < self.min_span:
+                    logger.warning("[planner] %s hit the %s row limit at the minimum window size, "
+                                   "rows may be truncated", window.label, self.row_limit)
+                    return True
+
+                middle = window.start + half
+                # the stack is LIFO, push the later half first so the earlier half is fetched next
+                self.splits.append(Window(middle, window.end))
+                self.splits.append(Window(window.start, middle))
+                if self.span > half:
+                    self.span = half
+                logger.info("[planner] split %s (%s rows >= limit %s) into two %s windows, next span %s",
+                            window.label, rows, self.row_limit, half, self.span)
+                return False
+
+            if rows < self.row_limit * self.widen_ratio and span >= self.span and self.span < self.max_span:
+                self.span = min(self.span * 2, self.max_span)
+                logger.info("[planner] merge: %s returned %s rows (< %d%% of limit), next span %s",
+                            window.label, rows, self.widen_ratio * 100, self.span)
+            return True
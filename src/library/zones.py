@@ -0,0 +1,56 @@
+# -*- coding: utf-8 -*-
+import json
+import os
+import typing as t
+
+
+# a Cloudflare zone to ship, with the account it belongs to and its own plan / index settings
+class ZoneConfig(t.NamedTuple):
+    zone: str
+    account: str | None = None
+    name: str | None = None
+    include_premium_fields: bool = False
+    index_prefix: str = 'cloudflare-requests-'
+    api_token: str | None = None
+
+    @property
+    def label(self) -> str:
+        return self.name or self.zone
+
+
+def _flag(value) -> bool:
+    if isinstance(value, str):
+        return value.lower() in ("true", "1", "yes")
+    return bool(value)
+
+
+def load_zones(value: str | None, default: ZoneConfig) -> t.List[ZoneConfig]:
+    """ Parse a zone list: a JSON array, or the path of a JSON file holding one, of objects with
+    a `zone` and optionally `account`, `name`, `include_premium_fields`, `index_prefix` and
+    `api_token`; missing keys are taken from `default`. An empty value is just `default` """
+    if not value or not value.strip():
+        return [default] if default.zone else []
+
+    value = value.strip()
+    if not value.startswith('['):
+        with open(os.path.expanduser(value)) as handle:
+            value = handle.read()
+    entries = json.loads(value)
+    if not isinstance(entries, list):
+        raise ValueError("The zone list must be a JSON array of objects")
+
+    zones = []
+    for entry in entries:
+        if not isinstance(entry, dict) or not entry.get('zone'):
+            raise ValueError(f"Every zone needs a `zone` tag: {entry!r}")
+        unknown = set(entry) - set(ZoneConfig._fields)
+        if unknown:
+            raise ValueError(f"Unknown zone setting(s) {', '.join(sorted(unknown))} in {entry!r}")
+        zone = default._replace(**{'name': None, **entry})
+        zones.append(zone._replace(include_premium_fields=_flag(zone.include_premium_fields)))
+
+    labels = [zone.label for zone in zones]
+    duplicates = sorted({label for label in labels if labels.count(label) > 1})
+    if duplicates:
+        raise ValueError(f"Duplicate zone(s) in the zone list: {', '.join(duplicates)}")
+    return zones
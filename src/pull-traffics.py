@@ -1,27 +1,46 @@
 #!/usr/bin/env python3
 # -*- coding: utf-8 -*-
+import asyncio
+import itertools
+import multiprocessing
 import os
-import time
 import random
+import signal
+import threading
+import time
 import json
+import typing as t
+from concurrent.futures import ProcessPoolExecutor
 from datetime import datetime, timedelta
 import requests
-from library.geoinfo import GeoInfo
-from library.iohelper import merge_two_dicts, parse_client_referer_url_string, parse_client_request_query_string, \
-    parse_browser_agent, normalize_country
-from opensearchpy import OpenSearch
+from library import checkpoint, enrichment, httpclient, rollup
+from library.archive import ResponseArchive
+from library.bulkindexer import BulkIndexer
+from library.graphqlquery import GraphQLQuery, load_filters, parse_dimensions
+from library.indexlifecycle import IndexLifecycle
+from library.lazy import LazyObject
+from library.memory import peak_rss_bytes, rss_bytes
+from library.metrics import MetricsRegistry, MetricsServer
+from library.pipeline import AsyncWindowPipeline
+from library.profiling import WindowProfiler
+from library.ratelimit import TokenBucket
+from library.scheduler import SPLIT, WindowScheduler
+from library.sinks import FileSink, OpenSearchSink, SpoolSink
+from library.spool import DiskSpool
+from library.streamjson import SeriesStream
+from library.windows import AdaptiveWindowPlanner, Window, format_timestamp
+from library.zones import ZoneConfig, load_zones
 from pprint import pprint
-# import logging
+import logging
 
-# # Set up logging
-# logging.basicConfig(level=logging.DEBUG)
+# Set up logging
+logging.basicConfig(level=os.getenv("LOG_LEVEL", "INFO").upper(),
+                    format="%(asctime)s %(levelname)s %(name)s: %(message)s")
 
 # the endpoint of GraphQL API
 url = 'https://api.cloudflare.com/client/v4/graphql/'
 
 # Customize these variables via Docker env (pass with --env-file or -e)
-# Must include trailing slash. If left blank, csv will be created in the current directory.
-file_dir = ''
 api_token = os.getenv("CLOUDFLARE_API_KEY")
 CLOUDFLARE_ACCOUNT = os.getenv("CLOUDFLARE_ACCOUNT")  # accountTag
 CLOUDFLARE_ZONE = os.getenv("CLOUDFLARE_ZONE")        # zoneTag
@@ -37,25 +56,256 @@ OPENSEARCH_HOSTNAME = os.getenv("OPENSEARCH_HOSTNAME", "opensearch-node")
 OPENSEARCH_PORT = int(os.getenv("OPENSEARCH_PORT", "9200"))
 OPENSEARCH_INDEX_PREFIX = os.getenv("OPENSEARCH_INDEX", "cloudflare-requests-")
 OPENSEARCH_HOST = f"https://{OPENSEARCH_HOSTNAME}:9200"
+# Bulk indexing: max docs and max bytes per `_bulk` request, retries for throttled docs
+OPENSEARCH_BULK_CHUNK_SIZE = int(os.getenv("OPENSEARCH_BULK_CHUNK_SIZE", "500"))
+OPENSEARCH_BULK_MAX_BYTES = int(os.getenv("OPENSEARCH_BULK_MAX_BYTES", str(10 * 1024 * 1024)))
+OPENSEARCH_BULK_MAX_RETRIES = int(os.getenv("OPENSEARCH_BULK_MAX_RETRIES", "3"))
+# Index template with explicit mappings for the daily indices, installed at startup
+OPENSEARCH_INSTALL_TEMPLATE = os.getenv("OPENSEARCH_INSTALL_TEMPLATE", "true").lower() in ("true", "1", "yes")
+OPENSEARCH_TEMPLATE_NAME = os.getenv("OPENSEARCH_TEMPLATE_NAME", "cloudflare-requests")
+OPENSEARCH_SHARDS = int(os.getenv("OPENSEARCH_SHARDS", "1"))
+OPENSEARCH_REPLICAS = int(os.getenv("OPENSEARCH_REPLICAS", "1"))
+OPENSEARCH_REFRESH_INTERVAL = os.getenv("OPENSEARCH_REFRESH_INTERVAL", "1s")
+# Backfill / replay: write with refresh_interval=-1 and no replicas, restore the settings once
+# a day is complete and force-merge it down to OPENSEARCH_FORCE_MERGE_SEGMENTS (0 = no merge)
+OPENSEARCH_BACKFILL_SETTINGS = os.getenv("OPENSEARCH_BACKFILL_SETTINGS", "false").lower() in ("true", "1", "yes")
+OPENSEARCH_FORCE_MERGE_SEGMENTS = int(os.getenv("OPENSEARCH_FORCE_MERGE_SEGMENTS", "0"))
 
 # Cloudflare plan configuration
 # Set to "true" or "1" if you have Bot Management or Enterprise plan
 INCLUDE_PREMIUM_FIELDS = True if os.getenv("INCLUDE_PREMIUM_FIELDS", "false").lower() in ("true", "1", "yes") else False
+# Filters pushed down to Cloudflare with every query: a JSON array (or the path of a JSON file) of
+# ZoneHttpRequestsAdaptiveGroupsFilter objects, empty = the built-in noise filters
+CLOUDFLARE_FILTERS = load_filters(os.getenv("CLOUDFLARE_FILTERS"))
+# Comma-separated dimensions to ask for, empty = every dimension of the zone's plan
+CLOUDFLARE_DIMENSIONS = parse_dimensions(os.getenv("CLOUDFLARE_DIMENSIONS"))
+
+# One process can ship many zones: CLOUDFLARE_ZONES is a JSON array (or the path of a JSON file) of
+# {"zone", "account", "name", "include_premium_fields", "index_prefix", "api_token"} objects, unset
+# keys default to the single-zone settings above. The zones share the window workers, the rate
+# budget, the enrichment caches and the OpenSearch connection pool.
+DEFAULT_ZONE = ZoneConfig(zone=CLOUDFLARE_ZONE, account=CLOUDFLARE_ACCOUNT,
+                          include_premium_fields=INCLUDE_PREMIUM_FIELDS,
+                          index_prefix=OPENSEARCH_INDEX_PREFIX, api_token=api_token)
+CLOUDFLARE_ZONES = load_zones(os.getenv("CLOUDFLARE_ZONES"), DEFAULT_ZONE)
+
+# Cloudflare GraphQL rate limits: at most CLOUDFLARE_RATE_LIMIT requests per
+# CLOUDFLARE_RATE_PERIOD seconds, shared by CLOUDFLARE_CONCURRENCY concurrent windows
+CLOUDFLARE_CONCURRENCY = int(os.getenv("CLOUDFLARE_CONCURRENCY", "4"))
+CLOUDFLARE_RATE_LIMIT = int(os.getenv("CLOUDFLARE_RATE_LIMIT", "300"))
+CLOUDFLARE_RATE_PERIOD = int(os.getenv("CLOUDFLARE_RATE_PERIOD", "300"))
+CLOUDFLARE_RATE_BURST = int(os.getenv("CLOUDFLARE_RATE_BURST", "5"))
+# Retries per window for throttled (429), 5xx, failed connections and bodies cut while they are read,
+# all counted together, with exponential backoff
+CLOUDFLARE_MAX_RETRIES = int(os.getenv("CLOUDFLARE_MAX_RETRIES", "5"))
+CLOUDFLARE_BACKOFF_SECONDS = float(os.getenv("CLOUDFLARE_BACKOFF_SECONDS", "5"))
+CLOUDFLARE_MAX_BACKOFF_SECONDS = float(os.getenv("CLOUDFLARE_MAX_BACKOFF_SECONDS", "120"))
+# Seconds to establish a connection and to wait for the next bytes of a response
+CLOUDFLARE_CONNECT_TIMEOUT = float(os.getenv("CLOUDFLARE_CONNECT_TIMEOUT", "10"))
+CLOUDFLARE_READ_TIMEOUT = float(os.getenv("CLOUDFLARE_READ_TIMEOUT", "120"))
+CLOUDFLARE_VERIFY_TLS = os.getenv("CLOUDFLARE_VERIFY_TLS", "true").lower() in ("true", "1", "yes")
+
+# Max rows per GraphQL query; windows that return this many rows are split in half
+# and windows that come back small are widened, within the min/max window size
+CLOUDFLARE_ROW_LIMIT = int(os.getenv("CLOUDFLARE_ROW_LIMIT", "10000"))
+LOG_WINDOW_MINUTES = int(os.getenv("LOG_WINDOW_MINUTES", "360"))
+LOG_WINDOW_MIN_MINUTES = int(os.getenv("LOG_WINDOW_MIN_MINUTES", "1"))
+LOG_WINDOW_MAX_MINUTES = int(os.getenv("LOG_WINDOW_MAX_MINUTES", "1440"))
+
+# GeoLite2 databases directory (default: src/db) and the number of networks kept
+# in each of the city / ASN lookup caches
+GEOIP_DB_DIR = os.getenv("GEOIP_DB_DIR") or None
+GEOIP_CACHE_SIZE = int(os.getenv("GEOIP_CACHE_SIZE", "65536"))
+# Number of distinct user agent strings kept parsed in memory (LRU)
+UA_CACHE_SIZE = int(os.getenv("UA_CACHE_SIZE", "4096"))
+
+# Enrichment worker processes (0 enriches in the main process) and the most rows per worker task,
+# a chunk of rows is spread over every worker. Each worker opens its own GeoLite2 readers and keeps
+# its own parser caches.
+ENRICH_WORKERS = int(os.getenv("ENRICH_WORKERS", "0"))
+ENRICH_BATCH_SIZE = int(os.getenv("ENRICH_BATCH_SIZE", "500"))
+
+# Responses are decoded while they are read: STREAM_READ_BYTES per network read,
+# STREAM_CHUNK_ROWS rows enriched and indexed at a time
+STREAM_READ_BYTES = int(os.getenv("STREAM_READ_BYTES", "65536"))
+STREAM_CHUNK_ROWS = int(os.getenv("STREAM_CHUNK_ROWS", "1000"))
+
+# Run mode: "backfill" ships LOG_DATE_START..LOG_DATE_END and exits, "follow" keeps
+# polling for new traffic LOG_FOLLOW_LAG_MINUTES behind now from a persisted high-water mark,
+# "replay" re-ships the archived responses of LOG_DATE_START..LOG_DATE_END without API calls
+LOG_MODE = os.getenv("LOG_MODE", "backfill").lower()
+LOG_FOLLOW_LAG_MINUTES = int(os.getenv("LOG_FOLLOW_LAG_MINUTES", "5"))
+LOG_FOLLOW_INTERVAL_SECONDS = int(os.getenv("LOG_FOLLOW_INTERVAL_SECONDS", "60"))
+LOG_FOLLOW_LOOKBACK_MINUTES = int(os.getenv("LOG_FOLLOW_LOOKBACK_MINUTES", "60"))
+# Polls in a row a failed window may hold the follow watermark back before it is checkpointed as
+# skipped (left for a backfill) and the watermark moves past it (0 = retry it forever)
+LOG_FOLLOW_MAX_ATTEMPTS = int(os.getenv("LOG_FOLLOW_MAX_ATTEMPTS", "5"))
+
+# Engine running the windows of backfill and follow: "threads" runs CLOUDFLARE_CONCURRENCY windows
+# start to end in parallel, "asyncio" pipelines them (aiohttp fetches, enrichment, AsyncOpenSearch
+# writes) so a window is fetched while the previous ones are enriched and indexed. Up to
+# PIPELINE_QUEUE_SIZE windows wait between two stages, PIPELINE_INDEX_CONCURRENCY are indexed at once
+LOG_ENGINE = os.getenv("LOG_ENGINE", "threads").lower()
+PIPELINE_QUEUE_SIZE = int(os.getenv("PIPELINE_QUEUE_SIZE", "2"))
+PIPELINE_INDEX_CONCURRENCY = int(os.getenv("PIPELINE_INDEX_CONCURRENCY", "2"))
+
+# When set, every fetched response is kept gzip-compressed per zone and window under this directory
+LOG_ARCHIVE_DIR = os.getenv("LOG_ARCHIVE_DIR", "")
+
+# Prometheus metrics (per-stage latency, rows, bytes, cache hit rates, errors and retries) are
+# served on http://METRICS_ADDRESS:METRICS_PORT/metrics when METRICS_PORT is set (0 = disabled)
+METRICS_PORT = int(os.getenv("METRICS_PORT", "0"))
+METRICS_ADDRESS = os.getenv("METRICS_ADDRESS", "0.0.0.0")
+
+# Profile every PROFILE_EVERY-th window and / or the windows containing the PROFILE_WINDOWS
+# timestamps (comma-separated, e.g. 2025-10-01T06:30:00Z) with PROFILE_MODE (cprofile, tracemalloc
+# or both, comma-separated); reports are written to PROFILE_DIR, named after the window
+PROFILE_EVERY = int(os.getenv("PROFILE_EVERY", "0"))
+PROFILE_WINDOWS = [datetime.strptime(value.strip(), "%Y-%m-%dT%H:%M:%SZ")
+                   for value in os.getenv("PROFILE_WINDOWS", "").split(',') if value.strip()]
+PROFILE_MODE = [value.strip() for value in os.getenv("PROFILE_MODE", "cprofile").lower().split(',') if value.strip()]
+PROFILE_DIR = os.getenv("PROFILE_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), 'profiles'))
+PROFILE_TOP = int(os.getenv("PROFILE_TOP", "30"))
 
-es = OpenSearch(
-    hosts=[{"host": OPENSEARCH_HOSTNAME,
-            "port": OPENSEARCH_PORT, "scheme": "https"}],
-    http_auth=(OPENSEARCH_USERNAME, OPENSEARCH_PASSWORD),
-    # turn on SSL
-    use_ssl=True,
-    # no verify SSL certificates
-    verify_certs=False,
-    # don't show warnings about ssl certs verification
-    ssl_show_warn=False,
-    http_compress=True,  # enables gzip compression for request bodies
-)
+# When set, every window's documents are also rolled up in memory: hits (count), visits and bytes per
+# ROLLUP_INTERVAL_MINUTES bucket and per value of each dimension set, written as compact documents to the
+# daily ROLLUP_INDEX_PREFIX indices (empty = disabled). A set is comma-separated fields, sets are separated
+# by semicolons; the prefix must not match the index pattern of a zone (e.g. cloudflare-requests-*)
+ROLLUP_INDEX_PREFIX = os.getenv("ROLLUP_INDEX_PREFIX", "")
+ROLLUP_INTERVAL_MINUTES = int(os.getenv("ROLLUP_INTERVAL_MINUTES", "60"))
+ROLLUP_DIMENSIONS = rollup.parse_dimensions(os.getenv("ROLLUP_DIMENSIONS")) if ROLLUP_INDEX_PREFIX else ()
 
-geoip_instance = GeoInfo()
+# Where documents go: "opensearch", or "file" to write them as compressed NDJSON `_bulk` bodies
+# under FILE_SINK_DIR/<zone>/<YYYY-MM-DD>/ without any cluster (windows are checkpointed as written)
+LOG_SINK = os.getenv("LOG_SINK", "opensearch").lower()
+FILE_SINK_DIR = os.getenv("FILE_SINK_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), 'output'))
+# gzip, or zstd when the zstandard package is installed
+FILE_SINK_COMPRESSION = os.getenv("FILE_SINK_COMPRESSION", "gzip").lower()
+# Compressed bytes after which a file is completed and the next one of its zone and day started
+FILE_SINK_ROTATE_BYTES = int(os.getenv("FILE_SINK_ROTATE_BYTES", str(256 * 1024 * 1024)))
+# Uncompressed bytes of a zone and day gathered before they are compressed and written
+FILE_SINK_BUFFER_BYTES = int(os.getenv("FILE_SINK_BUFFER_BYTES", str(1024 * 1024)))
+
+# When set, documents are written to a disk spool under SPOOL_DIR and indexed from there, so an
+# OpenSearch outage never loses a fetched window: windows block once the spool holds SPOOL_MAX_BYTES,
+# leftovers are indexed on the next start and rejected documents go to <SPOOL_DIR>/dead-letter.ndjson
+SPOOL_DIR = os.getenv("SPOOL_DIR", "")
+SPOOL_SEGMENT_BYTES = int(os.getenv("SPOOL_SEGMENT_BYTES", str(64 * 1024 * 1024)))
+SPOOL_MAX_BYTES = int(os.getenv("SPOOL_MAX_BYTES", str(1024 * 1024 * 1024)))
+# Seconds to wait for the spool to drain before exiting (the rest is indexed on the next start)
+SPOOL_DRAIN_TIMEOUT = int(os.getenv("SPOOL_DRAIN_TIMEOUT", "600"))
+
+# Directory for the window checkpoint database used to resume interrupted backfills
+LOG_STATE_DIR = os.getenv("LOG_STATE_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), 'state'))
+
+
+def new_opensearch_client():
+    from opensearchpy import OpenSearch
+
+    return OpenSearch(
+        hosts=[{"host": OPENSEARCH_HOSTNAME,
+                "port": OPENSEARCH_PORT, "scheme": "https"}],
+        http_auth=(OPENSEARCH_USERNAME, OPENSEARCH_PASSWORD),
+        # turn on SSL
+        use_ssl=True,
+        # no verify SSL certificates
+        verify_certs=False,
+        # don't show warnings about ssl certs verification
+        ssl_show_warn=False,
+        http_compress=True,  # enables gzip compression for request bodies
+    )
+
+
+# built on first use, so importing the shipper (a dry run, a benchmark) does not import opensearch-py
+es = LazyObject(new_opensearch_client)
+
+
+def new_async_opensearch_client():
+    # the client of the asyncio engine, opened and closed by every run_pipeline()
+    from opensearchpy import AsyncOpenSearch
+
+    return AsyncOpenSearch(
+        hosts=[{"host": OPENSEARCH_HOSTNAME,
+                "port": OPENSEARCH_PORT, "scheme": "https"}],
+        http_auth=(OPENSEARCH_USERNAME, OPENSEARCH_PASSWORD),
+        use_ssl=True,
+        verify_certs=False,
+        ssl_show_warn=False,
+        http_compress=True,
+    )
+
+bulk_indexer = BulkIndexer(es, chunk_size=OPENSEARCH_BULK_CHUNK_SIZE,
+                           max_chunk_bytes=OPENSEARCH_BULK_MAX_BYTES,
+                           max_retries=OPENSEARCH_BULK_MAX_RETRIES)
+
+graphql_query = GraphQLQuery(CLOUDFLARE_FILTERS, CLOUDFLARE_DIMENSIONS)
+
+response_archive = ResponseArchive(LOG_ARCHIVE_DIR) if LOG_ARCHIVE_DIR else None
+
+# set up by main(), not on import (a dry run, a benchmark, --help): the spool and the file sink
+# touch the disk, the file sink even walks its whole tree to recover what a crash left behind
+spool = None
+sink = None
+
+index_lifecycle = IndexLifecycle(
+    es, OPENSEARCH_TEMPLATE_NAME, [zone.index_prefix for zone in CLOUDFLARE_ZONES or [DEFAULT_ZONE]] +
+    ([ROLLUP_INDEX_PREFIX] if ROLLUP_INDEX_PREFIX else []),
+    shards=OPENSEARCH_SHARDS, replicas=OPENSEARCH_REPLICAS, refresh_interval=OPENSEARCH_REFRESH_INTERVAL,
+    bulk_settings=OPENSEARCH_BACKFILL_SETTINGS and LOG_SINK != 'file' and LOG_MODE in ('backfill', 'replay'),
+    force_merge_segments=OPENSEARCH_FORCE_MERGE_SEGMENTS)
+
+window_profiler = None
+if PROFILE_EVERY or PROFILE_WINDOWS:
+    window_profiler = WindowProfiler(PROFILE_DIR, every=PROFILE_EVERY, timestamps=PROFILE_WINDOWS,
+                                     modes=PROFILE_MODE, top=PROFILE_TOP)
+
+enrichment.init_worker(GEOIP_DB_DIR, GEOIP_CACHE_SIZE, UA_CACHE_SIZE)
+# forked by start_enrich_pool(), before any scheduler thread exists
+enrich_pool = None
+
+rate_limiter = TokenBucket(CLOUDFLARE_RATE_LIMIT / CLOUDFLARE_RATE_PERIOD, CLOUDFLARE_RATE_BURST)
+
+# one pooled, keep-alive session shared by every window, opened by main()
+cf_session = None
+
+# pipeline stages timed for every window, in order
+WINDOW_STAGES = ('fetch', 'read', 'decode', 'enrich', 'index')
+
+metrics = MetricsRegistry()
+metrics.histogram('cf2os_stage_seconds', 'Seconds spent per window in each pipeline stage')
+metrics.histogram('cf2os_window_rows', 'Rows returned per window',
+                  buckets=(0, 10, 100, 500, 1000, 2500, 5000, 7500, 10000))
+metrics.histogram('cf2os_window_bytes', 'Response bytes per window',
+                  buckets=(1024, 16384, 131072, 1048576, 4194304, 16777216, 67108864))
+metrics.counter('cf2os_enrich_step_seconds_total', 'Seconds spent in each enrichment step')
+metrics.counter('cf2os_windows_total', 'Windows processed, by outcome')
+metrics.counter('cf2os_rows_total', 'Rows decoded from GraphQL responses')
+metrics.counter('cf2os_response_bytes_total', 'Bytes read from GraphQL responses')
+metrics.counter('cf2os_api_requests_total', 'Cloudflare GraphQL requests, by HTTP status')
+metrics.counter('cf2os_api_retries_total', 'Cloudflare GraphQL requests retried, by reason')
+metrics.counter('cf2os_api_errors_total', 'Cloudflare GraphQL requests without a usable response')
+metrics.counter('cf2os_rate_limit_wait_seconds_total', 'Seconds spent waiting for the API rate limiter')
+metrics.counter('cf2os_bulk_requests_total', 'OpenSearch _bulk requests sent')
+metrics.counter('cf2os_bulk_bytes_total', 'Bytes sent in OpenSearch _bulk requests')
+metrics.counter('cf2os_documents_indexed_total', 'Documents indexed')
+metrics.counter('cf2os_documents_failed_total', 'Documents rejected by OpenSearch')
+metrics.counter('cf2os_documents_retried_total', 'Documents sent again after a retryable error')
+metrics.gauge('cf2os_cache_entries', 'Entries in each enrichment cache, summed over processes')
+metrics.gauge('cf2os_cache_hits', 'Enrichment cache hits, summed over processes')
+metrics.gauge('cf2os_cache_misses', 'Enrichment cache misses, summed over processes')
+metrics.gauge('cf2os_cache_hit_ratio', 'Enrichment cache hit ratio')
+metrics.gauge('cf2os_resident_memory_bytes', 'Resident memory of the main process')
+metrics.gauge('cf2os_spool_bytes', 'Bytes of documents waiting in the disk spool')
+metrics.gauge('cf2os_spool_segments', 'Segment files in the disk spool')
+metrics.gauge('cf2os_spool_dead_letter_documents', 'Documents written to the dead-letter file since start')
+
+# latest cache statistics reported by every process that enriched rows, by pid
+worker_caches = {}
+worker_caches_lock = threading.Lock()
+
+# windows, rows, documents and busy seconds shipped per zone label
+zone_stats = {}
+zone_stats_lock = threading.Lock()
 
 
 def create_index_data(index_name: str, index_data: str | dict, index_id: str | int | None,
@@ -68,300 +318,910 @@ def get_past_date(num_days):
     return today - timedelta(days=num_days)
 
 
-def get_cf_graphql(limit, start_date, end_date, include_premium_fields=False):
+# Make sure this is the correct URL for your Cloudflare API
+GRAPHQL_URL = 'https://api.cloudflare.com/client/v4/graphql'
+
 
-    assert (start_date <= end_date)
-    headers = {
+def graphql_headers(zone: ZoneConfig) -> dict:
+    return {
         'Content-Type': 'application/json',
-        'Authorization': f'Bearer {api_token}'
+        'Authorization': f'Bearer {zone.api_token}'
     }
-    # Make sure this is the correct URL for your Cloudflare API
-    url = 'https://api.cloudflare.com/client/v4/graphql'
-
-    # Base fields available on all plans
-    base_fields = """
-        clientCountryName: clientCountryName
-        clientIP: clientIP
-        clientRequestHTTPHost: clientRequestHTTPHost
-        clientRequestHTTPMethodName: clientRequestHTTPMethodName
-        clientRequestPath: clientRequestPath
-        datetime: datetime
-        edgeResponseStatus: edgeResponseStatus
-        originResponseStatus: originResponseStatus
-        sampleInterval: sampleInterval
-        userAgent: userAgent
-    """
-
-    # Premium fields for Bot Management/Enterprise plans
-    premium_fields = """
-        originIP: originIP
-        clientRequestQuery: clientRequestQuery
-        clientRequestReferer: clientRequestReferer
-        clientRefererHost: clientRefererHost
-        clientAsn: clientAsn
-        clientASNDescription: clientASNDescription
-        edgeResponseContentTypeName: edgeResponseContentTypeName
-        botManagementDecision: botManagementDecision
-        botScoreSrcName: botScoreSrcName
-        securityAction: securityAction
-        securitySource: securitySource
-        wafAttackScore: wafAttackScore
-        wafAttackScoreClass: wafAttackScoreClass
-        wafXssAttackScore: wafXssAttackScore
-        xRequestedWith: xRequestedWith
-    """
-
-    # Combine fields based on plan
-    dimensions_fields = base_fields
-    if include_premium_fields:
-        dimensions_fields += premium_fields
-
-    payload = f'''{{
-    "query": "query ZapTimeseriesBydatetimeGroupedByclientRequestPath( $zoneTag: string $filter: ZoneHttpRequestsAdaptiveGroupsFilter_InputObject ) {{ viewer {{ zones(filter: {{ zoneTag: $zoneTag }}) {{ series: httpRequestsAdaptiveGroups(limit: 10000, filter: $filter) {{ count avg {{ sampleInterval __typename }} sum {{ edgeResponseBytes visits __typename }} dimensions {{ {dimensions_fields} }} __typename }} __typename }} __typename }} }}",
-     "variables": {{
-    "accountTag": "{CLOUDFLARE_ACCOUNT}",
-    "zoneTag": "{CLOUDFLARE_ZONE}",
-    "filter": {{
-      "AND": [
-        {{
-          "datetime_geq": "{start_date}",
-          "datetime_leq": "{end_date}"
-        }},
-        {{
-          "userAgent_neq": ""
-         }},
-        {{
-          "userAgent_neq": "test"
-        }},
-        {{
-          "clientRequestPath_notlike": "%/.well-known/%"
-        }},
-        {{
-         "clientRequestPath_neq": "//.well-known/"
-        }},
-        {{
-          "clientRequestPath_notlike": "/favicon.ico"
-        }},
-        {{
-          "clientRequestPath_notlike": "%.ico%"
-        }},
-        {{
-          "clientRequestPath_notlike": "%.gif%"
-        }},
-        {{
-          "clientRequestPath_notlike": "%wlwmanifest%"
-        }},
-        {{
-          "clientRequestPath_notlike": "%.git%"
-        }},
-        {{
-          "clientRequestPath_notlike": "%/durbin%"
-        }},
-        {{
-          "clientRequestPath_notlike": "%/Blueprint.aspx%"
-        }},
-        {{
-          "clientRequestPath_notlike": "%.jsp%"
-        }},
-        {{
-          "clientRequestPath_notlike": "%/.aws%"
-        }},
-        {{
-          "clientRequestPath_notlike": "%/.env%"
-        }},
-        {{
-          "clientRequestPath_notlike": "%/index.php%"
-        }}
-      ]
-    }}
-  }}
-  }}'''
-    payload = payload.replace('\n', '')
-    payload = " ".join(payload.split())
-    # print( payload )
-    r = requests.post(url, data=payload.replace(
-        '\n', ''), headers=headers, verify=False)
+
+
+def graphql_payload(zone: ZoneConfig, limit, start_date, end_date) -> str:
+    return graphql_query.payload(zone, limit, start_date, end_date)
+
+
+def get_cf_graphql(zone: ZoneConfig, limit, start_date, end_date):
+    r = cf_session.post(GRAPHQL_URL, data=graphql_payload(zone, limit, start_date, end_date),
+                        headers=graphql_headers(zone), verify=CLOUDFLARE_VERIFY_TLS,
+                        timeout=(CLOUDFLARE_CONNECT_TIMEOUT, CLOUDFLARE_READ_TIMEOUT), stream=True)
     return r
 
 
 def sent_to_es(raw_data, batch_name: str = None, index_prefix_name: str = None):
-    # raw data is a json string conver to dict'
-    response = json.loads(raw_data)
-    data = response.get("data")
-    errors = response.get('errors')
+    zone = DEFAULT_ZONE if index_prefix_name is None else DEFAULT_ZONE._replace(index_prefix=index_prefix_name)
+    stream, summary = stream_to_es([raw_data], zone, batch_name)
+    if not stream.found:
+        return
+    return summary
+
+
+def new_window_summary() -> dict:
+    """ A bulk summary that also collects the stage and enrichment step timings of a window """
+    summary = BulkIndexer.new_summary()
+    summary['stages'] = dict.fromkeys(WINDOW_STAGES, 0.0)
+    summary['steps'] = enrichment.new_timings()
+    summary['spooled'] = 0
+    summary['written'] = 0
+    # highest resident memory seen while the window was in flight, see sample_memory()
+    summary['peak_rss'] = 0
+    # (dimension set, bucket, values) -> sums of rollup.MEASURES
+    summary['rollups'] = {}
+    return summary
+
+
+def sample_memory(summary: dict):
+    # RSS after each step that holds a window's rows, the peak of a window is the highest sample
+    summary['peak_rss'] = max(summary['peak_rss'], rss_bytes())
+
 
-    if errors:
-        pprint(errors)
+def timed_chunks(chunks: t.Iterable[bytes | str], stages: dict) -> t.Iterator[bytes | str]:
+    # time spent waiting for the body, so it can be told apart from decoding
+    clock = time.perf_counter
+    chunks = iter(chunks)
+    while True:
+        started_at = clock()
+        chunk = next(chunks, None)
+        stages['read'] += clock() - started_at
+        if chunk is None:
+            return
+        yield chunk
+
+
+def stream_to_es(chunks: t.Iterable[bytes | str], zone: ZoneConfig, batch_name: str = None,
+                 summary: dict | None = None, pending: list | None = None, window: Window | None = None):
+    """ Decode rows while the body is read and ship them STREAM_CHUNK_ROWS at a time; with
+    `pending` the documents are enriched into it instead, for a sink that cannot overwrite them """
+    if summary is None:
+        summary = new_window_summary()
+    stages = summary['stages']
+    context = window_context(zone, batch_name, window)
+    stream = SeriesStream(timed_chunks(chunks, stages))
+    rows = iter(stream)
+    while True:
+        started_at = time.perf_counter()
+        read_before = stages['read']
+        chunk = list(itertools.islice(rows, STREAM_CHUNK_ROWS))
+        stages['decode'] += time.perf_counter() - started_at - (stages['read'] - read_before)
+        if not chunk:
+            break
+        started_at = time.perf_counter()
+        enrich_before = stages['enrich']
+        if pending is not None:
+            pending.extend(index_actions(chunk, context, summary))
+        else:
+            sink.write(index_actions(chunk, context, summary), summary, zone.zone)
+        # time spent in the sink, without the enrichment running while it pulls the documents
+        stages['index'] += time.perf_counter() - started_at - (stages['enrich'] - enrich_before)
+        sample_memory(summary)
+
+    if stream.errors:
+        pprint(stream.errors)
 
     # Check if we got any errors or missing data
-    if data is None or "viewer" not in data or 'zones' not in data['viewer']:
+    if not stream.found:
         print('Failed to retrieve data: GraphQL API responded with error:')
-        if errors:
-            print('Errors:', errors)
-        return
+        if stream.errors:
+            print('Errors:', stream.errors)
+        return stream, summary
 
-    # pprint(data)
-    # loop through the raw_data['viewer']['scope']['activity'] and print it
-
-    for item in data['viewer']['zones'][0]['series']:
-        item_data = item['dimensions']
-
-        # Ensure required fields have empty values if not present
-        required_fields = [
-            'clientCountryName',
-            'clientIP',
-            'clientRequestHTTPHost',
-            'clientRequestHTTPMethodName',
-            'clientRequestPath',
-            'datetime',
-            'edgeResponseStatus',
-            'originResponseStatus',
-            'sampleInterval',
-            'userAgent'
-        ]
-        for field in required_fields:
-            if field not in item_data or item_data[field] is None:
-                item_data[field] = ''
-
-        created_date = item_data['datetime']
-        created_at = datetime.fromisoformat(created_date).strftime("%Y.%m.%d")
-
-        # client request query dicts
-        client_request_utm_dict = parse_client_request_query_string(
-            item_data.get('clientRequestQuery', ''))
-        item_data = merge_two_dicts(item_data, client_request_utm_dict)
-
-        # user agent dicts
-        parsed_user_agent = parse_browser_agent(item_data['userAgent'])
-        item_data = merge_two_dicts(item_data, parsed_user_agent)
-
-        # referer dicts
-        parsed_referer = parse_client_referer_url_string(
-            item_data.get('clientRequestReferer', ''))
-        item_data = merge_two_dicts(item_data, parsed_referer)
-
-        # normalize the country name
-        item_data['clientRequest_CountryCode'] = item_data['clientCountryName']
-        item_data['clientRequest_CountryName'] = normalize_country(
-            item_data['clientCountryName'])
-
-        # get client ip geo info
-        geo_result = geoip_instance.get_ip_info(item_data['clientIP'])
-        geo_dicts = {
-            'clientRequest_geoip_city': geo_result['city'],
-            'clientRequest_geoip_country': geo_result['country'],
-            'clientRequest_geoip_country_iso_code': geo_result['country_iso_code'],
-            'clientRequest_geoip_continent': geo_result['continent'],
-            'clientRequest_geoip_province': geo_result['province'],
-            'clientRequest_geoip_postal_code': geo_result['postal_code'],
-            'clientRequest_geoip_latitude': geo_result['latitude'],
-            'clientRequest_geoip_longitude': geo_result['longitude'],
-            'clientRequest_geoip_geocoding': geo_result['geocoding'],
-            'clientRequest_geoip_is_anonymous': geo_result['is_anonymous'],
-            'clientRequest_geoip_is_anonymous_vpn': geo_result['is_anonymous_vpn'],
-            'clientRequest_geoip_is_public_proxy': geo_result['is_public_proxy'],
-            'clientRequest_geoip_is_residential_proxy': geo_result['is_residential_proxy'],
-            'clientRequest_geoip_is_tor_exit_node': geo_result['is_tor_exit_node'],
-            'clientRequest_geoip_is_hosting_provider': geo_result['is_hosting_provider'],
-            'clientRequest_geoip_asn': geo_result['asn'],
-            'clientRequest_geoip_asn_org': geo_result['asn_org'],
-        }
-        item_data = merge_two_dicts(item_data, geo_dicts)
-
-        batch_info = {
-            'log_pull_batch_name': batch_name,
-            'log_pull_batch_datetime': datetime.now().strftime("%Y-%m-%dT%H:%M:%SZ"),
-            # "typename": item_data['__typename'],
-            'count': item['count'],
-            'avg_typename': item['avg']['__typename'],
-            'avg_sampleInterval': item['avg']['sampleInterval'],
-            'sum_edgeResponseBytes': item['sum']['edgeResponseBytes'],
-            'sum_visits': item['sum']['visits'],
-            'sum_typename': item['sum']['__typename'],
-            "accountTag": CLOUDFLARE_ACCOUNT,
-            "zoneTag": CLOUDFLARE_ZONE,
-        }
-        item_data = merge_two_dicts(item_data, batch_info)
-        index_name = index_prefix_name + created_at
-        create_index_data(index_name=index_name, index_data=item_data,
-                          index_id=None)
+    if pending is None:
+        print_bulk_summary(stream, summary)
+    return stream, summary
 
 
-def main():
-    """ Main entry point of the app """
+def window_context(zone: ZoneConfig, batch_name: str = None, window: Window | None = None) -> dict:
+    return enrichment.new_context(zone.zone, zone.account, zone.index_prefix, batch_name,
+                                  ROLLUP_DIMENSIONS, ROLLUP_INTERVAL_MINUTES, window)
 
-    global item_end_date
 
-    # ---- Read run-time config from env ----
-    index_prefix_name = OPENSEARCH_INDEX_PREFIX
-    batch_name = os.getenv("LOG_BACTH_NAME", "LOG250731")
+def rollup_actions(zone: ZoneConfig, window: Window, summary: dict) -> t.List[t.Tuple[str, str]]:
+    # the rollup documents of a window, only shipped once its documents were checkpointed, since
+    # a window that fails may be planned again with other boundaries
+    if not ROLLUP_INDEX_PREFIX or not summary['rollups']:
+        return []
+    return rollup.actions(summary['rollups'], ROLLUP_INDEX_PREFIX, zone.zone, zone.account, window,
+                          ROLLUP_INTERVAL_MINUTES)
 
-    # Dates from env (YYYY-MM-DD), converted to full Zulu timestamps
-    start_date_env = os.getenv("LOG_DATE_START", "2025-10-01")
-    end_date_env = os.getenv("LOG_DATE_END", "2025-10-31")
 
-    start_date_obj = datetime.strptime(
-        f"{start_date_env}T00:00:00Z", "%Y-%m-%dT%H:%M:%SZ"
-    )
-    end_date_obj = datetime.strptime(
-        f"{end_date_env}T23:59:00Z", "%Y-%m-%dT%H:%M:%SZ"
-    )
+def rollups_shipped(zone: ZoneConfig, window: Window, summary: dict, rollup_summary: dict, seconds: float) -> bool:
+    # rejected rollups fail the window, so it is shipped again
+    summary['stages']['index'] += seconds
+    summary['failed'] += rollup_summary['failed']
+    summary['errors'] += rollup_summary['errors']
+    print("[rollup] {} {} documents={} {}={} failed={}".format(
+        zone.label, window.label, len(summary['rollups']), sink.counter, rollup_summary[sink.counter],
+        rollup_summary['failed']))
+    return not rollup_summary['failed']
 
-    counter = 1
-    api_row_limit = 10000
-    end_date_timestamp = end_date_obj.timestamp()
 
-    # Explicitly seed the random number generator based on the current time
-    random.seed()
+def ship_rollups(zone: ZoneConfig, window: Window, summary: dict) -> bool:
+    """ Ship and sync the rollups of a window, False when some were rejected """
+    actions = rollup_actions(zone, window, summary)
+    if not actions:
+        return True
+    rollup_summary = new_window_summary()
+    started_at = time.perf_counter()
+    sink.write(actions, rollup_summary, zone.zone)
+    sink.sync()
+    return rollups_shipped(zone, window, summary, rollup_summary, time.perf_counter() - started_at)
 
-    while True:
-        if counter == 1:
-            start_date = start_date_obj
+
+def rollups_failed(zone: ZoneConfig, window: Window, checkpoints: checkpoint.CheckpointStore, summary: dict) -> str:
+    checkpoints.mark(zone.zone, window, checkpoint.FAILED, indexed=summary['indexed'], failed=summary['failed'],
+                     error='rollups rejected')
+    return checkpoint.FAILED
+
+
+def print_bulk_summary(stream: SeriesStream, summary: dict):
+    print("[bulk] rows={} bytes={} indexed={} failed={} retried={}{}".format(
+        stream.rows, stream.bytes_read, summary['indexed'], summary['failed'], summary['retried'],
+        ' {}={}'.format(sink.counter, summary[sink.counter]) if sink.counter != 'indexed' else ''))
+    for error in summary['errors'][:10]:
+        print(f'[bulk] error: {error}')
+
+
+def index_actions(series: list, context: dict, summary: dict | None = None):
+    # yields serialized bulk (action, source) lines for every enriched row, in row order,
+    # and adds the enrichment timings and the rollup sums to `summary`
+    if enrich_pool is None:
+        started_at = time.perf_counter()
+        results = [enrichment.enrich_rows(series, context)]
+    else:
+        # at least one batch per worker, so a STREAM_CHUNK_ROWS chunk keeps them all busy
+        batch_size = max(1, min(ENRICH_BATCH_SIZE, -(-len(series) // ENRICH_WORKERS)))
+        batches = [series[i:i + batch_size] for i in range(0, len(series), batch_size)]
+        started_at = time.perf_counter()
+        results = enrich_pool.map(enrichment.enrich_rows, batches, itertools.repeat(context))
+
+    for result in results:
+        if summary is not None:
+            # wall time in the main process, waiting for the workers included
+            summary['stages']['enrich'] += time.perf_counter() - started_at
+            for step, seconds in result['timings'].items():
+                summary['steps'][step] += seconds
+            if result['rollups']:
+                rollup.merge(summary['rollups'], result['rollups'])
+        with worker_caches_lock:
+            worker_caches[result['pid']] = result['caches']
+        yield from result['actions']
+        started_at = time.perf_counter()
+
+
+def update_cache_metrics() -> t.Dict[str, float]:
+    """ Sum the latest cache statistics of every process into the cache gauges, returns the hit ratios """
+    totals = {}
+    with worker_caches_lock:
+        for caches in worker_caches.values():
+            for name, stats in caches.items():
+                total = totals.setdefault(name, {'size': 0, 'hits': 0, 'misses': 0})
+                for key in total:
+                    total[key] += stats[key]
+
+    ratios = {}
+    for name, total in totals.items():
+        lookups = total['hits'] + total['misses']
+        ratios[name] = total['hits'] / lookups if lookups else 0.0
+        metrics.set('cf2os_cache_entries', total['size'], cache=name)
+        metrics.set('cf2os_cache_hits', total['hits'], cache=name)
+        metrics.set('cf2os_cache_misses', total['misses'], cache=name)
+        metrics.set('cf2os_cache_hit_ratio', ratios[name], cache=name)
+    return ratios
+
+
+def report_window(zone: ZoneConfig, window: Window, stream: SeriesStream, summary: dict, outcome: str):
+    """ Record the metrics of a shipped window and print its one-line summary """
+    stages = summary['stages']
+    elapsed = sum(stages.values())
+    with zone_stats_lock:
+        stats = zone_stats.setdefault(zone.label, dict.fromkeys(
+            ('windows', 'failed_windows', 'rows', 'bytes', 'shipped', 'failed', 'seconds'), 0))
+        stats['windows'] += 1
+        stats['failed_windows'] += outcome not in (sink.status, 'split')
+        stats['rows'] += stream.rows
+        stats['bytes'] += stream.bytes_read
+        # the documents the sink took: indexed, spooled or written
+        stats['shipped'] += summary[sink.counter]
+        stats['failed'] += summary['failed']
+        stats['seconds'] += elapsed
+
+    for stage, seconds in stages.items():
+        metrics.observe('cf2os_stage_seconds', seconds, stage=stage)
+    for step, seconds in summary['steps'].items():
+        metrics.inc('cf2os_enrich_step_seconds_total', seconds, step=step)
+    metrics.observe('cf2os_window_rows', stream.rows)
+    metrics.observe('cf2os_window_bytes', stream.bytes_read)
+    metrics.inc('cf2os_windows_total', outcome=outcome, zone=zone.label)
+    metrics.inc('cf2os_rows_total', stream.rows, zone=zone.label)
+    metrics.inc('cf2os_response_bytes_total', stream.bytes_read, zone=zone.label)
+    metrics.inc('cf2os_bulk_requests_total', summary['requests'])
+    metrics.inc('cf2os_bulk_bytes_total', summary['bytes'])
+    metrics.inc('cf2os_documents_indexed_total', summary['indexed'], zone=zone.label)
+    metrics.inc('cf2os_documents_failed_total', summary['failed'], zone=zone.label)
+    metrics.inc('cf2os_documents_retried_total', summary['retried'])
+    ratios = update_cache_metrics()
+    if spool is not None:
+        pending = spool.pending()
+        metrics.set('cf2os_spool_bytes', pending['bytes'])
+        metrics.set('cf2os_spool_segments', pending['segments'])
+        metrics.set('cf2os_spool_dead_letter_documents', pending['rejected'])
+
+    step_total = sum(summary['steps'].values())
+    slowest_step = max(summary['steps'], key=summary['steps'].get)
+    print("[stats] {} {} {} rows={} bytes={} {} total={:.2f}s rows/s={:.0f} slowest_step={}({:.0%}) {}".format(
+        zone.label, window.label, outcome, stream.rows, stream.bytes_read,
+        ' '.join('{}={:.2f}s'.format(stage, seconds) for stage, seconds in stages.items()),
+        elapsed, stream.rows / elapsed if elapsed else 0.0,
+        slowest_step, summary['steps'][slowest_step] / step_total if step_total else 0.0,
+        ' '.join('{}_hit={:.1%}'.format(name, ratio) for name, ratio in ratios.items())))
+
+
+def open_sink():
+    """ Build the sink of LOG_SINK, through the disk spool when SPOOL_DIR is set """
+    global spool, sink
+    if SPOOL_DIR and LOG_SINK != 'file':
+        # its drainer thread is started by main(), after the enrichment workers were forked
+        spool = DiskSpool(SPOOL_DIR, BulkIndexer(es, chunk_size=OPENSEARCH_BULK_CHUNK_SIZE,
+                                                 max_chunk_bytes=OPENSEARCH_BULK_MAX_BYTES,
+                                                 max_retries=OPENSEARCH_BULK_MAX_RETRIES, raise_unavailable=True),
+                          segment_bytes=SPOOL_SEGMENT_BYTES, max_bytes=SPOOL_MAX_BYTES)
+
+    if LOG_SINK == 'file':
+        sink = FileSink(FILE_SINK_DIR, FILE_SINK_COMPRESSION, rotate_bytes=FILE_SINK_ROTATE_BYTES,
+                        buffer_bytes=FILE_SINK_BUFFER_BYTES)
+    elif spool is not None:
+        sink = SpoolSink(spool)
+    else:
+        sink = OpenSearchSink(bulk_indexer, new_async_opensearch_client)
+
+
+def start_enrich_pool():
+    """ Open the GeoLite2 readers and build the user agent parser, then fork the ENRICH_WORKERS workers """
+    global enrich_pool
+    # the workers inherit the parser instead of each building their own, and open their own readers
+    enrichment.preload()
+    if ENRICH_WORKERS > 0:
+        enrich_pool = ProcessPoolExecutor(
+            max_workers=ENRICH_WORKERS, mp_context=multiprocessing.get_context('fork'),
+            initializer=enrichment.init_worker, initargs=(GEOIP_DB_DIR, GEOIP_CACHE_SIZE, UA_CACHE_SIZE, True))
+        # the first task forks every worker at once, so do it while the process is single-threaded
+        enrich_pool.submit(enrichment.cache_stats).result()
+
+
+def window_days(window: Window) -> t.List[datetime]:
+    """ Midnights of the days a window has rows in, i.e. of its daily indices """
+    day = window.start.replace(hour=0, minute=0, second=0, microsecond=0)
+    days = []
+    while day < window.end:
+        days.append(day)
+        day += timedelta(days=1)
+    return days
+
+
+def finish_completed_days(zone: ZoneConfig, window: Window, planner: AdaptiveWindowPlanner,
+                          checkpoints: checkpoint.CheckpointStore):
+    # a daily index is complete once every zone writing to it has indexed its part of the range
+    if not index_lifecycle.bulk_settings:
+        return
+    for day in window_days(window):
+        start, end = max(day, planner.start), min(day + timedelta(days=1), planner.end)
+        if all(any(done.start <= start and done.end >= end for done in checkpoints.completed(other.zone, start, end))
+               for other in CLOUDFLARE_ZONES if other.index_prefix == zone.index_prefix):
+            index_lifecycle.finish(zone.index_prefix + day.strftime("%Y.%m.%d"))
+
+
+def print_zone_stats():
+    with zone_stats_lock:
+        for label, stats in sorted(zone_stats.items()):
+            print("[report] zone={} windows={} failed_windows={} rows={} bytes={} {}={} failed={} "
+                  "rows/s={:.0f}".format(label, stats['windows'], stats['failed_windows'], stats['rows'],
+                                         stats['bytes'], sink.counter, stats['shipped'], stats['failed'],
+                                         stats['rows'] / stats['seconds'] if stats['seconds'] else 0.0))
+
+
+def fetch_window(zone: ZoneConfig, limit, start_date, end_date, first_attempt: int = 0):
+    """ POST the query of a window, returns the response and the attempt that got it """
+    # wait for a token before every call; retry 429, 5xx and connection failures until the window
+    # spent its CLOUDFLARE_MAX_RETRIES retries, the `first_attempt` ones went to bodies that failed
+    # while they were read; a 429 makes every window back off
+    for attempt in range(first_attempt, CLOUDFLARE_MAX_RETRIES + 1):
+        metrics.inc('cf2os_rate_limit_wait_seconds_total', rate_limiter.acquire())
+        try:
+            r = get_cf_graphql(zone, limit, start_date, end_date)
+        except httpclient.RETRYABLE_ERRORS as err:
+            metrics.inc('cf2os_api_errors_total')
+            if attempt == CLOUDFLARE_MAX_RETRIES:
+                raise
+            delay = httpclient.backoff(attempt, CLOUDFLARE_BACKOFF_SECONDS, CLOUDFLARE_MAX_BACKOFF_SECONDS)
+            print("[retry] {} {} -> {} {}, retrying in {:.1f}s".format(zone.label, start_date, end_date, err, delay))
+            metrics.inc('cf2os_api_retries_total', reason='connection')
+            time.sleep(delay)
+            continue
+        except requests.exceptions.RequestException:
+            metrics.inc('cf2os_api_errors_total')
+            raise
+
+        metrics.inc('cf2os_api_requests_total', status=str(r.status_code))
+        if r.status_code not in httpclient.RETRYABLE_STATUS or attempt == CLOUDFLARE_MAX_RETRIES:
+            return r, attempt
+        delay = httpclient.retry_after(r)
+        if delay is None:
+            delay = httpclient.backoff(attempt, CLOUDFLARE_BACKOFF_SECONDS, CLOUDFLARE_MAX_BACKOFF_SECONDS)
+        # the streamed body was not read: closing it drops the connection rather than holding it while waiting
+        r.close()
+        print("[retry] {} {} -> {} HTTP {}, retrying in {:.1f}s".format(
+            zone.label, start_date, end_date, r.status_code, delay))
+        metrics.inc('cf2os_api_retries_total', reason=str(r.status_code))
+        if r.status_code == 429:
+            rate_limiter.pause(delay)
         else:
-            start_date = item_end_date
+            time.sleep(delay)
+    return r, attempt
+
+
+def process_window(zone: ZoneConfig, window: Window, planner: AdaptiveWindowPlanner,
+                   checkpoints: checkpoint.CheckpointStore, batch_name: str = None):
+    try:
+        if window_profiler is not None and window_profiler.selected(window):
+            with window_profiler.profile(zone.zone, window):
+                summary = ship_window(zone, window, planner, checkpoints, batch_name)
+        else:
+            summary = ship_window(zone, window, planner, checkpoints, batch_name)
+    except Exception as err:
+        window_failed(zone, window, checkpoints, err)
+        raise
+    return summary
+
 
-        item_start_date = start_date
-        item_start_date_string = item_start_date.strftime("%Y-%m-%dT%H:%M:%SZ")
-        item_end_date = item_start_date + timedelta(hours=6)
-        item_end_date_string = item_end_date.strftime("%Y-%m-%dT%H:%M:%SZ")
+def window_failed(zone: ZoneConfig, window: Window, checkpoints: checkpoint.CheckpointStore, err: Exception):
+    checkpoints.mark(zone.zone, window, checkpoint.FAILED, error=str(err))
+    metrics.inc('cf2os_windows_total', outcome='error', zone=zone.label)
 
-        print("[item_start_date] {}".format(item_start_date_string))
-        print("[item_end_date  ] {}".format(item_end_date_string))
 
+def report_memory(zone: ZoneConfig, window: Window, summary: dict):
+    # `peak` is the highest RSS sampled while this window was decoded and enriched, `process_peak`
+    # the highest of the whole run; with several windows in flight they share the process
+    rss = rss_bytes()
+    metrics.set('cf2os_resident_memory_bytes', rss)
+    print("[memory] {} {} rss={:.1f}MB peak={:.1f}MB process_peak={:.1f}MB".format(
+        zone.label, window.label, rss / 1048576, max(rss, summary['peak_rss']) / 1048576,
+        max(rss, peak_rss_bytes()) / 1048576))
+
+
+def ship_window(zone: ZoneConfig, window: Window, planner: AdaptiveWindowPlanner,
+                checkpoints: checkpoint.CheckpointStore, batch_name: str = None):
+    item_start_date_string = format_timestamp(window.start)
+    item_end_date_string = format_timestamp(window.end)
+    print("[window] {} {} -> {}".format(zone.label, item_start_date_string, item_end_date_string))
+    checkpoints.mark(zone.zone, window, checkpoint.PENDING)
+
+    # the body is read while it is decoded: a connection dropped or timing out in the middle
+    # fetches the window again, its documents are written again with the same ids; the reads
+    # and the requests of a window share its CLOUDFLARE_MAX_RETRIES retries
+    attempt = 0
+    while True:
+        summary = new_window_summary()
+        r = None
         try:
-            r = get_cf_graphql(
-                api_row_limit, item_start_date_string, item_end_date_string, INCLUDE_PREMIUM_FIELDS)
+            started_at = time.perf_counter()
+            r, attempt = fetch_window(zone, planner.row_limit, item_start_date_string, item_end_date_string,
+                                      attempt)
+            summary['stages']['fetch'] = time.perf_counter() - started_at
             r.raise_for_status()
         except requests.exceptions.HTTPError as http_err:
             print(f'HTTP error occurred: {http_err}')
             if r is not None:
                 print(f'Response content: {r.content}')
+            raise
         except requests.exceptions.RequestException as err:
             print(f'Other error occurred: {err}')
+            raise
+
+        for day in window_days(window):
+            index_lifecycle.prepare(zone.index_prefix + day.strftime("%Y.%m.%d"))
+
+        chunks = r.iter_content(chunk_size=STREAM_READ_BYTES)
+        if response_archive is not None:
+            chunks = response_archive.tee(zone.zone, window, chunks)
+        # an append-only sink only gets the documents once the planner kept the window
+        pending = None if sink.overwrites else []
+        try:
+            stream, summary = stream_to_es(chunks, zone, batch_name, summary, pending, window)
+        except json.JSONDecodeError as json_err:
+            print(f'JSON decode error: {json_err}')
+            raise
+        except requests.exceptions.RequestException as err:
+            metrics.inc('cf2os_api_errors_total')
+            if attempt == CLOUDFLARE_MAX_RETRIES:
+                print(f'Reading the response failed: {err}')
+                raise
+            delay = httpclient.backoff(attempt, CLOUDFLARE_BACKOFF_SECONDS, CLOUDFLARE_MAX_BACKOFF_SECONDS)
+            print("[retry] {} {} -> {} reading the response failed ({}), retrying in {:.1f}s".format(
+                zone.label, item_start_date_string, item_end_date_string, err, delay))
+            metrics.inc('cf2os_api_retries_total', reason='read')
+            time.sleep(delay)
+            attempt += 1
+            continue
+        finally:
+            r.close()
+        break
+    report_memory(zone, window, summary)
+
+    if not stream.found:
+        if response_archive is not None:
+            response_archive.discard(zone.zone, window)
+        checkpoints.mark(zone.zone, window, checkpoint.FAILED, error='GraphQL API responded with error')
+        report_window(zone, window, stream, summary, 'api_error')
+        return
+    checkpoints.mark(zone.zone, window, checkpoint.FETCHED, rows=stream.rows)
+    # a window that hit the row limit is truncated, the planner re-queues its halves; the rows
+    # already shipped are overwritten by the halves since their document ids are the same
+    if not planner.record(window, stream.rows):
+        if response_archive is not None:
+            response_archive.discard(zone.zone, window)
+        report_window(zone, window, stream, summary, 'split')
+        return SPLIT
+    if pending:
+        started_at = time.perf_counter()
+        sink.write(pending, summary, zone.zone)
+        summary['stages']['index'] += time.perf_counter() - started_at
+    if pending is not None:
+        print_bulk_summary(stream, summary)
+
+    sink.sync()
+    status = sink.window_status(summary)
+    checkpoints.mark(zone.zone, window, status, indexed=summary['indexed'], failed=summary['failed'])
+    if status != checkpoint.FAILED and not ship_rollups(zone, window, summary):
+        status = rollups_failed(zone, window, checkpoints, summary)
+    report_window(zone, window, stream, summary, status)
+    if status == checkpoint.INDEXED:
+        finish_completed_days(zone, window, planner, checkpoints)
+    return summary
+
+
+def run_ranges(ranges: t.List[t.Tuple[ZoneConfig, datetime, datetime]], checkpoints: checkpoint.CheckpointStore,
+               batch_name: str = None) -> dict:
+    """ Ship every (zone, start, end) range, the zones take turns handing windows to the shared workers """
+    planners = []
+    for zone, start_date_obj, end_date_obj in ranges:
+        # resume: windows indexed by a previous run are skipped, failed or missing ones are fetched again
+        completed = checkpoints.completed(zone.zone, start_date_obj, end_date_obj)
+        if completed and LOG_MODE == 'backfill':
+            print("[resume] {} skipping {} already indexed range(s) from {}".format(
+                zone.label, len(completed), checkpoints.path))
+        planners.append((zone, AdaptiveWindowPlanner(
+            start_date_obj, end_date_obj,
+            span=timedelta(minutes=LOG_WINDOW_MINUTES),
+            row_limit=CLOUDFLARE_ROW_LIMIT,
+            min_span=timedelta(minutes=LOG_WINDOW_MIN_MINUTES),
+            max_span=timedelta(minutes=LOG_WINDOW_MAX_MINUTES),
+            completed=completed)))
+
+    turns = itertools.count()
+
+    def next_window():
+        first = next(turns)
+        for offset in range(len(planners)):
+            zone, planner = planners[(first + offset) % len(planners)]
+            window = planner.next_window()
+            if window is not None:
+                return zone, planner, window
+        return None
+
+    if LOG_ENGINE == 'asyncio':
+        return asyncio.run(run_pipeline(next_window, checkpoints, batch_name))
+
+    scheduler = WindowScheduler(CLOUDFLARE_CONCURRENCY)
+    return scheduler.run(next_window, lambda item: process_window(
+        item[0], item[2], item[1], checkpoints, batch_name))
+
+
+async def fetch_window_async(session, zone: ZoneConfig, limit, start_date, end_date, first_attempt: int = 0):
+    # fetch_window() on an aiohttp session, the rate limiter and the retries are the same
+    import aiohttp
+
+    retryable_errors = httpclient.async_retryable_errors()
+    for attempt in range(first_attempt, CLOUDFLARE_MAX_RETRIES + 1):
+        metrics.inc('cf2os_rate_limit_wait_seconds_total', await rate_limiter.acquire_async())
+        try:
+            r = await session.post(GRAPHQL_URL, data=graphql_payload(zone, limit, start_date, end_date),
+                                   headers=graphql_headers(zone))
+        except retryable_errors as err:
+            metrics.inc('cf2os_api_errors_total')
+            if attempt == CLOUDFLARE_MAX_RETRIES:
+                raise
+            delay = httpclient.backoff(attempt, CLOUDFLARE_BACKOFF_SECONDS, CLOUDFLARE_MAX_BACKOFF_SECONDS)
+            print("[retry] {} {} -> {} {!r}, retrying in {:.1f}s".format(
+                zone.label, start_date, end_date, err, delay))
+            metrics.inc('cf2os_api_retries_total', reason='connection')
+            await asyncio.sleep(delay)
+            continue
+        except aiohttp.ClientError:
+            metrics.inc('cf2os_api_errors_total')
+            raise
+
+        metrics.inc('cf2os_api_requests_total', status=str(r.status))
+        if r.status not in httpclient.RETRYABLE_STATUS or attempt == CLOUDFLARE_MAX_RETRIES:
+            return r, attempt
+        delay = httpclient.retry_after(r)
+        if delay is None:
+            delay = httpclient.backoff(attempt, CLOUDFLARE_BACKOFF_SECONDS, CLOUDFLARE_MAX_BACKOFF_SECONDS)
+        r.release()
+        print("[retry] {} {} -> {} HTTP {}, retrying in {:.1f}s".format(
+            zone.label, start_date, end_date, r.status, delay))
+        metrics.inc('cf2os_api_retries_total', reason=str(r.status))
+        if r.status == 429:
+            rate_limiter.pause(delay)
         else:
-            if r is not None:
-                try:
-                    sent_to_es(r.text, batch_name, index_prefix_name)
-                except json.JSONDecodeError as json_err:
-                    print(f'JSON decode error: {json_err}')
-                    print(f'Response content: {r.content}')
-            else:
-                print('No response received')
-
-        # increment the file number
-        counter += 1
-        print("[tem_counter ] {}".format(counter))
-        # convert the start date to unix time
-        current_item_date_timestamp = item_start_date.timestamp()
-        if current_item_date_timestamp > end_date_timestamp:
-            print("End of the loop")
+            await asyncio.sleep(delay)
+    return r, attempt
+
+
+def enrich_window(zone: ZoneConfig, window: Window, body: bytes, batch_name: str, summary: dict):
+    # decode and enrich a whole response, in a thread of the asyncio engine
+    chunks = [body]
+    if response_archive is not None:
+        chunks = response_archive.tee(zone.zone, window, chunks)
+    started_at = time.perf_counter()
+    stream = SeriesStream(chunks)
+    rows = list(stream)
+    summary['stages']['decode'] += time.perf_counter() - started_at
+    sample_memory(summary)
+    actions = list(index_actions(rows, window_context(zone, batch_name, window), summary))
+    sample_memory(summary)
+    return stream, actions
+
+
+async def run_pipeline(next_window: t.Callable, checkpoints: checkpoint.CheckpointStore,
+                       batch_name: str = None) -> dict:
+    """ Ship the windows handed out by `next_window()` through the fetch -> enrich -> index pipeline """
+    session = httpclient.new_async_session(CLOUDFLARE_CONCURRENCY, CLOUDFLARE_CONNECT_TIMEOUT,
+                                           CLOUDFLARE_READ_TIMEOUT, CLOUDFLARE_VERIFY_TLS)
+
+    async def fetch(item):
+        zone, planner, window = item
+        print("[window] {} {} -> {}".format(zone.label, format_timestamp(window.start), format_timestamp(window.end)))
+        checkpoints.mark(zone.zone, window, checkpoint.PENDING)
+        import aiohttp
+
+        read_errors = (aiohttp.ClientPayloadError,) + httpclient.async_retryable_errors()
+        # a body failing while it is read is fetched again, like a failed request, from the same retries
+        attempt = 0
+        while True:
+            summary = new_window_summary()
+            started_at = time.perf_counter()
+            r, attempt = await fetch_window_async(session, zone, planner.row_limit, format_timestamp(window.start),
+                                                  format_timestamp(window.end), attempt)
+            try:
+                summary['stages']['fetch'] = time.perf_counter() - started_at
+                if r.status >= 400:
+                    print(f'HTTP error occurred: {r.status} {r.reason}')
+                    print(f'Response content: {await r.read()}')
+                    r.raise_for_status()
+                started_at = time.perf_counter()
+                body = await r.read()
+                summary['stages']['read'] = time.perf_counter() - started_at
+                sample_memory(summary)
+            except read_errors as err:
+                metrics.inc('cf2os_api_errors_total')
+                if attempt == CLOUDFLARE_MAX_RETRIES:
+                    print(f'Reading the response failed: {err!r}')
+                    raise
+                delay = httpclient.backoff(attempt, CLOUDFLARE_BACKOFF_SECONDS, CLOUDFLARE_MAX_BACKOFF_SECONDS)
+                print("[retry] {} {} reading the response failed ({!r}), retrying in {:.1f}s".format(
+                    zone.label, window.label, err, delay))
+                metrics.inc('cf2os_api_retries_total', reason='read')
+                await asyncio.sleep(delay)
+                attempt += 1
+                continue
+            finally:
+                r.release()
+            return summary, body
+
+    async def enrich(item, fetched):
+        zone, planner, window = item
+        summary, body = fetched
+        if window_profiler is not None and window_profiler.selected(window):
+            def profiled():
+                with window_profiler.profile(zone.zone, window):
+                    return enrich_window(zone, window, body, batch_name, summary)
+            stream, actions = await asyncio.to_thread(profiled)
+        else:
+            stream, actions = await asyncio.to_thread(enrich_window, zone, window, body, batch_name, summary)
+        report_memory(zone, window, summary)
+
+        if stream.errors:
+            pprint(stream.errors)
+        if not stream.found:
+            print('Failed to retrieve data: GraphQL API responded with error:')
+            if response_archive is not None:
+                response_archive.discard(zone.zone, window)
+            checkpoints.mark(zone.zone, window, checkpoint.FAILED, error='GraphQL API responded with error')
+            report_window(zone, window, stream, summary, 'api_error')
+            return None
+        checkpoints.mark(zone.zone, window, checkpoint.FETCHED, rows=stream.rows)
+        # a truncated window is split before any of its rows are indexed
+        if not planner.record(window, stream.rows):
+            if response_archive is not None:
+                response_archive.discard(zone.zone, window)
+            report_window(zone, window, stream, summary, 'split')
+            return SPLIT
+        return stream, summary, actions
+
+    async def index(item, enriched):
+        zone, planner, window = item
+        stream, summary, actions = enriched
+        for day in window_days(window):
+            await asyncio.to_thread(index_lifecycle.prepare, zone.index_prefix + day.strftime("%Y.%m.%d"))
+        started_at = time.perf_counter()
+        await sink.write_async(actions, summary, zone.zone)
+        summary['stages']['index'] = time.perf_counter() - started_at
+        await asyncio.to_thread(sink.sync)
+        status = sink.window_status(summary)
+        print_bulk_summary(stream, summary)
+
+        checkpoints.mark(zone.zone, window, status, indexed=summary['indexed'], failed=summary['failed'])
+        actions = rollup_actions(zone, window, summary) if status != checkpoint.FAILED else []
+        if actions:
+            rollup_summary = new_window_summary()
+            started_at = time.perf_counter()
+            await sink.write_async(actions, rollup_summary, zone.zone)
+            await asyncio.to_thread(sink.sync)
+            if not rollups_shipped(zone, window, summary, rollup_summary, time.perf_counter() - started_at):
+                status = rollups_failed(zone, window, checkpoints, summary)
+        report_window(zone, window, stream, summary, status)
+        if status == checkpoint.INDEXED:
+            await asyncio.to_thread(finish_completed_days, zone, window, planner, checkpoints)
+        return summary
+
+    # the enrichment of a window holds the GIL, with worker processes a second one keeps them busy
+    pipeline = AsyncWindowPipeline(fetch_concurrency=CLOUDFLARE_CONCURRENCY,
+                                   enrich_concurrency=1 if enrich_pool is None else 2,
+                                   index_concurrency=PIPELINE_INDEX_CONCURRENCY, queue_size=PIPELINE_QUEUE_SIZE)
+    try:
+        await sink.open_async()
+        return await pipeline.run(next_window, fetch, enrich, index,
+                                  on_error=lambda item, err: window_failed(item[0], item[2], checkpoints, err))
+    finally:
+        await session.close()
+        await sink.close_async()
+
+
+def replay(start_date_obj: datetime, end_date_obj: datetime, batch_name: str = None,
+           zones: t.List[ZoneConfig] = CLOUDFLARE_ZONES) -> dict:
+    """ Feed archived responses through enrichment and indexing, without calling the API """
+    archived = iter([(zone, window, path) for zone in zones
+                     for window, path in response_archive.windows(zone.zone, start_date_obj, end_date_obj)])
+
+    def replay_window(entry):
+        zone, window, path = entry
+        print("[replay] {} {} from {}".format(zone.label, window.label, path))
+        for day in window_days(window):
+            index_lifecycle.prepare(zone.index_prefix + day.strftime("%Y.%m.%d"))
+        if window_profiler is not None and window_profiler.selected(window):
+            with window_profiler.profile(zone.zone, window):
+                stream, summary = stream_to_es(ResponseArchive.read(path, STREAM_READ_BYTES), zone, batch_name,
+                                               window=window)
+        else:
+            stream, summary = stream_to_es(ResponseArchive.read(path, STREAM_READ_BYTES), zone, batch_name,
+                                           window=window)
+        if stream.found:
+            if sink.window_status(summary) != checkpoint.FAILED:
+                ship_rollups(zone, window, summary)
+            report_window(zone, window, stream, summary, sink.window_status(summary))
+        return summary
+
+    scheduler = WindowScheduler(CLOUDFLARE_CONCURRENCY)
+    return scheduler.run(lambda: next(archived, None), replay_window)
+
+
+def advance_watermark(zone: ZoneConfig, watermark: datetime, target: datetime,
+                      checkpoints: checkpoint.CheckpointStore) -> datetime:
+    """ Move the watermark over the contiguous completed range that starts at it """
+    for done in checkpoints.completed(zone.zone, watermark, target):
+        if done.start > watermark:
             break
+        watermark = max(watermark, min(done.end, target))
+    return watermark
+
+
+def skip_failed_window(zone: ZoneConfig, watermark: datetime, target: datetime,
+                       checkpoints: checkpoint.CheckpointStore) -> datetime:
+    """ Give up on the failed window at the watermark, returns the watermark past it """
+    failed = checkpoints.failed_at(zone.zone, watermark)
+    if failed is None:
+        return watermark
+    window, error = failed
+    checkpoints.mark(zone.zone, window, checkpoint.SKIPPED, error=error)
+    print("[follow] {} skipping {} after {} failed polls ({}), a backfill of the range fetches it again".format(
+        zone.label, window.label, LOG_FOLLOW_MAX_ATTEMPTS, error))
+    metrics.inc('cf2os_windows_total', outcome=checkpoint.SKIPPED, zone=zone.label)
+    return advance_watermark(zone, min(window.end, target), target, checkpoints)
+
+
+def follow(checkpoints: checkpoint.CheckpointStore, batch_name: str = None,
+           zones: t.List[ZoneConfig] = CLOUDFLARE_ZONES):
+    """ Keep shipping new traffic, LOG_FOLLOW_LAG_MINUTES behind now """
+    stop = threading.Event()
+    signal.signal(signal.SIGTERM, lambda signum, frame: stop.set())
+
+    lag = timedelta(minutes=LOG_FOLLOW_LAG_MINUTES)
+    watermarks = {}
+    # zone -> polls in a row that ended with its watermark held back by a failed window
+    held_back = {}
+    for zone in zones:
+        watermark = checkpoints.get_watermark(zone.zone)
+        if watermark is None:
+            watermark = datetime.utcnow().replace(second=0, microsecond=0) - lag - \
+                timedelta(minutes=LOG_FOLLOW_LOOKBACK_MINUTES)
+        watermarks[zone] = watermark
+        print("[follow] {} starting from {} with a lag of {}".format(zone.label, format_timestamp(watermark), lag))
+
+    while not stop.is_set():
+        # windows end on whole minutes, like the ones the planner splits
+        target = datetime.utcnow().replace(second=0, microsecond=0) - lag
+        ranges = [(zone, watermark, target) for zone, watermark in watermarks.items()
+                  if target - watermark >= timedelta(seconds=LOG_FOLLOW_INTERVAL_SECONDS)]
+        if ranges:
+            report = run_ranges(ranges, checkpoints, batch_name)
+
+            for zone, watermark, _ in ranges:
+                # only advance over the contiguous indexed range, a failed window is retried next poll
+                advanced = advance_watermark(zone, watermark, target, checkpoints)
+                held_back[zone] = held_back.get(zone, 0) + 1 if advanced == watermark else 1
+                watermark = advanced
+                if watermark >= target:
+                    held_back[zone] = 0
+                elif LOG_FOLLOW_MAX_ATTEMPTS and held_back[zone] >= LOG_FOLLOW_MAX_ATTEMPTS:
+                    watermark = skip_failed_window(zone, watermark, target, checkpoints)
+                    held_back[zone] = 0
+                checkpoints.set_watermark(zone.zone, watermark)
+                watermarks[zone] = watermark
+            print("[follow] watermark={} windows completed={} failed={} split={}".format(
+                format_timestamp(min(watermarks.values())), report['completed'], report['failed'], report['split']))
+
+        stop.wait(LOG_FOLLOW_INTERVAL_SECONDS)
+
+
+def close_sink():
+    """ Complete the sink before exiting; the spool is waited for up to SPOOL_DRAIN_TIMEOUT seconds,
+    whatever is left is indexed on the next start """
+    if spool is None:
+        sink.close()
+        return
+    print(f"[spool] waiting up to {SPOOL_DRAIN_TIMEOUT}s for {spool.pending()['bytes'] / 1048576:.1f}MB to be indexed")
+    drained = sink.close(SPOOL_DRAIN_TIMEOUT)
+    pending = spool.pending()
+    if drained:
+        print("[spool] drained indexed={} dead_letter={} quarantined={}".format(
+            pending['drained'], pending['rejected'], pending['quarantined']))
+    else:
+        print("[spool] {} segment(s), {:.1f}MB left in {} for the next start".format(
+            pending['segments'], pending['bytes'] / 1048576, SPOOL_DIR))
+
+
+def main():
+    """ Main entry point of the app """
+    global cf_session
+
+    # ---- Read run-time config from env ----
+    batch_name = os.getenv("LOG_BACTH_NAME", "LOG250731")
+
+    if not CLOUDFLARE_ZONES:
+        print("No zone to ship: set CLOUDFLARE_ZONE or CLOUDFLARE_ZONES")
+        return
+    if LOG_ENGINE not in ('threads', 'asyncio'):
+        print(f"Unknown LOG_ENGINE {LOG_ENGINE!r}: use threads or asyncio")
+        return
+    if LOG_SINK not in ('opensearch', 'file'):
+        print(f"Unknown LOG_SINK {LOG_SINK!r}: use opensearch or file")
+        return
+    overlapping = sorted({zone.index_prefix for zone in CLOUDFLARE_ZONES if ROLLUP_INDEX_PREFIX and (
+        ROLLUP_INDEX_PREFIX.startswith(zone.index_prefix) or zone.index_prefix.startswith(ROLLUP_INDEX_PREFIX))})
+    if overlapping:
+        print(f"ROLLUP_INDEX_PREFIX {ROLLUP_INDEX_PREFIX!r} overlaps the indices of {', '.join(overlapping)}: "
+              "the rollups would be counted with the raw documents")
+        return
+
+    # a missing database would only show once every window's response was fetched
+    missing = enrichment.geoinfo().missing_databases()
+    if missing:
+        raise SystemExit("GeoLite2 database(s) not found: {}; download them or set GEOIP_DB_DIR".format(
+            ', '.join(missing)))
+
+    # Explicitly seed the random number generator based on the current time
+    random.seed()
+
+    cf_session = httpclient.new_session(CLOUDFLARE_CONCURRENCY)
+    start_enrich_pool()
+    open_sink()
+    if spool is not None:
+        spool.start()
+
+    if LOG_SINK == 'file':
+        print(f"[sink] writing {sink.compression} NDJSON files to {FILE_SINK_DIR}")
+    elif OPENSEARCH_INSTALL_TEMPLATE:
+        try:
+            index_lifecycle.install_template()
+        except Exception as err:
+            # e.g. a shipping user without the manage_index_templates privilege
+            print(f'[template] could not install index template {OPENSEARCH_TEMPLATE_NAME}: {err}')
+
+    if METRICS_PORT:
+        MetricsServer(metrics, METRICS_PORT, METRICS_ADDRESS).start()
+
+    # Dates from env (YYYY-MM-DD), converted to full Zulu timestamps
+    start_date_env = os.getenv("LOG_DATE_START", "2025-10-01")
+    end_date_env = os.getenv("LOG_DATE_END", "2025-10-31")
+
+    start_date_obj = datetime.strptime(
+        f"{start_date_env}T00:00:00Z", "%Y-%m-%dT%H:%M:%SZ"
+    )
+    # the end of the range is exclusive, so the last day runs up to the next midnight
+    end_date_obj = datetime.strptime(
+        f"{end_date_env}T00:00:00Z", "%Y-%m-%dT%H:%M:%SZ"
+    ) + timedelta(days=1)
+
+    if LOG_MODE == 'replay':
+        if response_archive is None:
+            print("[replay] LOG_ARCHIVE_DIR is not set, nothing to replay")
+            return
+        try:
+            report = replay(start_date_obj, end_date_obj, batch_name)
+            close_sink()
+        finally:
+            index_lifecycle.finish_all()
+        print("[report] replayed windows completed={} failed={} elapsed={:.1f}s rate={:.2f} windows/min".format(
+            report['completed'], report['failed'], report['elapsed'], report['windows_per_minute']))
+        print_zone_stats()
+        if enrich_pool is not None:
+            enrich_pool.shutdown()
+        return
+
+    checkpoints = checkpoint.CheckpointStore(LOG_STATE_DIR)
+
+    if LOG_MODE == 'follow':
+        try:
+            follow(checkpoints, batch_name)
+        except KeyboardInterrupt:
+            print("[follow] stopped")
+        close_sink()
+        checkpoints.close()
+        print_zone_stats()
+        if enrich_pool is not None:
+            enrich_pool.shutdown()
+        return
+
+    try:
+        report = run_ranges([(zone, start_date_obj, end_date_obj) for zone in CLOUDFLARE_ZONES],
+                            checkpoints, batch_name)
+        close_sink()
+    finally:
+        # days with failed windows are not complete, but must not stay unrefreshed
+        index_lifecycle.finish_all()
+    checkpoints.close()
 
-        # Sleep for a random time between 2 and 7 seconds (floating-point)
-        sleep_time = random.uniform(7, 12)
-        print("[Slow the process ] Sleeping for " +
-              str(sleep_time) + " seconds")
-        time.sleep(sleep_time)
+    print("[report] windows completed={} failed={} split={} elapsed={:.1f}s rate={:.2f} windows/min".format(
+        report['completed'], report['failed'], report['split'], report['elapsed'], report['windows_per_minute']))
+    print_zone_stats()
+    if enrich_pool is not None:
+        enrich_pool.shutdown()
+    else:
+        for name, stats in enrichment.cache_stats().items():
+            print("[report] {} cache size={} hits={} misses={}".format(
+                name, stats['size'], stats['hits'], stats['misses']))
 
 
 # Prevents main() from being executed during imports.
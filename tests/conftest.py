@@ -0,0 +1,21 @@
+# -*- coding: utf-8 -*-
+import os
+import sys
+
+import pytest
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# the shipper imports its modules as `library.*`, the synthetic data lives next to the benchmarks
+sys.path.insert(0, os.path.join(ROOT_DIR, 'src'))
+sys.path.insert(0, os.path.join(ROOT_DIR, 'benchmarks'))
+
+
+@pytest.fixture(scope='session')
+def geo_db_dir(tmp_path_factory) -> str:
+    """ A directory with the synthetic GeoLite2-City / GeoLite2-ASN look-alikes """
+    import synthetic
+
+    db_dir = str(tmp_path_factory.mktemp('db'))
+    synthetic.write_geo_databases(db_dir)
+    return db_dir
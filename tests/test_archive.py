@@ -0,0 +1,65 @@
+# -*- coding: utf-8 -*-
+import os
+from datetime import datetime, timedelta
+
+import pytest
+
+from library.archive import ResponseArchive
+from library.windows import Window, iter_windows
+
+BODY = [b'{"data": {"viewer": ', b'{"zones": []}}, ', b'"errors": null}']
+
+
+def archive_window(archive: ResponseArchive, zone: str | None, window: Window) -> bytes:
+    return b''.join(archive.tee(zone, window, iter(BODY)))
+
+
+def test_tee_passes_the_body_through_and_archives_it(tmp_path):
+    archive = ResponseArchive(str(tmp_path))
+    window = Window(datetime(2025, 10, 1, 6), datetime(2025, 10, 1, 7))
+    assert archive_window(archive, 'shop', window) == b''.join(BODY)
+    path = archive.path('shop', window)
+    assert path == os.path.join(str(tmp_path), 'shop', '2025-10-01', '20251001T060000Z_20251001T070000Z.json.gz')
+    assert b''.join(ResponseArchive.read(path, chunk_size=7)) == b''.join(BODY)
+
+
+def test_an_interrupted_body_is_not_archived(tmp_path):
+    archive = ResponseArchive(str(tmp_path))
+    window = Window(datetime(2025, 10, 1), datetime(2025, 10, 1, 1))
+
+    def broken_body():
+        yield BODY[0]
+        raise ConnectionError('reset by peer')
+
+    with pytest.raises(ConnectionError):
+        b''.join(archive.tee(None, window, broken_body()))
+    assert os.listdir(os.path.join(str(tmp_path), 'default', '2025-10-01')) == []
+    assert archive.windows(None, datetime(2025, 10, 1), datetime(2025, 10, 2)) == []
+
+
+def test_windows_lists_the_archived_windows_in_a_range(tmp_path):
+    archive = ResponseArchive(str(tmp_path))
+    windows = list(iter_windows(datetime(2025, 10, 1, 22), datetime(2025, 10, 2, 2), timedelta(hours=1)))
+    for window in reversed(windows):
+        archive_window(archive, 'shop', window)
+    archive_window(archive, 'other', windows[0])
+    # stray files are skipped
+    open(os.path.join(str(tmp_path), 'shop', '2025-10-01', 'notes.json.gz'), 'w').close()
+    open(os.path.join(str(tmp_path), 'shop', '2025-10-01', 'README'), 'w').close()
+
+    found = archive.windows('shop', datetime(2025, 10, 1, 23), datetime(2025, 10, 2, 2))
+    assert [window for window, _ in found] == windows[1:]
+    assert [path for _, path in found] == [archive.path('shop', window) for window in windows[1:]]
+    # a window crossing the end of the range is left out
+    assert [window for window, _ in archive.windows('shop', datetime(2025, 10, 1), datetime(2025, 10, 1, 23, 30))] \
+        == windows[:1]
+    assert archive.windows('missing', datetime(2025, 10, 1), datetime(2025, 10, 3)) == []
+
+
+def test_discard(tmp_path):
+    archive = ResponseArchive(str(tmp_path))
+    window = Window(datetime(2025, 10, 1), datetime(2025, 10, 1, 1))
+    archive_window(archive, 'shop', window)
+    archive.discard('shop', window)
+    archive.discard('shop', window)
+    assert not os.path.exists(archive.path('shop', window))
@@ -0,0 +1,106 @@
+# -*- coding: utf-8 -*-
+import json
+
+import pytest
+
+from library.bulkindexer import BulkIndexer, IndexingUnavailable, utf8_length
+
+
+# a stand-in for the OpenSearch client answering every `_bulk` request with the next of `responses`:
+# a list of item statuses, or an exception to raise
+class StubClient:
+    def __init__(self, *responses):
+        self.responses = list(responses)
+        self.bodies = []
+
+    def bulk(self, body: str) -> dict:
+        self.bodies.append(body)
+        response = self.responses.pop(0) if self.responses else None
+        if isinstance(response, Exception):
+            raise response
+        documents = len(body.splitlines()) // 2
+        statuses = [201] * documents if response is None else response
+        return {'errors': any(status >= 300 for status in statuses),
+                'items': [{'index': {'_index': 'i', '_id': str(n), 'status': status,
+                                     'error': None if status < 300 else {'type': 'mapper_parsing_exception'}}}
+                          for n, status in enumerate(statuses)]}
+
+
+def actions(count: int, text: str = 'x') -> list:
+    return [BulkIndexer.action('cloudflare-2025.10.01', {'n': n, 'path': text}, str(n)) for n in range(count)]
+
+
+def new_indexer(client, **kwargs) -> BulkIndexer:
+    return BulkIndexer(client, initial_backoff=0, **kwargs)
+
+
+def test_utf8_length_counts_bytes():
+    assert utf8_length('abc') == 3
+    assert utf8_length('é€') == 5
+
+
+def test_chunks_are_bounded_by_documents():
+    chunks = list(new_indexer(StubClient(), chunk_size=2).chunks(actions(5)))
+    assert [len(chunk) for chunk in chunks] == [2, 2, 1]
+
+
+def test_chunks_are_bounded_by_utf8_bytes():
+    lines = actions(4, 'é' * 100)
+    pair_bytes = sum(len(line.encode('utf-8')) for line in lines[0]) + 2
+    # two documents fit in characters, but not in bytes
+    indexer = new_indexer(StubClient(), max_chunk_bytes=2 * pair_bytes - 1)
+    assert [len(chunk) for chunk in indexer.chunks(lines)] == [1, 1, 1, 1]
+    indexer = new_indexer(StubClient(), max_chunk_bytes=2 * pair_bytes)
+    assert [len(chunk) for chunk in indexer.chunks(lines)] == [2, 2]
+
+
+def test_a_document_larger_than_the_limit_goes_alone():
+    assert [len(chunk) for chunk in new_indexer(StubClient(), max_chunk_bytes=1).chunks(actions(2))] == [1, 1]
+
+
+def test_summary_counts_documents_requests_and_bytes():
+    client = StubClient([201, 400, 201])
+    summary = new_indexer(client).index(actions(3))
+    assert (summary['indexed'], summary['failed'], summary['retried'], summary['requests']) == (2, 1, 0, 1)
+    assert summary['bytes'] == len(client.bodies[0].encode('utf-8'))
+    assert summary['errors'][0]['status'] == 400
+
+
+def test_throttled_documents_are_sent_again():
+    client = StubClient([201, 429, 429], [201, 201])
+    summary = new_indexer(client).index(actions(3))
+    assert (summary['indexed'], summary['failed'], summary['retried'], summary['requests']) == (3, 0, 2, 2)
+    assert [json.loads(line)['n'] for line in client.bodies[1].splitlines()[1::2]] == [1, 2]
+
+
+def test_throttled_documents_fail_after_the_retries():
+    summary = new_indexer(StubClient([429], [429]), max_retries=1).index(actions(1))
+    assert (summary['indexed'], summary['failed'], summary['retried']) == (0, 1, 1)
+
+
+def test_documents_missing_from_the_response_are_sent_again():
+    client = StubClient([201])
+    summary = new_indexer(client).index(actions(3))
+    assert (summary['indexed'], summary['failed'], summary['retried']) == (3, 0, 2)
+
+
+def test_documents_missing_from_the_response_are_rejected_after_the_retries():
+    rejected = []
+    indexer = new_indexer(StubClient([201], [], []), max_retries=1,
+                          on_rejected=lambda meta, source, error: rejected.append(json.loads(source)['n']))
+    summary = indexer.index(actions(2))
+    assert (summary['indexed'], summary['failed']) == (1, 1)
+    assert rejected == [1]
+
+
+def test_documents_missing_from_the_response_are_kept_for_later():
+    with pytest.raises(IndexingUnavailable):
+        new_indexer(StubClient([201], []), max_retries=1, raise_unavailable=True).index(actions(2))
+
+
+def test_failed_requests_are_retried_then_dropped():
+    from opensearchpy.exceptions import ConnectionError as OpenSearchConnectionError
+
+    error = OpenSearchConnectionError('N/A', 'refused', None)
+    summary = new_indexer(StubClient(error, error), max_retries=1).index(actions(2))
+    assert (summary['indexed'], summary['failed'], summary['retried'], summary['requests']) == (0, 2, 2, 2)
@@ -0,0 +1,67 @@
+# -*- coding: utf-8 -*-
+from datetime import datetime, timedelta
+
+from library import checkpoint
+from library.checkpoint import CheckpointStore
+from library.windows import AdaptiveWindowPlanner, Window
+
+START = datetime(2025, 10, 1)
+
+
+def hours(start: int, end: int) -> Window:
+    return Window(START + timedelta(hours=start), START + timedelta(hours=end))
+
+
+def test_completed_windows_are_merged_into_ranges(tmp_path):
+    store = CheckpointStore(str(tmp_path))
+    store.mark('z', hours(0, 1), checkpoint.INDEXED)
+    store.mark('z', hours(1, 2), checkpoint.SPOOLED)
+    store.mark('z', hours(2, 3), checkpoint.FAILED)
+    store.mark('z', hours(3, 4), checkpoint.WRITTEN)
+    store.mark('z', hours(4, 5), checkpoint.FETCHED)
+    store.mark('other', hours(5, 6), checkpoint.INDEXED)
+    assert store.completed('z', START, START + timedelta(days=1)) == [hours(0, 2), hours(3, 4)]
+
+
+def test_status_and_counts_survive_a_restart(tmp_path):
+    store = CheckpointStore(str(tmp_path))
+    store.mark('z', hours(0, 1), checkpoint.FETCHED, rows=10)
+    store.mark('z', hours(0, 1), checkpoint.INDEXED, indexed=10, failed=0)
+    store.set_watermark('z', START + timedelta(hours=1))
+    store.close()
+
+    store = CheckpointStore(str(tmp_path))
+    assert store.counts('z') == {checkpoint.INDEXED: 1}
+    assert store.get_watermark('z') == START + timedelta(hours=1)
+    assert store.get_watermark('unknown') is None
+    row = store.connection.execute('SELECT rows, indexed FROM windows').fetchone()
+    assert row == (10, 10)
+
+
+def test_planner_resumes_around_completed_ranges(tmp_path):
+    store = CheckpointStore(str(tmp_path))
+    store.mark('z', hours(0, 2), checkpoint.INDEXED)
+    store.mark('z', hours(3, 4), checkpoint.INDEXED)
+    planner = AdaptiveWindowPlanner(START, START + timedelta(hours=6), span=timedelta(hours=2), row_limit=100,
+                                    completed=store.completed('z', START, START + timedelta(hours=6)))
+    windows = []
+    while True:
+        window = planner.next_window()
+        if window is None:
+            break
+        windows.append(window)
+    assert windows == [hours(2, 3), hours(4, 6)]
+
+
+def test_the_last_failed_window_at_a_start_is_found_with_its_error(tmp_path):
+    store = CheckpointStore(str(tmp_path))
+    store.mark('z', hours(1, 3), checkpoint.FAILED, error='first')
+    store.mark('z', hours(1, 2), checkpoint.FAILED, error='bulk rejected')
+    store.mark('z', hours(2, 3), checkpoint.FAILED, error='other')
+    assert store.failed_at('z', START + timedelta(hours=1)) == (hours(1, 2), 'bulk rejected')
+    assert store.failed_at('z', START) is None
+
+    # a skipped window is neither failed nor completed
+    store.mark('z', hours(1, 2), checkpoint.SKIPPED, error='bulk rejected')
+    assert store.failed_at('z', START + timedelta(hours=1)) == (hours(1, 3), 'first')
+    assert store.completed('z', START, START + timedelta(days=1)) == []
@@ -0,0 +1,94 @@
+# -*- coding: utf-8 -*-
+import copy
+import json
+
+import pytest
+import synthetic
+
+from library import enrichment
+from library.bulkindexer import BulkIndexer
+from library.iohelper import merge_two_dicts, normalize_country, parse_browser_agent, \
+    parse_client_referer_url_string, parse_client_request_query_string
+
+
+@pytest.fixture
+def context(geo_db_dir):
+    enrichment.init_worker(geo_db_dir)
+    yield enrichment.new_context('zone1', 'account1', 'cloudflare-', 'batch1')
+    enrichment.init_worker()
+
+
+def legacy_document(item: dict, context: dict) -> dict:
+    """ The document as the former merge_two_dicts chain of sent_to_es built it """
+    item_data = item['dimensions']
+    for field in enrichment.REQUIRED_FIELDS:
+        if item_data.get(field) is None:
+            item_data[field] = ''
+    item_data = merge_two_dicts(item_data, parse_client_request_query_string(item_data.get('clientRequestQuery', '')))
+    item_data = merge_two_dicts(item_data, parse_browser_agent(item_data['userAgent']))
+    item_data = merge_two_dicts(item_data, parse_client_referer_url_string(item_data.get('clientRequestReferer', '')))
+    item_data['clientRequest_CountryCode'] = item_data['clientCountryName']
+    item_data['clientRequest_CountryName'] = normalize_country(item_data['clientCountryName'])
+    geo_result = enrichment.geoinfo().get_ip_info(item_data['clientIP'])
+    item_data = merge_two_dicts(item_data, {'clientRequest_geoip_' + key: value for key, value in geo_result.items()})
+    return merge_two_dicts(item_data, {
+        'log_pull_batch_name': context['batch_name'],
+        'log_pull_batch_datetime': context['batch_datetime'],
+        'count': item['count'],
+        'avg_typename': item['avg']['__typename'],
+        'avg_sampleInterval': item['avg']['sampleInterval'],
+        'sum_edgeResponseBytes': item['sum']['edgeResponseBytes'],
+        'sum_visits': item['sum']['visits'],
+        'sum_typename': item['sum']['__typename'],
+        'accountTag': context['account'],
+        'zoneTag': context['zone'],
+    })
+
+
+def sample_rows() -> list:
+    rows = synthetic.make_rows(200, seed=3)
+    rows[1]['dimensions'].pop('userAgent')
+    rows[2]['dimensions']['clientIP'] = None
+    rows[3]['dimensions']['clientRequestQuery'] = ''
+    return rows
+
+
+def test_documents_match_the_former_merge_chain(context):
+    builder = enrichment.DocumentBuilder(context)
+    for item in sample_rows():
+        index_name, _, document = builder.build(copy.deepcopy(item))
+        expected = legacy_document(copy.deepcopy(item), context)
+        assert list(document.items()) == list(expected.items())
+        assert index_name == 'cloudflare-2025.10.01'
+
+
+def test_actions_are_the_bulk_lines_of_the_document(context):
+    builder = enrichment.DocumentBuilder(context)
+    for item in sample_rows()[:20]:
+        index_name, doc_id, document = builder.build(copy.deepcopy(item))
+        assert builder.action(copy.deepcopy(item)) == BulkIndexer.action(index_name, document, doc_id)
+
+
+def test_every_day_has_its_own_index(context):
+    builder = enrichment.DocumentBuilder(context)
+    item = synthetic.make_rows(1)[0]
+    item['dimensions']['datetime'] = '2025-10-02T23:59:00Z'
+    meta, _ = builder.action(item)
+    assert json.loads(meta)['index']['_index'] == 'cloudflare-2025.10.02'
+    assert set(builder.indices) == {'2025-10-02'}
+
+
+def test_steps_are_timed(context):
+    timings = enrichment.new_timings()
+    enrichment.DocumentBuilder(context).action(synthetic.make_rows(1)[0], timings)
+    assert set(timings) == set(enrichment.ENRICH_STEPS)
+    assert timings['user_agent'] > 0
+
+
+def test_enrich_rows_returns_the_actions_in_order(context):
+    rows = sample_rows()[:10]
+    result = enrichment.enrich_rows(copy.deepcopy(rows), context)
+    builder = enrichment.DocumentBuilder(context)
+    assert result['actions'] == [builder.action(item) for item in copy.deepcopy(rows)]
+    assert result['rollups'] is None
+    assert 'geoip_city' in result['caches']
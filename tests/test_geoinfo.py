@@ -0,0 +1,43 @@
+# -*- coding: utf-8 -*-
+import ipaddress
+
+from library.geoinfo import EMPTY_IP_INFO_VALUES, GeoInfo, NetworkCache
+
+
+def test_network_cache_answers_every_address_of_a_network():
+    cache = NetworkCache()
+    cache.put(ipaddress.ip_network('8.8.0.0/16'), 'google')
+    assert cache.get(ipaddress.ip_address('8.8.4.4')) == (True, 'google')
+    assert cache.get(ipaddress.ip_address('8.9.0.1')) == (False, None)
+    assert cache.get(ipaddress.ip_address('2001:db8::1')) == (False, None)
+    assert cache.stats() == {'size': 1, 'hits': 1, 'misses': 2, 'evictions': 0}
+
+
+def test_network_cache_evicts_the_least_recently_used():
+    cache = NetworkCache(max_size=2)
+    cache.put(ipaddress.ip_network('1.0.0.0/24'), 1)
+    cache.put(ipaddress.ip_network('2.0.0.0/16'), 2)
+    cache.get(ipaddress.ip_address('1.0.0.1'))
+    cache.put(ipaddress.ip_network('3.0.0.0/8'), 3)
+    assert cache.get(ipaddress.ip_address('2.0.0.1')) == (False, None)
+    assert cache.get(ipaddress.ip_address('1.0.0.1')) == (True, 1)
+    assert cache.stats()['evictions'] == 1
+    # the prefix lengths of evicted networks are no longer probed
+    assert 16 not in cache.prefix_lengths[4]
+
+
+def test_lookups_are_cached_per_network(geo_db_dir):
+    geo = GeoInfo(geo_db_dir)
+    info = geo.get_ip_info('8.8.8.8')
+    assert (info['city'], info['country_iso_code'], info['asn']) == ('Mountain View', 'US', 15169)
+    assert geo.get_ip_info('8.8.8.9') == info
+    assert geo.cache_stats()['city']['hits'] == 1
+    assert geo.cache_stats()['asn']['hits'] == 1
+
+
+def test_unknown_and_invalid_addresses_are_empty(geo_db_dir):
+    geo = GeoInfo(geo_db_dir)
+    assert geo.get_ip_values('10.0.0.1') == EMPTY_IP_INFO_VALUES
+    assert geo.get_ip_values('10.0.0.2') == EMPTY_IP_INFO_VALUES
+    assert geo.get_ip_values('not an address') == EMPTY_IP_INFO_VALUES
+    assert geo.get_asn_info('2a02:1000::1') == {'asn': 3320, 'asn_org': 'Deutsche Telekom AG'}
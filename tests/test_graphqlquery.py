@@ -0,0 +1,83 @@
+# -*- coding: utf-8 -*-
+import json
+
+import pytest
+
+from library.graphqlquery import BASE_DIMENSIONS, DEFAULT_FILTERS, PREMIUM_DIMENSIONS, GraphQLQuery, load_filters, \
+    parse_dimensions
+from library.zones import ZoneConfig
+
+ZONE = ZoneConfig('zone1', account='account1')
+PREMIUM_ZONE = ZoneConfig('zone2', account='account1', include_premium_fields=True)
+
+
+def dimensions_of(query: str) -> list:
+    return query.split('dimensions { ')[1].split(' }')[0].split()
+
+
+def test_payload_is_json_with_a_half_open_time_range():
+    payload = json.loads(GraphQLQuery().payload(ZONE, 5000, '2025-10-01T00:00:00Z', '2025-10-01T01:00:00Z'))
+    assert payload['variables']['accountTag'] == 'account1'
+    assert payload['variables']['zoneTag'] == 'zone1'
+    # the time range comes first, then the noise filters
+    assert payload['variables']['filter'] == {'AND': [
+        {'datetime_geq': '2025-10-01T00:00:00Z', 'datetime_lt': '2025-10-01T01:00:00Z'}, *DEFAULT_FILTERS]}
+    assert 'httpRequestsAdaptiveGroups(limit: 5000, filter: $filter)' in payload['query']
+
+
+def test_payload_escapes_the_filter_values():
+    filters = [{'clientRequestPath_notlike': '%"quoted"\\%'}]
+    payload = json.loads(GraphQLQuery(filters).payload(ZONE, 10, '2025-10-01T00:00:00Z', '2025-10-01T00:00:00Z'))
+    assert payload['variables']['filter']['AND'][1:] == filters
+
+
+def test_a_start_after_the_end_is_refused():
+    with pytest.raises(ValueError):
+        GraphQLQuery().payload(ZONE, 10, '2025-10-02T00:00:00Z', '2025-10-01T00:00:00Z')
+
+
+def test_query_text_is_built_once_per_plan_and_limit():
+    builder = GraphQLQuery()
+    query = builder.query(False, 100)
+    assert builder.query(False, 100) is query
+    assert builder.query(True, 100) is not query
+    assert set(builder.queries) == {(False, 100), (True, 100)}
+
+
+def test_every_dimension_of_the_plan_by_default():
+    builder = GraphQLQuery()
+    assert dimensions_of(builder.query(False, 100)) == list(BASE_DIMENSIONS)
+    assert dimensions_of(builder.query(True, 100)) == list(BASE_DIMENSIONS + PREMIUM_DIMENSIONS)
+
+
+def test_projected_dimensions_always_include_datetime():
+    builder = GraphQLQuery(dimensions=('clientIP', 'clientRequestQuery'))
+    assert dimensions_of(builder.query(True, 100)) == ['datetime', 'clientIP', 'clientRequestQuery']
+    # premium dimensions are left out for the zones of other plans
+    assert dimensions_of(builder.query(False, 100)) == ['datetime', 'clientIP']
+
+
+def test_invalid_dimension_names_are_refused():
+    with pytest.raises(ValueError, match='clientIP }'):
+        GraphQLQuery(dimensions=('clientIP }',))
+
+
+def test_parse_dimensions():
+    assert parse_dimensions(' clientIP, userAgent,,clientIP ') == ('clientIP', 'userAgent')
+    assert parse_dimensions('') is None
+    assert parse_dimensions(None) is None
+
+
+def test_load_filters(tmp_path):
+    assert load_filters(None) == list(DEFAULT_FILTERS)
+    assert load_filters('  ') == list(DEFAULT_FILTERS)
+    assert load_filters('[{"clientRequestPath_notlike": "%.ico%"}]') == [{'clientRequestPath_notlike': '%.ico%'}]
+    path = tmp_path / 'filters.json'
+    path.write_text('[{"edgeResponseStatus_neq": 404}]')
+    assert load_filters(str(path)) == [{'edgeResponseStatus_neq': 404}]
+
+
+@pytest.mark.parametrize('value', ['[]x', '[{}]', '["clientIP"]'])
+def test_invalid_filters_are_refused(value):
+    with pytest.raises(ValueError):
+        load_filters(value)
@@ -0,0 +1,45 @@
+# -*- coding: utf-8 -*-
+from datetime import datetime, timedelta, timezone
+from email.utils import format_datetime
+
+import pytest
+
+from library import httpclient
+
+
+class Response:
+    def __init__(self, retry_after: str | None = None):
+        self.headers = {} if retry_after is None else {'Retry-After': retry_after}
+
+
+def test_retry_after_in_seconds():
+    assert httpclient.retry_after(Response('30')) == 30.0
+    assert httpclient.retry_after(Response(' 7 ')) == 7.0
+
+
+def test_retry_after_as_an_http_date():
+    retry_at = datetime.now(timezone.utc) + timedelta(seconds=60)
+    assert 55 <= httpclient.retry_after(Response(format_datetime(retry_at, usegmt=True))) <= 60
+    # a date already past means right away
+    assert httpclient.retry_after(Response('Wed, 21 Oct 2015 07:28:00 GMT')) == 0.0
+
+
+@pytest.mark.parametrize('value', [None, '', 'soon', '-5'])
+def test_missing_or_unreadable_retry_after(value):
+    assert httpclient.retry_after(Response(value)) is None
+
+
+def test_backoff_doubles_with_jitter_up_to_the_maximum():
+    for attempt, delay in enumerate((5, 10, 20, 40)):
+        for _ in range(20):
+            assert delay / 2 <= httpclient.backoff(attempt, 5, 120) <= delay
+    for _ in range(20):
+        assert 60 <= httpclient.backoff(10, 5, 120) <= 120
+
+
+def test_session_keeps_one_connection_per_window():
+    session = httpclient.new_session(pool_size=6, headers={'User-Agent': 'cf2os'})
+    adapter = session.get_adapter('https://api.cloudflare.com/client/v4/graphql')
+    assert adapter._pool_maxsize == 6
+    assert session.headers['Accept-Encoding'] == 'gzip, deflate'
+    assert session.headers['User-Agent'] == 'cf2os'
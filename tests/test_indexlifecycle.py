@@ -0,0 +1,131 @@
+# -*- coding: utf-8 -*-
+import pytest
+from opensearchpy.exceptions import RequestError
+
+from library.indexlifecycle import IndexLifecycle, mappings
+
+
+# a stand-in for `client.indices` recording every call, `existing` indices exist up front and
+# `create_error` is raised by create()
+class StubIndices:
+    def __init__(self, existing=(), create_error: Exception | None = None, settings_error: Exception | None = None):
+        self.existing = set(existing)
+        self.create_error = create_error
+        self.settings_error = settings_error
+        self.calls = []
+
+    def put_index_template(self, name: str, body: dict):
+        self.calls.append(('put_index_template', name))
+
+    def exists(self, index: str) -> bool:
+        return index in self.existing
+
+    def create(self, index: str):
+        self.calls.append(('create', index))
+        if self.create_error is not None:
+            raise self.create_error
+        self.existing.add(index)
+
+    def put_settings(self, index: str, body: dict):
+        if self.settings_error is not None:
+            raise self.settings_error
+        settings = body['index']
+        self.calls.append(('put_settings', index, settings['refresh_interval'], settings['number_of_replicas']))
+
+    def forcemerge(self, index: str, max_num_segments: int, request_timeout: float):
+        self.calls.append(('forcemerge', index, max_num_segments))
+
+
+class StubClient:
+    def __init__(self, indices: StubIndices):
+        self.indices = indices
+
+
+def new_lifecycle(indices: StubIndices, **kwargs) -> IndexLifecycle:
+    return IndexLifecycle(StubClient(indices), 'cf2os', ['shop-', 'cloudflare-requests-', 'shop-'], **kwargs)
+
+
+def test_template_covers_every_prefix_with_the_mappings():
+    template = new_lifecycle(StubIndices(), shards=2, replicas=0, refresh_interval='30s').template()
+    assert template['index_patterns'] == ['cloudflare-requests-*', 'shop-*']
+    assert template['template']['settings']['index'] == {
+        'number_of_shards': 2, 'number_of_replicas': 0, 'refresh_interval': '30s'}
+    assert template['template']['mappings'] == mappings()
+
+
+def test_mappings_type_the_enriched_fields():
+    properties = mappings()['properties']
+    assert properties['clientIP']['type'] == 'ip'
+    assert properties['datetime']['type'] == 'date'
+    assert properties['sum_edgeResponseBytes']['type'] == 'long'
+    assert properties['clientRequest_geoip_geocoding']['type'] == 'geo_point'
+    assert properties['clientRequest_geoip_is_tor_exit_node']['type'] == 'boolean'
+    assert properties['userAgent'] == {'type': 'keyword', 'ignore_above': 8191}
+    assert properties['clientReferer_utm_source'] == {'type': 'keyword', 'ignore_above': 1024}
+    # an empty string stands for unknown: it must not reject the document
+    assert all(mapping.get('ignore_malformed') for mapping in properties.values()
+               if mapping['type'] in ('ip', 'date', 'short', 'long', 'float', 'geo_point'))
+
+
+def test_install_template():
+    indices = StubIndices()
+    new_lifecycle(indices).install_template()
+    assert indices.calls == [('put_index_template', 'cf2os')]
+
+
+def test_prepare_does_nothing_without_bulk_settings():
+    indices = StubIndices()
+    lifecycle = new_lifecycle(indices)
+    lifecycle.prepare('shop-2025.10.01')
+    lifecycle.finish('shop-2025.10.01')
+    assert indices.calls == []
+
+
+def test_prepare_creates_the_index_once_with_ingest_settings():
+    indices = StubIndices()
+    lifecycle = new_lifecycle(indices, bulk_settings=True)
+    lifecycle.prepare('shop-2025.10.01')
+    lifecycle.prepare('shop-2025.10.01')
+    assert indices.calls == [('create', 'shop-2025.10.01'), ('put_settings', 'shop-2025.10.01', '-1', 0)]
+    assert lifecycle.prepared == {'shop-2025.10.01'}
+
+
+def test_prepare_an_existing_index():
+    indices = StubIndices(existing=['shop-2025.10.01'])
+    new_lifecycle(indices, bulk_settings=True).prepare('shop-2025.10.01')
+    assert indices.calls == [('put_settings', 'shop-2025.10.01', '-1', 0)]
+
+
+def test_prepare_an_index_created_meanwhile():
+    indices = StubIndices(create_error=RequestError(400, 'resource_already_exists_exception', {}))
+    lifecycle = new_lifecycle(indices, bulk_settings=True)
+    lifecycle.prepare('shop-2025.10.01')
+    assert lifecycle.prepared == {'shop-2025.10.01'}
+
+
+def test_a_failed_prepare_is_tried_again():
+    indices = StubIndices(create_error=RequestError(400, 'invalid_index_name_exception', {}))
+    lifecycle = new_lifecycle(indices, bulk_settings=True)
+    with pytest.raises(RequestError):
+        lifecycle.prepare('shop-2025.10.01')
+    assert lifecycle.prepared == set()
+
+
+def test_finish_restores_the_settings_and_merges():
+    indices = StubIndices()
+    lifecycle = new_lifecycle(indices, bulk_settings=True, replicas=2, refresh_interval='5s', force_merge_segments=1)
+    lifecycle.prepare('shop-2025.10.01')
+    lifecycle.finish('shop-2025.10.01')
+    lifecycle.finish('shop-2025.10.01')
+    assert indices.calls[2:] == [('put_settings', 'shop-2025.10.01', '5s', 2), ('forcemerge', 'shop-2025.10.01', 1)]
+    assert lifecycle.prepared == set()
+
+
+def test_finish_all_keeps_going_after_a_failure():
+    indices = StubIndices()
+    lifecycle = new_lifecycle(indices, bulk_settings=True)
+    lifecycle.prepare('shop-2025.10.01')
+    lifecycle.prepare('shop-2025.10.02')
+    indices.settings_error = RuntimeError('cluster unreachable')
+    lifecycle.finish_all()
+    assert lifecycle.prepared == set()
@@ -0,0 +1,109 @@
+# -*- coding: utf-8 -*-
+import pytest
+
+from library import iohelper
+from library.iohelper import REFERER_FIELDS, REQUEST_QUERY_FIELDS, URL_FIELDS, USER_AGENT_FIELDS, document_id
+from library.parseurl import ParseURL
+
+ROW = {'datetime': '2025-10-01T00:00:00Z', 'clientIP': '8.8.8.8', 'clientRequestPath': '/a', 'edgeResponseStatus': 200}
+
+
+def test_document_id_is_stable_across_runs():
+    # pinned: a change here re-indexes every document under a new id instead of overwriting it
+    assert document_id('zone1', ROW) == '9b9488d1a60073f51f9b1f6cd8c3c5fe'
+    assert document_id(None, {'datetime': '2025-10-01T00:00:00Z'}) == '8e9020b02b871083392982ffadfaf08c'
+
+
+def test_document_id_ignores_the_order_of_the_dimensions():
+    assert document_id('zone1', dict(reversed(list(ROW.items())))) == document_id('zone1', ROW)
+
+
+def test_document_id_depends_on_the_zone_and_every_dimension():
+    ids = {document_id('zone1', ROW), document_id('zone2', ROW), document_id(None, ROW),
+           document_id('zone1', {**ROW, 'edgeResponseStatus': 404}),
+           document_id('zone1', {**ROW, 'datetime': '2025-10-01T00:01:00Z'}),
+           document_id('zone1', {**ROW, 'clientCountryName': ''})}
+    assert len(ids) == 6
+
+
+USER_AGENTS = [
+    'Mozilla/5.0 (iPhone; CPU iPhone OS 17_2_1 like Mac OS X) AppleWebKit/605.1.15 (KHTML, like Gecko) '
+    'Version/17.2 Mobile/15E148 Safari/604.1',
+    'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36',
+    'Mozilla/5.0 (Linux; Android 14; SM-S918B) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.6099.144 '
+    'Mobile Safari/537.36',
+    'Mozilla/5.0 (compatible; Googlebot/2.1; +http://www.google.com/bot.html)',
+    'curl/8.4.0',
+    'not a browser',
+    '',
+]
+
+
+@pytest.fixture
+def user_agent_cache():
+    iohelper.set_user_agent_cache_size(2)
+    yield
+    iohelper.set_user_agent_cache_size(4096)
+
+
+@pytest.mark.parametrize('agent_string', USER_AGENTS)
+def test_user_agents_parse_like_the_legacy_parser(agent_string):
+    from ua_parser import user_agent_parser
+
+    parsed = user_agent_parser.Parse(agent_string)
+    legacy = tuple(parsed[part][key] for part, keys in (('device', ('family', 'brand', 'model')),
+                                                       ('os', ('family', 'major', 'minor', 'patch')),
+                                                       ('user_agent', ('family', 'major', 'minor', 'patch')))
+                   for key in keys)
+    assert iohelper.parse_browser_agent_values(agent_string) == legacy
+    assert iohelper.parse_browser_agent(agent_string) == dict(zip(USER_AGENT_FIELDS, legacy))
+
+
+def test_user_agent_cache_is_bounded_and_counts_hits(user_agent_cache):
+    for agent_string in USER_AGENTS[:3] + USER_AGENTS[2:3]:
+        iohelper.parse_browser_agent_values(agent_string)
+    stats = iohelper.user_agent_cache_stats()
+    assert (stats['size'], stats['max_size'], stats['hits'], stats['misses']) == (2, 2, 1, 3)
+    assert stats['hit_rate'] == 0.25
+
+
+# expected fields as the former if-chain parse_url returned them, every other field is ''
+@pytest.mark.parametrize('url, expected', [
+    ('https://www.google.com/search?q=red+shoes&utm_source=google&utm_medium=cpc',
+     {'scheme': 'https', 'hostname': 'www.google.com', 'path': '/search',
+      'query': 'q=red+shoes&utm_source=google&utm_medium=cpc',
+      'utm_source': 'google', 'utm_medium': 'cpc', 'search_keyword': 'red shoes'}),
+    ('https://shop.example.com/p/1?utm_source=fb&utm_campaign=spring&fbclid=abc&utm_term=a,b&gclid=g1'
+     '&gad_source=1&hsa_kw=kw1&hsa_acc=42',
+     {'scheme': 'https', 'hostname': 'shop.example.com', 'path': '/p/1',
+      'query': 'utm_source=fb&utm_campaign=spring&fbclid=abc&utm_term=a,b&gclid=g1&gad_source=1&hsa_kw=kw1&hsa_acc=42',
+      'utm_source': 'fb', 'utm_campaign': 'spring', 'utm_term': 'a:b', 'fbclid': 'abc', 'gclid': 'g1',
+      'hsa_acc': '42', 'hsa_kw': 'kw1', 'gad_source': '1'}),
+    # q wins over every other search parameter, then query, Q, kw, wd, searchfor and ask
+    ('?query=first&q=second&kw=third', {'query': 'query=first&q=second&kw=third', 'search_keyword': 'second'}),
+    ('?kw=one&ask=two', {'query': 'kw=one&ask=two', 'search_keyword': 'one'}),
+    # the first value of a repeated parameter is kept
+    ('?utm_source=a&utm_source=b', {'query': 'utm_source=a&utm_source=b', 'utm_source': 'a'}),
+    ('https://x.com/?q=' + 'a' * 300,
+     {'scheme': 'https', 'hostname': 'x.com', 'path': '/', 'query': 'q=' + 'a' * 300,
+      'search_keyword': 'a' * 250 + '...'}),
+    ('https://example.com/path', {'scheme': 'https', 'hostname': 'example.com', 'path': '/path'}),
+    ('http://[bad', {}),
+    ('', {}),
+    (None, {}),
+])
+def test_urls_parse_like_the_former_parser(url, expected):
+    assert iohelper.parse_url(url) == {field: expected.get(field, '') for field in URL_FIELDS}
+    if url is not None:
+        parsed = iohelper.parse_url(url)
+        assert iohelper.parse_client_referer_url_string(url) == dict(zip(REFERER_FIELDS, parsed.values()))
+        assert iohelper.parse_client_request_query_string(url) == {
+            'clientRequest_' + field: parsed[field] for field in URL_FIELDS[len(iohelper.URL_PARTS):]}
+        assert tuple(iohelper.parse_client_request_query_string(url)) == REQUEST_QUERY_FIELDS
+
+
+def test_url_hashes_are_only_computed_on_request():
+    parsed = ParseURL().parse_url('https://example.com/a')
+    assert (parsed['host_hash'], parsed['path_hash'], parsed['port']) == ('', '', 443)
+    parsed = ParseURL().parse_url('https://example.com/a', hashes=True)
+    assert len(parsed['host_hash']) == len(parsed['path_hash']) == 40
@@ -0,0 +1,67 @@
+# -*- coding: utf-8 -*-
+import urllib.error
+import urllib.request
+
+import pytest
+
+from library.metrics import MetricsRegistry, MetricsServer
+
+
+def test_counters_and_gauges_render_per_label_set():
+    registry = MetricsRegistry()
+    registry.counter('cf2os_windows_total', 'Windows shipped')
+    registry.gauge('cf2os_spool_bytes', 'Bytes waiting in the spool')
+    registry.inc('cf2os_windows_total', zone='shop', outcome='indexed')
+    registry.inc('cf2os_windows_total', 2, outcome='indexed', zone='shop')
+    registry.inc('cf2os_windows_total', zone='shop', outcome='failed')
+    registry.set('cf2os_spool_bytes', 1.5)
+    assert registry.value('cf2os_windows_total', zone='shop', outcome='indexed') == 3
+    assert registry.value('cf2os_windows_total', zone='other', outcome='indexed') == 0
+    assert registry.render() == (
+        '# HELP cf2os_spool_bytes Bytes waiting in the spool\n'
+        '# TYPE cf2os_spool_bytes gauge\n'
+        'cf2os_spool_bytes 1.5\n'
+        '# HELP cf2os_windows_total Windows shipped\n'
+        '# TYPE cf2os_windows_total counter\n'
+        'cf2os_windows_total{outcome="failed",zone="shop"} 1\n'
+        'cf2os_windows_total{outcome="indexed",zone="shop"} 3\n'
+    )
+
+
+def test_histograms_render_cumulative_buckets():
+    registry = MetricsRegistry()
+    registry.histogram('cf2os_fetch_seconds', 'Fetch time', buckets=(1, 0.1))
+    for value in (0.05, 0.1, 0.5, 3):
+        registry.observe('cf2os_fetch_seconds', value, zone='shop')
+    assert registry.value('cf2os_fetch_seconds', zone='shop') == (3.65, 4)
+    assert registry.value('cf2os_fetch_seconds', zone='other') == (0.0, 0)
+    assert registry.render().splitlines()[2:] == [
+        'cf2os_fetch_seconds_bucket{zone="shop",le="0.1"} 2',
+        'cf2os_fetch_seconds_bucket{zone="shop",le="1"} 3',
+        'cf2os_fetch_seconds_bucket{zone="shop",le="+Inf"} 4',
+        'cf2os_fetch_seconds_sum{zone="shop"} 3.65',
+        'cf2os_fetch_seconds_count{zone="shop"} 4',
+    ]
+
+
+def test_label_values_are_escaped():
+    registry = MetricsRegistry()
+    registry.counter('cf2os_errors_total', 'Errors')
+    registry.inc('cf2os_errors_total', error='say "hi"\\\n')
+    assert registry.render().splitlines()[-1] == 'cf2os_errors_total{error="say \\"hi\\"\\\\\\n"} 1'
+
+
+def test_server_serves_the_registry():
+    registry = MetricsRegistry()
+    registry.gauge('cf2os_up', 'Up')
+    registry.set('cf2os_up', 1)
+    server = MetricsServer(registry, 0, '127.0.0.1').start()
+    try:
+        base_url = 'http://127.0.0.1:{}'.format(server.server.server_address[1])
+        with urllib.request.urlopen(base_url + '/metrics') as response:
+            assert response.headers['Content-Type'].startswith('text/plain; version=0.0.4')
+            assert response.read().decode() == registry.render()
+        with pytest.raises(urllib.error.HTTPError):
+            urllib.request.urlopen(base_url + '/other')
+    finally:
+        server.stop()
@@ -0,0 +1,55 @@
+# -*- coding: utf-8 -*-
+import os
+from datetime import datetime, timedelta
+
+import pytest
+
+from library.profiling import CPROFILE, TRACEMALLOC, WindowProfiler
+from library.windows import Window, iter_windows
+
+WINDOWS = list(iter_windows(datetime(2025, 10, 1), datetime(2025, 10, 1, 10), timedelta(hours=1)))
+
+
+def test_nothing_is_selected_by_default(tmp_path):
+    profiler = WindowProfiler(str(tmp_path))
+    assert not any(profiler.selected(window) for window in WINDOWS)
+
+
+def test_every_nth_window_is_selected(tmp_path):
+    profiler = WindowProfiler(str(tmp_path), every=4)
+    assert [profiler.selected(window) for window in WINDOWS] == [False, False, False, True] * 2 + [False, False]
+
+
+def test_windows_containing_a_timestamp_are_selected(tmp_path):
+    # the end of a window belongs to the next one
+    profiler = WindowProfiler(str(tmp_path), timestamps=[datetime(2025, 10, 1, 2, 30), datetime(2025, 10, 1, 5)])
+    assert [index for index, window in enumerate(WINDOWS) if profiler.selected(window)] == [2, 5]
+
+
+def test_unknown_modes_are_refused(tmp_path):
+    with pytest.raises(ValueError, match='perf'):
+        WindowProfiler(str(tmp_path), modes=(CPROFILE, 'perf'))
+
+
+def test_profile_writes_one_report_set_per_window(tmp_path):
+    output_dir = tmp_path / 'profiles'
+    profiler = WindowProfiler(str(output_dir), modes=(CPROFILE, TRACEMALLOC), top=5)
+    window = Window(datetime(2025, 10, 1), datetime(2025, 10, 1, 1))
+    with profiler.profile('shop', window):
+        sorted(str(n) for n in range(10000))
+    assert sorted(os.listdir(output_dir)) == [
+        'shop_20251001T000000Z_20251001T010000Z.allocations.txt',
+        'shop_20251001T000000Z_20251001T010000Z.profile.txt',
+        'shop_20251001T000000Z_20251001T010000Z.pstats',
+    ]
+    assert 'peak traced memory' in (output_dir / 'shop_20251001T000000Z_20251001T010000Z.allocations.txt').read_text()
+
+
+def test_only_one_window_is_profiled_at_a_time(tmp_path):
+    profiler = WindowProfiler(str(tmp_path))
+    with profiler.profile(None, WINDOWS[0]):
+        with profiler.profile(None, WINDOWS[1]):
+            pass
+    # the nested window ran unprofiled
+    assert sorted(os.listdir(tmp_path)) == ['default_20251001T000000Z_20251001T010000Z.profile.txt',
+                                            'default_20251001T000000Z_20251001T010000Z.pstats']
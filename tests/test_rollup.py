@@ -0,0 +1,101 @@
+# -*- coding: utf-8 -*-
+import json
+from datetime import datetime
+
+from library import rollup
+from library.rollup import RollupAggregator
+from library.windows import Window
+
+
+def document(datetime_value: str, host: str = 'www.example.com', status: int = 200, count: int = 1) -> dict:
+    return {'datetime': datetime_value, 'clientRequestHTTPHost': host, 'edgeResponseStatus': status,
+            'count': count, 'sum_visits': 1, 'sum_edgeResponseBytes': 100}
+
+
+def rollup_documents(sums: dict, window: Window) -> dict:
+    """ Document id -> source of the rollups of `window` """
+    lines = rollup.actions(sums, 'cloudflare-rollups-', 'z', 'a', window, 60)
+    return {json.loads(meta_line)['index']['_id']: json.loads(source_line) for meta_line, source_line in lines}
+
+
+def test_parse_dimensions():
+    assert rollup.parse_dimensions('a, b;c;;a,b') == (('a', 'b'), ('c',))
+    assert rollup.parse_dimensions('') == rollup.parse_dimensions(rollup.DEFAULT_DIMENSIONS)
+
+
+def test_buckets_are_aligned_to_midnight():
+    aggregator = RollupAggregator([('clientRequestHTTPHost',)], interval_minutes=15)
+    assert aggregator.bucket('2025-10-01T12:34:56Z') == '2025-10-01T12:30:00Z'
+    assert RollupAggregator([], interval_minutes=5000).bucket('2025-10-01T23:59:00Z') == '2025-10-01T00:00:00Z'
+
+
+def test_measures_are_summed_per_bucket_and_dimension_set():
+    aggregator = RollupAggregator([('clientRequestHTTPHost',), ('edgeResponseStatus', 'missing')])
+    aggregator.add(document('2025-10-01T00:10:00Z', count=2))
+    aggregator.add(document('2025-10-01T00:50:00Z', status=404))
+    aggregator.add(document('2025-10-01T01:00:00Z'))
+    assert aggregator.sums == {
+        (('clientRequestHTTPHost',), '2025-10-01T00:00:00Z', ('www.example.com',)): [3, 2, 200],
+        (('clientRequestHTTPHost',), '2025-10-01T01:00:00Z', ('www.example.com',)): [1, 1, 100],
+        (('edgeResponseStatus', 'missing'), '2025-10-01T00:00:00Z', (200, None)): [2, 1, 100],
+        (('edgeResponseStatus', 'missing'), '2025-10-01T00:00:00Z', (404, None)): [1, 1, 100],
+        (('edgeResponseStatus', 'missing'), '2025-10-01T01:00:00Z', (200, None)): [1, 1, 100],
+    }
+
+
+def test_merge_adds_the_sums_of_another_batch():
+    sums = {('k',): [1, 2, 3]}
+    rollup.merge(sums, {('k',): [1, 1, 1], ('other',): [5, 5, 5]})
+    assert sums == {('k',): [2, 3, 4], ('other',): [5, 5, 5]}
+
+
+def test_rollup_documents():
+    aggregator = RollupAggregator([('clientRequestHTTPHost', 'missing')])
+    aggregator.add(document('2025-10-01T00:10:00Z'))
+    lines = rollup.actions(aggregator.sums, 'cloudflare-rollups-', 'z', 'a',
+                           Window(datetime(2025, 10, 1), datetime(2025, 10, 1, 6)), 60)
+    (meta_line, source_line), = lines
+    assert json.loads(meta_line)['index']['_index'] == 'cloudflare-rollups-2025.10.01'
+    assert json.loads(source_line) == {
+        'datetime': '2025-10-01T00:00:00Z', 'interval_minutes': 60, 'rollup': 'clientRequestHTTPHost,missing',
+        'clientRequestHTTPHost': 'www.example.com', 'missing': '', 'count': 1, 'sum_visits': 1,
+        'sum_edgeResponseBytes': 100, 'accountTag': 'a', 'zoneTag': 'z'}
+
+
+def test_ids_of_whole_buckets_do_not_depend_on_the_window():
+    aggregator = RollupAggregator([('clientRequestHTTPHost',)])
+    for datetime_value in ('2025-10-01T01:10:00Z', '2025-10-01T02:20:00Z'):
+        aggregator.add(document(datetime_value))
+
+    first = rollup_documents(aggregator.sums, Window(datetime(2025, 10, 1), datetime(2025, 10, 1, 6)))
+    again = rollup_documents(aggregator.sums, Window(datetime(2025, 10, 1, 1), datetime(2025, 10, 1, 3)))
+    assert first.keys() == again.keys()
+
+
+def window_sums(window: Window, *datetime_values: str) -> dict:
+    aggregator = RollupAggregator([('clientRequestHTTPHost',)], window=window)
+    for datetime_value in datetime_values:
+        aggregator.add(document(datetime_value))
+    return aggregator.sums
+
+
+def test_a_bucket_cut_by_the_window_gets_a_document_per_minute():
+    earlier, later = Window(datetime(2025, 10, 1), datetime(2025, 10, 1, 1, 30)), \
+        Window(datetime(2025, 10, 1, 1, 30), datetime(2025, 10, 1, 3))
+    first = rollup_documents(window_sums(earlier, '2025-10-01T00:10:00Z', '2025-10-01T01:10:00Z',
+                                         '2025-10-01T01:10:30Z'), earlier)
+    second = rollup_documents(window_sums(later, '2025-10-01T01:40:00Z', '2025-10-01T02:20:00Z'), later)
+    assert sorted((source['datetime'], source['count']) for source in first.values()) == [
+        ('2025-10-01T00:00:00Z', 1), ('2025-10-01T01:00:00Z', 2)]
+    assert sorted((source['datetime'], source['count']) for source in second.values()) == [
+        ('2025-10-01T01:00:00Z', 1), ('2025-10-01T02:00:00Z', 1)]
+    assert first.keys().isdisjoint(second.keys())
+
+
+def test_parts_do_not_depend_on_the_window_boundaries():
+    # a failed window planned again with other boundaries overwrites the parts it wrote
+    window, replanned = Window(datetime(2025, 10, 1, 1), datetime(2025, 10, 1, 1, 30)), \
+        Window(datetime(2025, 10, 1, 1), datetime(2025, 10, 1, 1, 20))
+    rows = ('2025-10-01T01:05:00Z', '2025-10-01T01:15:00Z')
+    assert rollup_documents(window_sums(replanned, *rows), replanned).keys() == \
+        rollup_documents(window_sums(window, *rows), window).keys()
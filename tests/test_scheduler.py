@@ -0,0 +1,78 @@
+# -*- coding: utf-8 -*-
+import asyncio
+import threading
+
+from library.pipeline import AsyncWindowPipeline
+from library.ratelimit import TokenBucket
+from library.scheduler import SPLIT, WindowScheduler
+
+
+def test_every_window_is_processed_and_counted():
+    windows = iter(range(10))
+    processed = []
+    lock = threading.Lock()
+
+    def process(window):
+        with lock:
+            processed.append(window)
+        if window == 3:
+            raise RuntimeError('boom')
+        if window == 5:
+            return SPLIT
+        return {'window': window}
+
+    report = WindowScheduler(concurrency=3).run(lambda: next(windows, None), process)
+    assert sorted(processed) == list(range(10))
+    assert (report['completed'], report['failed'], report['split']) == (8, 1, 1)
+    assert report['windows_per_minute'] > 0
+
+
+def test_windows_queued_while_running_are_picked_up():
+    # like the planner re-queueing the halves of a split window
+    queue = [1]
+
+    def next_window():
+        return queue.pop() if queue else None
+
+    def process(window):
+        if window < 4:
+            queue.extend([window * 2, window * 2 + 1])
+            return SPLIT
+
+    report = WindowScheduler(concurrency=2).run(next_window, process)
+    assert report['split'] == 3
+    assert report['completed'] == 4
+
+
+def test_pipeline_counts_split_windows_apart():
+    windows = iter(range(6))
+
+    async def fetch(window):
+        return window
+
+    async def enrich(window, fetched):
+        return SPLIT if window == 2 else fetched
+
+    async def index(window, enriched):
+        if window == 4:
+            raise RuntimeError('boom')
+        return enriched
+
+    failed = []
+    pipeline = AsyncWindowPipeline(fetch_concurrency=2, enrich_concurrency=2, index_concurrency=2, queue_size=1)
+    report = asyncio.run(pipeline.run(lambda: next(windows, None), fetch, enrich, index,
+                                      on_error=lambda window, err: failed.append(window)))
+    assert (report['completed'], report['failed'], report['split']) == (4, 1, 1)
+    assert failed == [4]
+
+
+def test_token_bucket_allows_a_burst_then_waits():
+    bucket = TokenBucket(rate=1000, capacity=3)
+    assert [bucket._take(1) for _ in range(3)] == [0.0, 0.0, 0.0]
+    assert bucket._take(1) > 0
+
+
+def test_token_bucket_pause_empties_the_bucket():
+    bucket = TokenBucket(rate=1, capacity=5)
+    bucket.pause(60)
+    assert bucket._take(1) > 59
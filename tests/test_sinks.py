@@ -0,0 +1,119 @@
+# -*- coding: utf-8 -*-
+import glob
+import gzip
+import json
+import os
+
+import pytest
+
+from library import checkpoint
+from library.bulkindexer import BulkIndexer
+from library.sinks import PARTIAL_SUFFIX, FileSink, Sink, zstd_available
+
+
+def actions(day: str, count: int, start: int = 0) -> list:
+    return [BulkIndexer.action('cloudflare-' + day.replace('-', '.'), {'n': n, 'datetime': day}, f'{day}-{n}')
+            for n in range(start, start + count)]
+
+
+def read_parts(file_dir, pattern: str = '**/*.ndjson.gz') -> dict:
+    """ Relative path -> (action, source) pairs of every completed part """
+    parts = {}
+    for path in sorted(glob.glob(os.path.join(file_dir, pattern), recursive=True)):
+        with gzip.open(path, 'rt', encoding='utf-8') as part:
+            lines = part.read().splitlines()
+        parts[os.path.relpath(path, file_dir)] = list(zip(lines[::2], lines[1::2]))
+    return parts
+
+
+def new_summary() -> dict:
+    return {'written': 0}
+
+
+def test_documents_go_to_one_directory_per_zone_and_day(tmp_path):
+    sink = FileSink(str(tmp_path))
+    summary = new_summary()
+    sink.write(actions('2025-10-01', 3) + actions('2025-10-02', 2), summary, 'zone-a')
+    sink.write(actions('2025-10-01', 1), summary, 'zone-b')
+    assert sink.close()
+
+    assert summary['written'] == 6
+    parts = read_parts(tmp_path)
+    assert sorted(parts) == [os.path.join('zone-a', '2025-10-01', 'part-000001.ndjson.gz'),
+                             os.path.join('zone-a', '2025-10-02', 'part-000001.ndjson.gz'),
+                             os.path.join('zone-b', '2025-10-01', 'part-000001.ndjson.gz')]
+    assert parts[os.path.join('zone-a', '2025-10-01', 'part-000001.ndjson.gz')] == actions('2025-10-01', 3)
+    assert sink.window_status({'failed': 0}) == checkpoint.WRITTEN
+    assert not sink.overwrites
+
+
+def test_parts_are_rotated(tmp_path):
+    # a part is rotated once a batch of lines took it over rotate_bytes
+    sink = FileSink(str(tmp_path), rotate_bytes=1)
+    for n in range(3):
+        sink.write(actions('2025-10-01', 1, start=n), new_summary(), 'z')
+    sink.close()
+    parts = read_parts(tmp_path)
+    assert len(parts) == 3
+    assert sum(parts.values(), []) == actions('2025-10-01', 3)
+
+
+def test_least_recently_written_part_is_closed_first(tmp_path):
+    sink = FileSink(str(tmp_path), max_open=1)
+    sink.write(actions('2025-10-01', 1), new_summary(), 'z')
+    sink.write(actions('2025-10-02', 1), new_summary(), 'z')
+    assert len(read_parts(tmp_path)) == 1
+    sink.write(actions('2025-10-01', 1, start=1), new_summary(), 'z')
+    sink.close()
+    assert sorted(read_parts(tmp_path)) == [os.path.join('z', '2025-10-01', 'part-000001.ndjson.gz'),
+                                            os.path.join('z', '2025-10-01', 'part-000002.ndjson.gz'),
+                                            os.path.join('z', '2025-10-02', 'part-000001.ndjson.gz')]
+
+
+def test_synced_documents_are_recovered_after_a_crash(tmp_path):
+    sink = FileSink(str(tmp_path))
+    sink.write(actions('2025-10-01', 4), new_summary(), 'z')
+    sink.sync()
+    # never synced, lost with the process
+    sink.write(actions('2025-10-01', 1, start=4), new_summary(), 'z')
+    partial_paths = glob.glob(os.path.join(tmp_path, '**', '*' + PARTIAL_SUFFIX), recursive=True)
+    assert len(partial_paths) == 1
+
+    FileSink(str(tmp_path))
+    assert not glob.glob(os.path.join(tmp_path, '**', '*' + PARTIAL_SUFFIX), recursive=True)
+    assert read_parts(tmp_path) == {os.path.join('z', '2025-10-01', 'part-000001.ndjson.gz'): actions('2025-10-01', 4)}
+
+
+def test_a_sink_must_write():
+    class Incomplete(Sink):
+        pass
+
+    with pytest.raises(TypeError):
+        Incomplete()
+
+
+def test_zstd_is_probed_without_importing_it():
+    import sys
+
+    imported = 'zstandard' in sys.modules
+    zstd_available()
+    assert ('zstandard' in sys.modules) == imported
+
+
+def test_unknown_compression_is_refused(tmp_path):
+    with pytest.raises(ValueError):
+        FileSink(str(tmp_path), compression='lz4')
+
+
+@pytest.mark.skipif(not zstd_available(), reason='zstandard is not installed')
+def test_zstd_parts(tmp_path):
+    import zstandard
+
+    sink = FileSink(str(tmp_path), compression='zstd')
+    sink.write(actions('2025-10-01', 2), new_summary(), 'z')
+    sink.close()
+    (path,) = glob.glob(os.path.join(tmp_path, '**', '*.ndjson.zst'), recursive=True)
+    with open(path, 'rb') as part:
+        lines = zstandard.ZstdDecompressor().decompressobj().decompress(part.read()).decode().splitlines()
+    assert list(zip(lines[::2], lines[1::2])) == actions('2025-10-01', 2)
+    assert json.loads(lines[0])['index']['_id'] == '2025-10-01-0'
@@ -0,0 +1,132 @@
+# -*- coding: utf-8 -*-
+import json
+import os
+
+from library.bulkindexer import BulkIndexer
+from library.spool import DEAD_LETTER_FILE, QUARANTINE_SUFFIX, DiskSpool
+
+
+# a stand-in for the OpenSearch client: `statuses` are the item statuses of the next documents,
+# the documents numbered in `rejected` are always refused and `request_status` fails every `_bulk`
+# request as a whole
+class StubClient:
+    def __init__(self, statuses=(), request_status: int | None = None, rejected=()):
+        self.statuses = list(statuses)
+        self.request_status = request_status
+        self.rejected = set(rejected)
+        self.requests = 0
+        self.documents = []
+
+    def bulk(self, body: str) -> dict:
+        from opensearchpy.exceptions import TransportError
+
+        self.requests += 1
+        if self.request_status is not None:
+            raise TransportError(self.request_status, 'refused', {})
+        lines = body.splitlines()
+        items = []
+        for source_line in lines[1::2]:
+            status = self.statuses.pop(0) if self.statuses else 201
+            if json.loads(source_line)['n'] in self.rejected:
+                status = 400
+            if 200 <= status < 300:
+                self.documents.append(json.loads(source_line))
+            items.append({'index': {'status': status, 'error': None if status < 300 else 'mapper_parsing_exception'}})
+        return {'errors': any(item['index']['status'] >= 300 for item in items), 'items': items}
+
+
+def actions(count: int, start: int = 0) -> list:
+    return [BulkIndexer.action('cloudflare-2025.10.01', {'n': n, 'path': '/é'}, str(n))
+            for n in range(start, start + count)]
+
+
+def new_spool(spool_dir, client, **kwargs) -> DiskSpool:
+    indexer = BulkIndexer(client, max_retries=0, initial_backoff=0, raise_unavailable=True)
+    return DiskSpool(str(spool_dir), indexer, linger=0.01, initial_backoff=0.01, **kwargs)
+
+
+def dead_letters(spool_dir) -> list:
+    with open(os.path.join(spool_dir, DEAD_LETTER_FILE)) as dead_letter:
+        return [json.loads(line) for line in dead_letter]
+
+
+def test_documents_are_drained_and_segments_removed(tmp_path):
+    client = StubClient()
+    spool = new_spool(tmp_path, client, segment_bytes=200).start()
+    assert spool.append(actions(20)) == 20
+    assert spool.close(5)
+    assert sorted(document['n'] for document in client.documents) == list(range(20))
+    assert os.listdir(tmp_path) == []
+
+
+def test_leftover_segments_are_drained_on_the_next_start(tmp_path):
+    spool = new_spool(tmp_path, StubClient())
+    spool.append(actions(5))
+    spool.sync()
+    # the process dies before the drainer ran; a pair cut in half is never acknowledged
+    with open(os.path.join(tmp_path, spool.active_name), 'a') as segment:
+        segment.write('{"index": {"_index": "cloudflare-2025.10.01"}}\n{"n": ')
+
+    client = StubClient()
+    spool = new_spool(tmp_path, client).start()
+    assert spool.close(5)
+    assert sorted(document['n'] for document in client.documents) == list(range(5))
+
+
+def test_rejected_documents_are_dead_lettered_and_survive_a_restart(tmp_path):
+    spool = new_spool(tmp_path, StubClient(statuses=[400, 201, 201])).start()
+    spool.append(actions(3))
+    assert spool.close(5)
+    assert [record['source'] for record in dead_letters(tmp_path)] == [actions(1)[0][1]]
+
+    # the dead-letter file is neither a segment nor drained
+    client = StubClient()
+    spool = new_spool(tmp_path, client).start()
+    assert spool.pending()['segments'] == 0
+    assert spool.close(5)
+    assert client.requests == 0
+    assert len(dead_letters(tmp_path)) == 1
+
+
+def test_requests_refused_as_a_whole_are_dead_lettered(tmp_path):
+    spool = new_spool(tmp_path, StubClient(request_status=413)).start()
+    spool.append(actions(4))
+    assert spool.close(5)
+    records = dead_letters(tmp_path)
+    assert [json.loads(record['source'])['n'] for record in records] == [0, 1, 2, 3]
+    assert records[0]['error']['status'] == 413
+
+
+def test_auth_failures_keep_the_segment(tmp_path):
+    client = StubClient(request_status=401)
+    spool = new_spool(tmp_path, client).start()
+    spool.append(actions(2))
+    assert not spool.close(0.3)
+    assert client.requests > 1
+    assert not os.path.exists(os.path.join(tmp_path, DEAD_LETTER_FILE))
+    assert spool.pending()['segments'] == 1
+
+
+def test_a_segment_sent_again_after_an_outage_is_dead_lettered_once(tmp_path):
+    # the first document is rejected, the second one finds OpenSearch unavailable
+    client = StubClient(statuses=[400, 503], rejected=[0])
+    spool = new_spool(tmp_path, client).start()
+    spool.append(actions(2))
+    assert spool.close(5)
+    assert len(dead_letters(tmp_path)) == 1
+    assert [document['n'] for document in client.documents] == [1]
+    assert client.requests == 2
+    assert spool.pending()['unavailable'] == 1
+
+
+def test_a_segment_that_keeps_failing_is_quarantined(tmp_path):
+    # a corrupt action line cannot be dead-lettered
+    with open(os.path.join(tmp_path, '000000000001.segment'), 'w') as segment:
+        segment.write('not json\n{"n": 0}\n')
+    client = StubClient(statuses=[400, 400])
+    spool = new_spool(tmp_path, client, max_failures=2).start()
+    spool.append(actions(2, start=1))
+    assert spool.close(5)
+    assert sorted(document['n'] for document in client.documents) == [1, 2]
+    assert os.listdir(tmp_path) == ['000000000001.segment' + QUARANTINE_SUFFIX]
+    assert spool.pending()['quarantined'] == 1
@@ -0,0 +1,79 @@
+# -*- coding: utf-8 -*-
+import json
+
+import pytest
+
+from library.streamjson import SeriesStream
+
+ROWS = [{'count': i, 'dimensions': {'clientIP': f'1.2.3.{i}', 'clientRequestPath': '/café/series'}}
+        for i in range(50)]
+
+
+def chunked(document, size: int) -> list:
+    data = (document if isinstance(document, str) else json.dumps(document, ensure_ascii=False)).encode('utf-8')
+    return [data[i:i + size] for i in range(0, len(data), size)]
+
+
+def response(series, errors=None, **viewer) -> dict:
+    return {'data': {'viewer': {**viewer, 'zones': [{'series': series, '__typename': 'zone'}]}}, 'errors': errors}
+
+
+@pytest.mark.parametrize('size', [1, 7, 64, 1 << 20])
+def test_rows_are_decoded_across_chunk_boundaries(size):
+    stream = SeriesStream(chunked(response(ROWS), size))
+    assert list(stream) == ROWS
+    assert stream.found
+    assert stream.rows == len(ROWS)
+    assert stream.errors is None
+
+
+def test_members_before_the_series_are_skipped():
+    document = {'errors': None, 'data': {'viewer': {'__typename': 'viewer', 'zones': [
+        {'other': [1, 2.5, {'series': []}], 'series': ROWS}]}}}
+    stream = SeriesStream(chunked(document, 5))
+    assert list(stream) == ROWS
+
+
+def test_buffer_is_compacted_while_rows_are_handed_out():
+    stream = SeriesStream(chunked(response(ROWS), 100), compact_at=200)
+    assert list(stream) == ROWS
+
+
+def test_empty_series():
+    stream = SeriesStream(chunked(response([]), 3))
+    assert list(stream) == []
+    assert stream.found
+
+
+@pytest.mark.parametrize('document', [
+    {'data': None, 'errors': [{'message': 'bad', 'path': ['viewer', 'zones', 0, 'series']}]},
+    {'data': {'viewer': {'zones': [{'series': None}]}}, 'errors': [{'message': 'quota exceeded'}]},
+])
+def test_error_documents_mentioning_series_report_their_errors(document):
+    stream = SeriesStream(chunked(document, 4))
+    assert list(stream) == []
+    assert not stream.found
+    assert stream.errors == document['errors']
+
+
+def test_errors_after_the_series_are_reported():
+    stream = SeriesStream(chunked(response(ROWS[:3], errors=[{'message': 'partial'}]), 9))
+    assert len(list(stream)) == 3
+    assert stream.errors == [{'message': 'partial'}]
+
+
+def test_no_zones():
+    stream = SeriesStream(chunked({'data': {'viewer': {'zones': []}}, 'errors': None}, 4))
+    assert list(stream) == []
+    assert not stream.found
+
+
+def test_malformed_body_raises():
+    with pytest.raises(json.JSONDecodeError):
+        list(SeriesStream(chunked('{"data": {oops', 3)))
+
+
+def test_truncated_series_raises():
+    body = json.dumps(response(ROWS))
+    with pytest.raises(json.JSONDecodeError):
+        list(SeriesStream(chunked(body[:len(body) // 2], 16)))
@@ -0,0 +1,42 @@
+# -*- coding: utf-8 -*-
+from datetime import datetime, timedelta
+
+from library.windows import AdaptiveWindowPlanner, Window, iter_windows
+
+START = datetime(2025, 10, 1)
+
+
+def test_iter_windows_clips_the_last_window():
+    windows = list(iter_windows(START, START + timedelta(minutes=150), timedelta(hours=1)))
+    assert [window.end - window.start for window in windows] == [timedelta(hours=1)] * 2 + [timedelta(minutes=30)]
+
+
+def test_truncated_window_is_split_and_earlier_half_comes_first():
+    planner = AdaptiveWindowPlanner(START, START + timedelta(hours=12), span=timedelta(hours=6), row_limit=100)
+    window = planner.next_window()
+    assert not planner.record(window, 100)
+    assert planner.next_window() == Window(START, START + timedelta(hours=3))
+    assert planner.next_window() == Window(START + timedelta(hours=3), START + timedelta(hours=6))
+    # the span of the next windows shrinks to the half
+    assert planner.next_window() == Window(START + timedelta(hours=6), START + timedelta(hours=9))
+
+
+def test_window_at_the_minimum_span_is_kept():
+    planner = AdaptiveWindowPlanner(START, START + timedelta(hours=1), span=timedelta(minutes=1), row_limit=100,
+                                    min_span=timedelta(minutes=1))
+    assert planner.record(planner.next_window(), 500)
+
+
+def test_sparse_windows_widen_the_span_up_to_the_maximum():
+    planner = AdaptiveWindowPlanner(START, START + timedelta(days=3), span=timedelta(hours=6), row_limit=100,
+                                    max_span=timedelta(hours=12))
+    for _ in range(3):
+        assert planner.record(planner.next_window(), 1)
+    assert planner.span == timedelta(hours=12)
+
+
+def test_halves_stay_on_whole_minutes():
+    planner = AdaptiveWindowPlanner(START, START + timedelta(minutes=3), span=timedelta(minutes=3), row_limit=100)
+    assert not planner.record(planner.next_window(), 100)
+    assert planner.next_window() == Window(START, START + timedelta(minutes=1))
+    assert planner.next_window() == Window(START + timedelta(minutes=1), START + timedelta(minutes=3))
@@ -0,0 +1,52 @@
+# -*- coding: utf-8 -*-
+import json
+
+import pytest
+
+from library.zones import ZoneConfig, load_zones
+
+DEFAULT = ZoneConfig('zone0', account='account0', name='main', index_prefix='cloudflare-requests-', api_token='t0')
+
+
+def test_an_empty_list_is_the_default_zone():
+    assert load_zones(None, DEFAULT) == [DEFAULT]
+    assert load_zones(' ', DEFAULT) == [DEFAULT]
+    assert load_zones('', ZoneConfig('')) == []
+
+
+def test_missing_settings_come_from_the_default():
+    zones = load_zones('[{"zone": "z1"}, {"zone": "z2", "account": "a2", "name": "shop", '
+                       '"include_premium_fields": "true", "index_prefix": "shop-", "api_token": "t2"}]', DEFAULT)
+    # the default zone's name is not inherited, the zone tag labels it instead
+    assert zones[0] == DEFAULT._replace(zone='z1', name=None)
+    assert zones[0].label == 'z1'
+    assert zones[1] == ZoneConfig('z2', 'a2', 'shop', True, 'shop-', 't2')
+    assert zones[1].label == 'shop'
+
+
+@pytest.mark.parametrize('value, expected', [('true', True), ('1', True), ('YES', True), ('false', False),
+                                             (True, True), (0, False)])
+def test_premium_fields_flag(value, expected):
+    zones = load_zones(json.dumps([{'zone': 'z1', 'include_premium_fields': value}]), DEFAULT)
+    assert zones[0].include_premium_fields is expected
+
+
+def test_zones_are_read_from_a_file(tmp_path):
+    path = tmp_path / 'zones.json'
+    path.write_text('[{"zone": "z1"}]')
+    assert [zone.zone for zone in load_zones(str(path), DEFAULT)] == ['z1']
+    path.write_text('{"zone": "z1"}')
+    with pytest.raises(ValueError, match='JSON array'):
+        load_zones(str(path), DEFAULT)
+
+
+@pytest.mark.parametrize('value, message', [
+    ('[{"account": "a1"}]', 'needs a `zone`'),
+    ('["z1"]', 'needs a `zone`'),
+    ('[{"zone": "z1", "prefix": "x-"}]', 'Unknown zone setting'),
+    ('[{"zone": "z1"}, {"zone": "z1"}]', 'Duplicate zone'),
+    ('[{"zone": "z1", "name": "shop"}, {"zone": "z2", "name": "shop"}]', 'Duplicate zone'),
+])
+def test_invalid_zone_lists_are_refused(value, message):
+    with pytest.raises(ValueError, match=message):
+        load_zones(value, DEFAULT)